@@ -1,9 +1,16 @@
 from flask import Flask
-from elasticsearch import Elasticsearch
 
 from coco.settings import config
+from coco.cache import create_cache_backend
 from coco.const import init_const
+from coco.count_cache import CountCache
 from coco.extensions import db, login_manager, migrate
+from coco.model_cache import ModelCache
+from coco.response_cache import ResponseCache
+from coco.result_cache import ResultCache
+from coco.search import init_search_backend, create_client
+from coco.unit_of_work import register_unit_of_work
+from coco.view_counter import ViewCounter
 
 
 def create_app(env):
@@ -33,8 +40,18 @@ def register_extensions(app):
     login_manager.init_app(app)
     migrate.init_app(app, db)
 
-    elasticsearch_url = app.config['ELASTICSEARCH_URL']
-    setattr(app, 'elasticsearch', Elasticsearch([elasticsearch_url]) if elasticsearch_url else None)
+    setattr(app, 'elasticsearch', create_client(app))
+    setattr(app, 'cache_backend', create_cache_backend(app))
+    setattr(app, 'count_cache', CountCache.from_app(app))
+    setattr(app, 'result_cache', ResultCache.from_app(app))
+    setattr(app, 'model_cache', ModelCache.from_app(app))
+    setattr(app, 'response_cache', ResponseCache.from_app(app) if app.config['RESPONSE_CACHE'] else None)
+    init_search_backend(app)
+
+    from .models.article import Article
+    setattr(app, 'view_counter', ViewCounter.from_app(app, Article.__table__))
+    if app.config['REQUEST_UNIT_OF_WORK']:
+        register_unit_of_work(app)
 
     from .models.auth_user import AuthUser, AnonymousUser
     login_manager.session_protection = 'basic'
@@ -42,7 +59,7 @@ def register_extensions(app):
 
     @login_manager.user_loader
     def load_user(user_id):
-        return AuthUser.get_by_id(int(user_id))
+        return AuthUser.get_by_id(int(user_id), cached=True)
 
 
 def register_blueprints(app):
@@ -103,3 +120,8 @@ def register_commands(app):
     from coco import commands
     app.cli.add_command(commands.test)
     app.cli.add_command(commands.create_super_admin)
+    app.cli.add_command(commands.reindex)
+    app.cli.add_command(commands.reconcile)
+    app.cli.add_command(commands.refresh_counts)
+    app.cli.add_command(commands.bench_search)
+    app.cli.add_command(commands.bench_read)
@@ -1,4 +1,37 @@
-from flask import Blueprint
+from flask import Blueprint, current_app
+from flask_login import login_required
+
+from coco.utils.json_util import gen_success_json
+from coco.utils.other_utils import permission_required
+from coco.models.auth_user import UserGroupPermission
 
 
 blueprint = Blueprint('admin_website_config', __name__)
+
+
+@blueprint.route('/search/status', methods=['GET'])
+@login_required
+@permission_required(UserGroupPermission.All)
+def search_status():
+    """搜索后端的运行状态，Elasticsearch 后端包含熔断器状态、请求耗时和待发送的索引操作数"""
+    backend = current_app.search_backend
+    data = {
+        'backend': current_app.config['SEARCH_BACKEND'],
+        'status': backend.status() if backend is not None else None
+    }
+    return gen_success_json(data)
+
+
+@blueprint.route('/cache/status', methods=['GET'])
+@login_required
+@permission_required(UserGroupPermission.All)
+def cache_status():
+    """缓存后端的状态，以及本进程模型查询缓存和响应缓存的命中、未命中次数"""
+    response_cache = current_app.response_cache
+    data = {
+        'backend': current_app.config['CACHE_BACKEND'],
+        'status': current_app.cache_backend.stats(),
+        'modelCache': current_app.model_cache.stats(),
+        'responseCache': response_cache.stats() if response_cache is not None else None
+    }
+    return gen_success_json(data)
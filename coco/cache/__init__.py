@@ -0,0 +1,19 @@
+from .base import CacheBackend, encode_key
+from .bus import InvalidationBus
+from .local import LocalCache
+from .remote import RedisCache
+from .shm import SharedMemoryCache
+
+
+CACHE_BACKENDS = {
+    'local': LocalCache,
+    'shm': SharedMemoryCache,
+    'redis': RedisCache,
+}
+
+
+def create_cache_backend(app):
+    backend = CACHE_BACKENDS[app.config['CACHE_BACKEND']].from_app(app)
+    if app.config['CACHE_INVALIDATION_BUS']:
+        backend = InvalidationBus.from_app(app, backend)
+    return backend
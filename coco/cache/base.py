@@ -0,0 +1,55 @@
+import abc
+import hashlib
+
+
+def encode_key(key):
+    """把任意可 repr 的键转换为定长的 16 字节摘要，共享内存和网络后端用它作为键"""
+    return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).digest()
+
+
+class CacheBackend(abc.ABC):
+    """缓存后端
+
+    count_cache、result_cache 和 model_cache 通过当前应用的缓存后端保存结果。
+    值为可以 pickle 的对象；失效通过版本号完成：缓存的值记录写入时依赖的版本号，
+    读取时与当前版本号比较，不一致则视为未命中，修改数据后调用 incr_version。
+    """
+
+    @classmethod
+    def from_app(cls, app):
+        return cls()
+
+    @abc.abstractmethod
+    def get(self, key):
+        """返回缓存的值，不存在或已过期时返回 None"""
+        pass
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl):
+        """保存 ttl 秒；值太大无法保存时返回 False"""
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key):
+        pass
+
+    @abc.abstractmethod
+    def get_version(self, name):
+        pass
+
+    @abc.abstractmethod
+    def incr_version(self, name):
+        """版本号加一，依赖它的缓存值全部失效"""
+        pass
+
+    def incr_versions(self, names):
+        """一次增加多个版本号，返回新的版本号列表"""
+        return [self.incr_version(name) for name in names]
+
+    def clear(self):
+        """清空缓存的值，可能漏掉失效通知时调用；所有机器共享的后端不需要清空"""
+        pass
+
+    def stats(self):
+        """运行状态，用于监控"""
+        return {}
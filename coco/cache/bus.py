@@ -0,0 +1,209 @@
+import atexit
+import json
+import os
+import re
+import select
+import socket
+import threading
+
+from sqlalchemy import text
+
+from .base import CacheBackend
+
+
+# PostgreSQL 通知内容的上限是 8000 字节，超过时拆成多条
+MAX_PAYLOAD = 7900
+
+
+class InvalidationBus(CacheBackend):
+    """通过 PostgreSQL LISTEN/NOTIFY 在进程和机器之间广播失效的缓存后端包装
+
+    读写直接交给被包装的后端；incr_version 在本进程生效后，用 pg_notify 把版本号名称发送到 channel，
+    每个进程的后台线程 LISTEN 这个 channel，收到其它进程的通知后增加本地对应的版本号，
+    local 后端和多台机器各自的 shm 后端因此在提交后立即失效，不需要依赖 TTL。
+    进程之间的版本号各不相同，通知只包含名称，接收方把自己的版本号加一。
+    监听连接断开期间可能漏掉通知，重新连接后清空本地缓存。
+    """
+
+    def __init__(self, backend, get_engine, channel='coco_cache', poll_interval=1.0,
+                 reconnect_interval=5.0, logger=None):
+        if not re.fullmatch(r'[a-z_][a-z0-9_]*', channel):
+            raise ValueError(f'Invalid channel name: {channel}')
+        self.backend = backend
+        self.get_engine = get_engine
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.reconnect_interval = reconnect_interval
+        self.logger = logger
+        self.host = socket.gethostname()
+        self.published = 0
+        self.received = 0
+        self.reconnects = 0
+        self.errors = 0
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @classmethod
+    def from_app(cls, app, backend):
+        from coco.extensions import db
+
+        bus = cls(
+            backend,
+            lambda: db.get_engine(app),
+            channel=app.config['CACHE_INVALIDATION_CHANNEL'],
+            reconnect_interval=app.config['CACHE_INVALIDATION_RECONNECT_INTERVAL'],
+            logger=app.logger,
+        )
+        # 在请求中启动监听线程，gunicorn preload 时 fork 出的 worker 也会各自启动
+        app.before_request(bus.ensure_listening)
+        atexit.register(bus.close)
+        return bus
+
+    @property
+    def sender(self):
+        # fork 之后 pid 变化，每个 worker 有自己的标识
+        return f'{self.host}:{os.getpid()}'
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl):
+        return self.backend.set(key, value, ttl)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def get_version(self, name):
+        return self.backend.get_version(name)
+
+    def incr_version(self, name):
+        return self.incr_versions([name])[0]
+
+    def incr_versions(self, names):
+        versions = self.backend.incr_versions(names)
+        self.publish(names)
+        return versions
+
+    def clear(self):
+        self.backend.clear()
+
+    def payloads(self, names):
+        """把版本号名称编码为不超过 MAX_PAYLOAD 字节的若干条通知"""
+        payloads, batch = [], []
+        for name in names:
+            payload = json.dumps({'sender': self.sender, 'versions': batch + [name]}, ensure_ascii=False)
+            if batch and len(payload.encode('utf-8')) > MAX_PAYLOAD:
+                payloads.append(json.dumps({'sender': self.sender, 'versions': batch}, ensure_ascii=False))
+                batch = []
+            batch.append(name)
+        if batch:
+            payloads.append(json.dumps({'sender': self.sender, 'versions': batch}, ensure_ascii=False))
+        return payloads
+
+    def publish(self, names):
+        """发送失败时只记录日志，其它进程的缓存在 TTL 后过期"""
+        try:
+            # pg_notify 在事务提交时才发送
+            with self.get_engine().begin() as connection:
+                for payload in self.payloads(names):
+                    connection.execute(
+                        text('SELECT pg_notify(:channel, :payload)'),
+                        channel=self.channel, payload=payload
+                    )
+        except Exception as e:
+            self._failed(f'Failed to publish cache invalidation: {e}')
+            return
+        with self._lock:
+            self.published += len(names)
+
+    def apply(self, payload):
+        """处理收到的一条通知，忽略本进程发出的通知和无法解析的内容"""
+        try:
+            message = json.loads(payload)
+            sender, names = message['sender'], message['versions']
+        except (ValueError, KeyError, TypeError):
+            self._failed(f'Invalid cache invalidation payload: {payload!r}')
+            return
+        if sender == self.sender:
+            return
+        self.backend.incr_versions(names)
+        with self._lock:
+            self.received += len(names)
+
+    def ensure_listening(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._closed.is_set() or (self._pid == os.getpid() and self._thread.is_alive()):
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='cache-invalidation-bus', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(self.poll_interval * 2)
+
+    def _failed(self, message):
+        with self._lock:
+            self.errors += 1
+        if self.logger:
+            self.logger.warning(message)
+
+    def _run(self):
+        connected = False
+        while not self._closed.is_set():
+            try:
+                connection = self.get_engine().raw_connection()
+            except Exception as e:
+                self._failed(f'Cache invalidation listener cannot connect: {e}')
+                self._closed.wait(self.reconnect_interval)
+                continue
+            try:
+                # 监听连接长期占用，不放回连接池
+                connection.detach()
+                if connected:
+                    # 断开期间可能漏掉了通知
+                    self.reconnects += 1
+                    self.backend.clear()
+                connected = True
+                self._listen(connection.connection)
+            except Exception as e:
+                self._failed(f'Cache invalidation listener disconnected: {e}')
+                self._closed.wait(self.reconnect_interval)
+            finally:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def _listen(self, connection):
+        # 从连接池取出的连接可能还有未结束的事务（如方言初始化时的查询），
+        # 事务中不能切换 autocommit，先结束该事务
+        connection.rollback()
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel}')
+        while not self._closed.is_set():
+            if select.select([connection], [], [], self.poll_interval) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                self.apply(connection.notifies.pop(0).payload)
+
+    def stats(self):
+        stats = dict(self.backend.stats())
+        with self._lock:
+            stats['bus'] = {
+                'channel': self.channel,
+                'listening': self._thread is not None and self._pid == os.getpid() and self._thread.is_alive(),
+                'published': self.published,
+                'received': self.received,
+                'reconnects': self.reconnects,
+                'errors': self.errors,
+            }
+        return stats
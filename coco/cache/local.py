@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from .base import CacheBackend
+
+
+class LocalCache(CacheBackend):
+    """进程内的 LRU 缓存
+
+    默认的后端，单进程部署和测试使用，也在测试中代替网络后端。
+    值直接保存对象本身，不做序列化；每个进程各自预热和失效。
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config['CACHE_LOCAL_MAX_SIZE'])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_version(self, name):
+        with self._lock:
+            return self._versions[name]
+
+    def incr_version(self, name):
+        with self._lock:
+            self._versions[name] += 1
+            return self._versions[name]
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxSize': self.max_size, 'evictions': self.evictions}
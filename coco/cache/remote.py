@@ -0,0 +1,85 @@
+import logging
+import pickle
+
+from .base import CacheBackend, encode_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class RedisCache(CacheBackend):
+    """多台机器共享的网络缓存，需要安装 redis 包
+
+    Redis 不可用时读取视为未命中、写入被忽略，不影响请求；
+    get_version 失败时返回 -1，与任何已保存的版本号都不相等，因此不会读到旧数据。
+    """
+
+    def __init__(self, client, prefix='coco:'):
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+        # redis 包是可选依赖，只有使用这个后端时才导入
+        from redis import RedisError
+        self._error = RedisError
+
+    @classmethod
+    def from_app(cls, app):
+        import redis
+
+        client = redis.Redis.from_url(
+            app.config['CACHE_REDIS_URL'],
+            socket_timeout=app.config['CACHE_REDIS_TIMEOUT'],
+            socket_connect_timeout=app.config['CACHE_REDIS_TIMEOUT'],
+        )
+        return cls(client, app.config['CACHE_REDIS_PREFIX'])
+
+    def _key(self, key):
+        return self.prefix.encode('utf-8') + encode_key(key)
+
+    def _version_key(self, name):
+        return f'{self.prefix}version:{name}'
+
+    def _failed(self, e):
+        self.errors += 1
+        logger.warning(f'Redis cache unavailable: {e}')
+
+    def get(self, key):
+        try:
+            data = self.client.get(self._key(key))
+        except self._error as e:
+            self._failed(e)
+            return None
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        try:
+            self.client.set(self._key(key), data, px=max(int(ttl * 1000), 1))
+        except self._error as e:
+            self._failed(e)
+            return False
+        return True
+
+    def delete(self, key):
+        try:
+            self.client.delete(self._key(key))
+        except self._error as e:
+            self._failed(e)
+
+    def get_version(self, name):
+        try:
+            return int(self.client.get(self._version_key(name)) or 0)
+        except self._error as e:
+            self._failed(e)
+            return -1
+
+    def incr_version(self, name):
+        try:
+            return self.client.incr(self._version_key(name))
+        except self._error as e:
+            # 失效没有送达时，缓存的值最多在 ttl 秒后过期
+            self._failed(e)
+            return None
+
+    def stats(self):
+        return {'prefix': self.prefix, 'errors': self.errors}
@@ -0,0 +1,187 @@
+import fcntl
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from .base import CacheBackend, encode_key
+
+
+MAGIC = b'COCOSHM1'
+# 文件头：标识、槽数、每个槽的字节数、版本号个数
+_HEADER = struct.Struct('<8sIII')
+_HEADER_SIZE = 64
+# 槽头：键摘要的前 8 字节（0 表示空槽）、过期时间、键长度、值长度
+_SLOT = struct.Struct('<QdII')
+_VERSION = struct.Struct('<Q')
+# 每个键可以放在同一组的两个槽中的任意一个
+WAYS = 2
+
+
+class SharedMemoryCache(CacheBackend):
+    """同一台机器上所有 worker 进程共享的缓存
+
+    数据保存在 mmap 映射的文件中（默认在 /dev/shm），文件分为固定数量、固定大小的槽，
+    键的摘要决定它所在的组，每组 WAYS 个槽，组满时淘汰最早过期的槽。
+    版本号保存在单独的区域，名称按摘要映射到固定的位置，两个名称映射到同一位置时
+    只会让对方多失效一次，不会读到旧数据。
+    进程之间用 fcntl 对组所在的字节范围加锁，同一进程的线程之间用 threading.Lock。
+    序列化后超过槽大小的值不缓存。
+    """
+
+    def __init__(self, path, slots=8192, slot_size=8192, version_slots=4096):
+        self.path = path
+        self.slots = slots - slots % WAYS
+        self.slot_size = slot_size
+        self.version_slots = version_slots
+        self._versions_offset = _HEADER_SIZE
+        self._slots_offset = _HEADER_SIZE + version_slots * _VERSION.size
+        size = self._slots_offset + self.slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            self._init_file(size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._mmap = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.too_large = 0
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(
+            app.config['CACHE_SHM_PATH'],
+            slots=app.config['CACHE_SHM_SLOTS'],
+            slot_size=app.config['CACHE_SHM_SLOT_SIZE'],
+            version_slots=app.config['CACHE_SHM_VERSION_SLOTS'],
+        )
+
+    def _init_file(self, size):
+        header = _HEADER.pack(MAGIC, self.slots, self.slot_size, self.version_slots)
+        current = os.pread(self._fd, _HEADER.size, 0)
+        if current == header and os.fstat(self._fd).st_size == size:
+            return
+        if current[:len(MAGIC)] == MAGIC:
+            # 其它进程可能正在使用旧的布局，不能直接改写
+            raise ValueError(f'Shared cache {self.path} was created with different settings, remove it first')
+        os.ftruncate(self._fd, size)
+        os.pwrite(self._fd, header, 0)
+
+    @contextmanager
+    def _locked(self, offset, length, shared=False):
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, length, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset)
+
+    def _locate(self, key):
+        digest = encode_key(key)
+        key_hash = int.from_bytes(digest[:8], 'little') or 1
+        group = key_hash % (self.slots // WAYS)
+        return digest, key_hash, self._slots_offset + group * WAYS * self.slot_size
+
+    def _find(self, offset, key_hash, digest):
+        for way in range(WAYS):
+            slot = offset + way * self.slot_size
+            slot_hash, expires, key_len, value_len = _SLOT.unpack_from(self._mmap, slot)
+            start = slot + _SLOT.size
+            if slot_hash == key_hash and self._mmap[start:start + key_len] == digest:
+                return slot, expires, value_len
+        return None, 0, 0
+
+    def get(self, key):
+        digest, key_hash, offset = self._locate(key)
+        with self._locked(offset, WAYS * self.slot_size, shared=True):
+            slot, expires, value_len = self._find(offset, key_hash, digest)
+            if slot is None or expires < time.time():
+                return None
+            start = slot + _SLOT.size + len(digest)
+            data = self._mmap[start:start + value_len]
+        return pickle.loads(data)
+
+    def set(self, key, value, ttl):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        digest, key_hash, offset = self._locate(key)
+        if _SLOT.size + len(digest) + len(data) > self.slot_size:
+            self.too_large += 1
+            return False
+        now = time.time()
+        with self._locked(offset, WAYS * self.slot_size):
+            slot = self._find(offset, key_hash, digest)[0]
+            if slot is None:
+                slot = self._choose_slot(offset, now)
+            _SLOT.pack_into(self._mmap, slot, key_hash, now + ttl, len(digest), len(data))
+            start = slot + _SLOT.size
+            self._mmap[start:start + len(digest)] = digest
+            self._mmap[start + len(digest):start + len(digest) + len(data)] = data
+        return True
+
+    def _choose_slot(self, offset, now):
+        """优先使用空槽或已过期的槽，否则淘汰最早过期的槽"""
+        victim, victim_expires = None, None
+        for way in range(WAYS):
+            slot = offset + way * self.slot_size
+            slot_hash, expires = _SLOT.unpack_from(self._mmap, slot)[:2]
+            if slot_hash == 0 or expires < now:
+                return slot
+            if victim is None or expires < victim_expires:
+                victim, victim_expires = slot, expires
+        self.evictions += 1
+        return victim
+
+    def delete(self, key):
+        digest, key_hash, offset = self._locate(key)
+        with self._locked(offset, WAYS * self.slot_size):
+            slot = self._find(offset, key_hash, digest)[0]
+            if slot is not None:
+                _SLOT.pack_into(self._mmap, slot, 0, 0, 0, 0)
+
+    def clear(self):
+        for group in range(self.slots // WAYS):
+            offset = self._slots_offset + group * WAYS * self.slot_size
+            with self._locked(offset, WAYS * self.slot_size):
+                for way in range(WAYS):
+                    _SLOT.pack_into(self._mmap, offset + way * self.slot_size, 0, 0, 0, 0)
+
+    def _version_offset(self, name):
+        index = int.from_bytes(encode_key(('version', name))[:8], 'little') % self.version_slots
+        return self._versions_offset + index * _VERSION.size
+
+    def get_version(self, name):
+        offset = self._version_offset(name)
+        with self._locked(offset, _VERSION.size, shared=True):
+            return _VERSION.unpack_from(self._mmap, offset)[0]
+
+    def incr_version(self, name):
+        offset = self._version_offset(name)
+        with self._locked(offset, _VERSION.size):
+            version = _VERSION.unpack_from(self._mmap, offset)[0] + 1
+            _VERSION.pack_into(self._mmap, offset, version)
+        return version
+
+    def stats(self):
+        now = time.time()
+        used = 0
+        for index in range(self.slots):
+            slot_hash, expires = _SLOT.unpack_from(self._mmap, self._slots_offset + index * self.slot_size)[:2]
+            if slot_hash and expires >= now:
+                used += 1
+        # evictions 和 tooLarge 是本进程的计数
+        return {
+            'path': self.path,
+            'slots': self.slots,
+            'slotSize': self.slot_size,
+            'used': used,
+            'evictions': self.evictions,
+            'tooLarge': self.too_large,
+        }
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
@@ -123,3 +123,174 @@ def create_super_admin():
     stderr_print('创建成功')
 
 
+@click.command()
+@click.option('--model', 'tablename', default='article', help='要重建索引的表名')
+@click.option('--workers', default=4, type=int, help='并行导入的进程数')
+@click.option('--chunk-size', default=500, type=int, help='每批读取和写入的记录数')
+def reindex(tablename, workers, chunk_size):
+    """重建搜索索引
+    Elasticsearch 后端在新索引中重建，完成后原子地切换别名，重建期间搜索不受影响；
+    PostgreSQL 后端分批重新计算 tsvector 列。
+    调用命令：flask reindex --workers=4
+    """
+    from .models.mixin import SearchableMixin
+
+    app = create_app(get_env())
+    app.app_context().push()
+
+    if not app.search_backend:
+        stderr_print('未启用搜索后端')
+        return
+    model = SearchableMixin.get_searchable_model(tablename)
+    index, count = model.reindex(workers=workers, chunk_size=chunk_size)
+    stderr_print(f'已为 {index} 写入 {count} 条记录')
+
+
+@click.command()
+@click.option('--model', 'tablename', default='article', help='要对账的表名')
+@click.option('--chunk-size', default=500, type=int, help='每批读取和写入的记录数')
+@click.option('--loop', is_flag=True, help='按 SEARCH_RECONCILE_INTERVAL 的间隔持续运行')
+def reconcile(tablename, chunk_size, loop):
+    """把上次对账以来修改和软删除的记录同步到搜索索引，修复提交钩子遗漏的变更
+    调用命令：flask reconcile --loop
+    """
+    import time
+    from .extensions import db
+    from .models.mixin import SearchableMixin
+
+    app = create_app(get_env())
+    app.app_context().push()
+
+    if not app.search_backend:
+        stderr_print('未启用搜索后端')
+        return
+    model = SearchableMixin.get_searchable_model(tablename)
+    overlap = app.config['SEARCH_RECONCILE_OVERLAP']
+    while True:
+        try:
+            since, count = model.reconcile(overlap=overlap, chunk_size=chunk_size)
+        except Exception as e:
+            db.session.rollback()
+            if not loop:
+                raise
+            app.logger.error(f'Search reconcile failed: {e}')
+        else:
+            stderr_print(f'已同步 {since:%Y-%m-%d %H:%M:%S} 之后修改的 {count} 条记录')
+        if not loop:
+            return
+        time.sleep(app.config['SEARCH_RECONCILE_INTERVAL'])
+
+
+@click.command()
+def refresh_counts():
+    """按文章表重新统计分类和标签的文章数
+    调用命令：flask refresh-counts
+    """
+    from .models.article import Article
+
+    app = create_app(get_env())
+    app.app_context().push()
+
+    Article.refresh_counts()
+    stderr_print('已重新统计分类和标签的文章数')
+
+
+@click.command()
+@click.option('--repeat', default=200, type=int, help='每个读取方式执行的次数')
+@click.option('--page-size', default=None, type=int, help='列表每页的文章数，默认与接口一致')
+def bench_read(repeat, page_size):
+    """比较文章列表和详情通过模型实例与直接读取行两种方式的 CPU 耗时
+    调用命令：flask bench-read --repeat=200
+    """
+    import time
+    from .const import Constant
+    from .extensions import db
+    from .models.article import Article
+
+    app = create_app(get_env())
+    app.app_context().push()
+
+    page_size = page_size or Constant.ARTICLE_PAGE_SIZE
+    article = Article.list_query().filter_by(deleted=False).first()
+    if article is None:
+        stderr_print('没有文章，无法测试')
+        return
+    slug = article.slug
+
+    def orm_list():
+        items = Article.paginate(deleted=False, order='desc', per_page=page_size, count=None).items
+        return [item.to_summary_dict() for item in items]
+
+    def row_list():
+        items = Article.paginate(deleted=False, order='desc', per_page=page_size, count=None, rows=True).items
+        return Article.rows_to_summary_dicts(items)
+
+    def orm_detail():
+        return Article.get_by_slug(slug, deleted=False).to_dict()
+
+    def row_detail():
+        return Article.row_to_dict(Article.get_row_by_slug(slug, deleted=False))
+
+    cases = [
+        ('list', 'orm', orm_list), ('list', 'rows', row_list),
+        ('detail', 'orm', orm_detail), ('detail', 'rows', row_detail),
+    ]
+    results = {}
+    for endpoint, name, func in cases:
+        func()
+        db.session.remove()
+        cpu = wall = 0
+        for _ in range(repeat):
+            start_cpu, start_wall = time.process_time(), time.perf_counter()
+            func()
+            cpu += time.process_time() - start_cpu
+            wall += time.perf_counter() - start_wall
+            # 每次模拟一个新请求，模型实例不能复用上一次的 identity map
+            db.session.remove()
+        results[endpoint, name] = cpu / repeat * 1000
+        print(f'{endpoint:<8} {name:<6} cpu={cpu / repeat * 1000:.3f}ms wall={wall / repeat * 1000:.3f}ms')
+    for endpoint in ('list', 'detail'):
+        orm, rows = results[endpoint, 'orm'], results[endpoint, 'rows']
+        print(f'{endpoint:<8} 每次请求节省 CPU {orm - rows:.3f}ms ({(1 - rows / orm) * 100 if orm else 0:.0f}%)')
+
+
+@click.command()
+@click.option('--query', 'queries', multiple=True, default=['房子', 'Python'], help='查询词，可以指定多个')
+@click.option('--backend', 'backends', multiple=True, default=['local', 'postgres', 'elasticsearch'],
+              help='要比较的搜索后端，可以指定多个')
+@click.option('--repeat', default=100, type=int, help='每个查询执行的次数')
+@click.option('--rebuild', is_flag=True, help='测试前重建各后端的索引')
+@click.option('--model', 'tablename', default='article', help='要查询的表名')
+def bench_search(queries, backends, repeat, rebuild, tablename):
+    """比较各搜索后端查询一页结果的耗时
+    调用命令：flask bench-search --query=房子 --repeat=100 --rebuild
+    """
+    import time
+    from .const import Constant
+    from .search import BACKENDS
+    from .models.mixin import SearchableMixin
+
+    app = create_app(get_env())
+    app.app_context().push()
+
+    model = SearchableMixin.get_searchable_model(tablename)
+    page_size = Constant.ARTICLE_PAGE_SIZE
+    for name in backends:
+        backend = BACKENDS[name].from_app(app)
+        if backend is None:
+            print(f'{name}: 未配置，跳过')
+            continue
+        if rebuild:
+            _, count = backend.rebuild(model)
+            print(f'{name}: 已重建 {count} 条记录')
+        for query in queries:
+            timings = []
+            total = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                total = backend.query_ids(model, query, 1, page_size).total
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            mean = sum(timings) / len(timings)
+            p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+            print(f'{name:<14} {query:<12} total={total:<6} mean={mean:.2f}ms p95={p95:.2f}ms')
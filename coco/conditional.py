@@ -0,0 +1,46 @@
+import hashlib
+from collections import namedtuple
+
+from flask import current_app, request
+
+from coco.extensions import db
+
+
+# etag 为弱校验值；last_modified 为 UTC 时间，表中没有行时为 None
+Validators = namedtuple('Validators', ['etag', 'last_modified'])
+
+
+def probe(models):
+    """由各模型表的 max(updated_time) 生成当前请求的校验值，只执行一次查询
+
+    updated_time 有索引时只读取索引的一端。浏览数等不经过 ORM 的 UPDATE 不修改 updated_time，
+    不会改变校验值；硬删除的行无法发现，只能等其它修改或 ETAG_SALT 变化。
+    """
+    times = db.session.query(
+        *[db.session.query(db.func.max(model.updated_time)).as_scalar() for model in models]
+    ).one()
+    seed = repr((current_app.config['ETAG_SALT'], request.path, request.query_string, tuple(times)))
+    etag = hashlib.blake2b(seed.encode('utf-8'), digest_size=12).hexdigest()
+    last_modified = max((time for time in times if time is not None), default=None)
+    return Validators(etag, last_modified)
+
+
+def is_not_modified(validators):
+    """请求的条件是否满足，同时带有两种条件时只看 If-None-Match"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(validators.etag)
+    if request.if_modified_since is not None and validators.last_modified is not None:
+        # HTTP 日期只精确到秒
+        return validators.last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def set_validators(response, validators):
+    response.set_etag(validators.etag, weak=True)
+    if validators.last_modified is not None:
+        response.last_modified = validators.last_modified
+    return response
+
+
+def not_modified_response(validators):
+    return set_validators(current_app.response_class(status=304), validators)
@@ -0,0 +1,94 @@
+import json
+
+from flask import current_app, has_app_context
+from sqlalchemy import Table
+from sqlalchemy.sql.util import find_tables
+
+from coco.extensions import db
+
+
+def query_tables(query):
+    """查询涉及的全部表名，包括连接和子查询中的表"""
+    tables = find_tables(query.statement, check_columns=True, include_aliases=True, include_joins=True)
+    return sorted({table.name for table in tables if isinstance(table, Table)})
+
+
+class CountCache:
+    """分页总数缓存
+
+    以查询语句和参数为键把 COUNT 结果保存在缓存后端中。每个表有一个版本号，提交钩子在表有增删改时增加版本号，
+    缓存的结果记录了统计时涉及的表的版本，版本变化后失效。
+    版本号保存在缓存后端中，使用共享的后端时所有进程立即看到失效。
+    """
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.cache_backend, app.config['COUNT_CACHE_TTL'])
+
+    @staticmethod
+    def _key(query):
+        compiled = query.statement.compile()
+        params = sorted((name, repr(value)) for name, value in compiled.params.items())
+        return str(compiled), json.dumps(params)
+
+    def count(self, query):
+        query = query.order_by(None)
+        tables = query_tables(query)
+        key = ('count',) + self._key(query)
+        versions = tuple(self.backend.get_version(f'count:{table}') for table in tables)
+        entry = self.backend.get(key)
+        if entry is not None and entry[1] == versions:
+            return entry[0]
+        total = query.count()
+        self.backend.set(key, (total, versions), self.ttl)
+        return total
+
+    def invalidate(self, tables):
+        self.backend.incr_versions([f'count:{table}' for table in tables])
+
+
+def estimate_count(query):
+    """由 PostgreSQL 估算查询的行数，不扫描数据
+
+    没有过滤条件时使用 pg_class.reltuples，否则使用执行计划中估算的行数。
+    """
+    query = query.order_by(None)
+    statement = query.statement
+    tables = query_tables(query)
+    if statement.whereclause is None and len(tables) == 1:
+        return db.session.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)',
+            {'name': tables[0]}
+        ).scalar() or 0
+    compiled = statement.compile(dialect=db.session.bind.dialect)
+    plan = db.session.connection().execute(f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _after_flush(session, flush_context):
+    tables = session.info.setdefault('count_tables', set())
+    for obj in session.new | session.dirty | session.deleted:
+        table = getattr(obj, '__tablename__', None)
+        if table is not None:
+            tables.add(table)
+
+
+def _after_commit(session):
+    tables = session.info.pop('count_tables', None)
+    if tables and has_app_context() and current_app.count_cache is not None:
+        current_app.count_cache.invalidate(tables)
+
+
+def _after_rollback(session):
+    session.info.pop('count_tables', None)
+
+
+db.event.listen(db.session, 'after_flush', _after_flush)
+db.event.listen(db.session, 'after_commit', _after_commit)
+db.event.listen(db.session, 'after_rollback', _after_rollback)
@@ -27,3 +27,5 @@ EMAIL_NOT_REGISTERED = BaseError('EMAIL_NOT_REGISTERED', '该邮箱未注册')
 PASSWORD_RESET_TOKEN_INVALID = BaseError('PASSWORD_RESET_TOKEN_INVALID', '密码重置码无效')
 INTERNAL_ERROR = BaseError('INTERNAL_ERROR', '服务器内部错误')
 FILTER_TYPE_ERROR = BaseError('FILTER_TYPE_ERROR', '查询类型错误')
+INVALID_CURSOR = BaseError('INVALID_CURSOR', '无效的分页游标')
+SEARCH_UNAVAILABLE = BaseError('SEARCH_UNAVAILABLE', '搜索服务暂时不可用，请稍后再试')
@@ -0,0 +1,184 @@
+from functools import wraps
+
+from flask import current_app, has_app_context
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from coco.extensions import db
+
+
+# 任意模型的缓存失效时都会增加，生成依赖多个版本号的结果时用于检查期间是否有提交
+MODEL_VERSION = 'model'
+
+
+def table_version(table):
+    """表中任意一行变化都会增加"""
+    return f'model:{table}'
+
+
+def row_versions(table, pk):
+    """单行的版本号，整张表失效（如批量更新）时也要让单行的结果失效"""
+    return [f'model:{table}:*', f'model:{table}:{pk}']
+
+
+def members_version(table):
+    """表中增加或删除行、行的删除标记或 __cache_parents__ 中的列变化时增加，修改其它列不会增加"""
+    return f'model:{table}:+'
+
+
+def snapshot(obj):
+    """把已加载的列复制到一个新的 detached 实例
+
+    快照不属于任何 session，多个请求共享，只能读取；需要修改时应重新查询。
+    没有加载的延迟列不会复制，读取时会抛出 DetachedInstanceError。
+    """
+    state = db.inspect(obj)
+    mapper = state.mapper
+    copy = mapper.class_manager.new_instance()
+    for prop in mapper.column_attrs:
+        if prop.key not in state.unloaded:
+            set_committed_value(copy, prop.key, state.dict[prop.key])
+    make_transient_to_detached(copy)
+    return copy
+
+
+class ModelCache:
+    """模型查询方法的结果缓存
+
+    键为 (表名, 方法名, 参数)，值为结果的快照，保存在缓存后端中。
+    结果是单个对象时依赖该行的版本号（model:表名:主键），该行修改或删除时失效；
+    结果是列表或 None 时依赖整张表的版本号（model:表名），表中任意一行变化都会失效。
+    版本号保存在缓存后端中，使用共享的后端时所有进程立即看到失效。
+    hits、misses 和 invalidations 是本进程的计数。
+    """
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.cache_backend, app.config['MODEL_CACHE_TTL'])
+
+    def _dependencies(self, table, value):
+        if value is None or isinstance(value, list):
+            return [table_version(table)]
+        return row_versions(table, value.id)
+
+    def get_or_load(self, key, table, load):
+        version = self.backend.get_version(table_version(table))
+        entry = self.backend.get(('model',) + key)
+        if entry is not None:
+            value, versions = entry
+            if all(self.backend.get_version(name) == version for name, version in versions):
+                self.hits += 1
+                return value
+        self.misses += 1
+        value = load()
+        versions = [(name, self.backend.get_version(name)) for name in self._dependencies(table, value)]
+        # 加载期间表有变化时不保存，避免以新版本号缓存旧数据
+        if self.backend.get_version(table_version(table)) == version:
+            self.backend.set(('model',) + key, (value, versions), self.ttl)
+        return value
+
+    def invalidate(self, changes, members=()):
+        """changes 为 {表名: 主键集合}，主键集合为 None 表示整张表都可能变化；members 为行的归属有变化的表"""
+        names = []
+        for table, pks in changes.items():
+            names.append(table_version(table))
+            if pks is None:
+                names.extend([f'model:{table}:*', members_version(table)])
+            else:
+                names.extend(f'model:{table}:{pk}' for pk in pks)
+                if table in members:
+                    names.append(members_version(table))
+        self.invalidations += len(names)
+        self.backend.incr_versions(names + [MODEL_VERSION])
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+
+def _snapshot_result(result):
+    if isinstance(result, list):
+        return [snapshot(obj) for obj in result]
+    return snapshot(result) if result is not None else None
+
+
+def cached_query(method):
+    """缓存模型查询类方法的结果，放在 @classmethod 下面
+
+    调用时传入 cached=True 才使用缓存，返回只读的快照，适合不修改结果的读取接口；
+    需要修改返回的对象时不要使用缓存。
+    """
+    @wraps(method)
+    def wrapper(cls, *args, cached=False, **kwargs):
+        cache = current_app.model_cache if cached and has_app_context() else None
+        if cache is None:
+            return method(cls, *args, **kwargs)
+        table = cls.__tablename__
+        key = (table, method.__name__, args, tuple(sorted(kwargs.items())))
+        return cache.get_or_load(key, table, lambda: _snapshot_result(method(cls, *args, **kwargs)))
+    return wrapper
+
+
+def record_change(session, table, pks=None, members=False):
+    """不经过 ORM 的修改（如 Query.update）调用，提交后失效相关的缓存
+
+    pks 为 None 表示整张表；members 为 True 表示增加、删除了行或改变了行的归属
+    """
+    changes = session.info.setdefault('model_cache_changes', {})
+    if pks is None or changes.get(table, ()) is None:
+        changes[table] = None
+    else:
+        changes.setdefault(table, set()).update(pks)
+    if members:
+        session.info.setdefault('model_cache_members', set()).add(table)
+
+
+def _parent_ids(obj, column):
+    # after_flush 中属性历史仍是 flush 之前的状态，修改前后的父行都要失效
+    history = db.inspect(obj).attrs[column].history
+    return {value for value in history.sum() if value is not None}
+
+
+def _members_changed(obj, parents):
+    attrs = db.inspect(obj).attrs
+    return any(attrs[key].history.has_changes() for key in ['deleted', *parents] if key in attrs.keys())
+
+
+def _after_flush(session, flush_context):
+    for obj in session.new | session.dirty | session.deleted:
+        table = getattr(obj, '__tablename__', None)
+        if table is None:
+            continue
+        parents = getattr(obj, '__cache_parents__', {})
+        members = obj in session.new or obj in session.deleted or _members_changed(obj, parents)
+        record_change(session, table, [obj.id], members)
+        # 子表的行（如评论、文章的标签）变化时，父表中对应的行也视为变化
+        for column, parent in parents.items():
+            record_change(session, parent, _parent_ids(obj, column))
+
+
+def _after_commit(session):
+    changes = session.info.pop('model_cache_changes', None)
+    members = session.info.pop('model_cache_members', set())
+    if changes and has_app_context() and current_app.model_cache is not None:
+        current_app.model_cache.invalidate(changes, members)
+
+
+def _after_rollback(session):
+    session.info.pop('model_cache_changes', None)
+    session.info.pop('model_cache_members', None)
+
+
+db.event.listen(db.session, 'after_flush', _after_flush)
+db.event.listen(db.session, 'after_commit', _after_commit)
+db.event.listen(db.session, 'after_rollback', _after_rollback)
@@ -4,4 +4,5 @@ from .auth_user import AuthUser
 from .category import Category
 from .comment import Comment
 from .link import Link
+from .search_watermark import SearchWatermark
 from .tag import Tag
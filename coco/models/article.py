@@ -1,11 +1,40 @@
 import enum
-from datetime import timedelta
+import re
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
 
+from dateutil.parser import isoparse
+from flask import current_app, has_app_context
+from sqlalchemy.dialects.postgresql import TSVECTOR, aggregate_order_by
 from sqlalchemy_utils.types.choice import ChoiceType
 
-from coco.utils.other_utils import gen_slug
+from coco.model_cache import cached_query, record_change
+from coco.result_cache import mark_stale
+from coco.search import register_suggest_model
+from coco.unit_of_work import commit_or_flush
+from coco.utils.other_utils import gen_slug, gen_summary
 from .mixin import db, Model, SearchableMixin
+from .article_tag import ArticleTag
 from .comment import Comment
+from .tag import Tag, TAG_NAME_LENGTH
+
+
+# 标签之间的分隔符，兼容中文逗号
+TAG_SEPARATOR = re.compile(r'[,，]')
+# 归档按北京时间的月份分组
+ARCHIVE_UTC_OFFSET = timedelta(hours=8)
+# 归档缓存的名称，以及修改后需要重建归档的字段
+ARCHIVE_CACHE = 'archive'
+ARCHIVE_FIELDS = ('slug', 'title', 'created_time', 'deleted')
+
+
+# 只读接口使用的行，直接由 SELECT 的结果构造，不创建模型实例
+ArticleRow = namedtuple('ArticleRow', [
+    'id', 'slug', 'title', 'summary', 'view_count', 'deleted', 'created_time', 'updated_time'
+])
+ArticleDetailRow = namedtuple('ArticleDetailRow', ArticleRow._fields + ('content',))
+# 数据库时间为 UTC，接口返回北京时间
+LOCAL_UTC_OFFSET = timedelta(hours=8)
 
 
 class ArticleStatus(enum.Enum):
@@ -20,15 +49,31 @@ ArticleStatus.Draft.label = '草稿'
 class Article(Model, SearchableMixin):
     """文章表"""
     __tablename__ = 'article'
-    __searchable__ = ['body_text', 'tags', 'title']
+    # 标签不是列，由 search_document 读取，修改后由 _sync_tags 标记更新索引
+    __searchable__ = ['title', 'summary', 'content', 'tags']
+    __search_stored__ = ['slug', 'created_time', 'category_id']
+    __search_source__ = ['slug', 'title', 'summary', 'created_time', 'updated_time']
+    __search_facets__ = {
+        'category': ('category_id', 'term'),
+        'tag': ('tags', 'keyword'),
+        'month': ('created_time', 'month'),
+    }
+    __suggest__ = 'title'
+    __cache_parents__ = {'category_id': 'category'}
+    __table_args__ = (
+        db.Index('ix_article_search_vector', 'search_vector', postgresql_using='gin'),
+        # 对账任务按 updated_time 读取变更
+        db.Index('ix_article_updated_time', 'updated_time'),
+        # 按分类的游标分页在 (category_id, id) 上定位
+        db.Index('ix_article_category_id_id', 'category_id', 'id'),
+    )
 
     slug = db.Column(db.String(16), index=True, nullable=False, unique=True, comment='Slug')
     title = db.Column(db.String(200), nullable=False, comment='标题')
     summary = db.Column(db.String(200), comment='摘要')
     content = db.Column(db.Text, nullable=False, comment='正文')  # 正文必须用 Markdown 格式书写
     status = db.Column(
-        db.SmallInteger(),
-        ChoiceType(ArticleStatus, impl=db.SmallInteger),
+        ChoiceType(ArticleStatus, impl=db.SmallInteger()),
         nullable=False,
         default=ArticleStatus.Normal,
         comment='状态'
@@ -36,6 +81,8 @@ class Article(Model, SearchableMixin):
     view_count = db.Column(db.Integer(), nullable=False, default=0, comment='浏览数')
     category_id = db.Column(db.SmallInteger(), nullable=False, index=True, comment='外键，分类的ID')
     author_id = db.Column(db.Integer(), nullable=False, index=True, comment='外键，用户的ID')
+    # PostgreSQL 全文检索向量，只在 SEARCH_BACKEND 为 postgres 时维护
+    search_vector = db.deferred(db.Column(TSVECTOR, comment='全文检索向量'))
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -52,42 +99,305 @@ class Article(Model, SearchableMixin):
     def __repr__(self):
         return f'<Article({self.title!r})>'
 
-    def to_dict(self):
+    @property
+    def live_view_count(self):
+        """数据库中的浏览数加上 view_counter 中尚未写入的增量"""
+        if self.id is None or not has_app_context():
+            return self.view_count
+        return self.view_count + current_app.view_counter.pending(self.id)
+
+    @property
+    def tags(self):
+        """标签名列表"""
+        if self.id is None:
+            return []
+        return self.tag_names(self.id)
+
+    @classmethod
+    def tag_names(cls, article_id):
+        return cls.tag_names_by_article([article_id]).get(article_id, [])
+
+    @staticmethod
+    def tag_names_by_article(article_ids):
+        """一次查询多篇文章的标签，返回 {文章 id: 标签名列表}"""
+        query = db.session.query(ArticleTag.article_id, Tag.name)\
+            .join(Tag, ArticleTag.tag_id == Tag.id)\
+            .filter(ArticleTag.article_id.in_(article_ids), ArticleTag.deleted.is_(False), Tag.deleted.is_(False))
+        names = defaultdict(list)
+        for article_id, name in query.order_by(Tag.id):
+            names[article_id].append(name)
+        return names
+
+    @tags.setter
+    def tags(self, value):
+        """value 为逗号分隔的字符串或标签名列表，save 时写入 article_tag"""
+        self._pending_tags = self.parse_tags(value)
+
+    @staticmethod
+    def parse_tags(value):
+        """返回去重后的标签名列表，标签名超过 TAG_NAME_LENGTH 个字符时抛出 ValueError"""
+        if isinstance(value, str):
+            value = TAG_SEPARATOR.split(value)
+        names = (name.strip() for name in value or [])
+        names = list(dict.fromkeys(name for name in names if name))
+        for name in names:
+            if len(name) > TAG_NAME_LENGTH:
+                raise ValueError(f'Tag name {name!r} is longer than {TAG_NAME_LENGTH} characters')
+        return names
+
+    def save(self):
+        self._fill_summary()
+        tag_names = self.__dict__.pop('_pending_tags', None)
+        # 只有新文章、修改分类、删除或恢复、修改标签时文章数才会变化，其它修改不读取计数状态
+        counted = tag_names is not None or self._count_fields_changed()
+        before = self._count_state() if counted else None
+        db.session.add(self)
+        if counted:
+            # 新文章需要先 flush 得到 id，修改后的计数状态也要 flush 之后才能读取
+            db.session.flush()
+        if tag_names is not None:
+            self._sync_tags(tag_names)
+            db.session.flush()
+        if counted:
+            self._update_counts(before, self._count_state())
+        return super().save()
+
+    def _count_fields_changed(self):
+        state = db.inspect(self)
+        if state.transient or state.pending:
+            return True
+        return state.attrs.category_id.history.has_changes() or state.attrs.deleted.history.has_changes()
+
+    def _fill_summary(self):
+        """作者没有填写摘要时由正文生成；摘要是由旧正文生成的，正文修改后重新生成"""
+        if not self.content:
+            return
+        if not self.summary:
+            self.summary = gen_summary(self.content)
+            return
+        attrs = db.inspect(self).attrs
+        old_contents = attrs.content.history.deleted
+        if old_contents and not attrs.summary.history.has_changes() \
+                and self.summary == gen_summary(old_contents[0]):
+            self.summary = gen_summary(self.content)
+
+    def delete(self):
+        self._update_counts(self._count_state(), (None, set()))
+        return super().delete()
+
+    def _count_state(self):
+        """数据库中文章计入的 (分类 ID, 标签 ID 集合)，已删除的文章不计入任何分类和标签"""
+        if self.id is None:
+            return None, set()
+        # 读取的是 flush 之前数据库中的值，并锁住该行，避免并发编辑重复计数
+        with db.session.no_autoflush:
+            row = db.session.query(Article.deleted, Article.category_id)\
+                .filter(Article.id == self.id).with_for_update().first()
+            if row is None or row.deleted:
+                return None, set()
+            tag_ids = db.session.query(ArticleTag.tag_id)\
+                .filter(ArticleTag.article_id == self.id, ArticleTag.deleted.is_(False))
+            return row.category_id, {tag_id for tag_id, in tag_ids}
+
+    @staticmethod
+    def _update_counts(before, after):
+        """按变更前后的差异增减分类和标签的文章数"""
+        from .category import Category  # category 模块导入了 article
+
+        (old_category_id, old_tag_ids), (new_category_id, new_tag_ids) = before, after
+        if old_category_id != new_category_id:
+            Category.incr_counter('article_count', {old_category_id: -1, new_category_id: 1})
+        deltas = dict.fromkeys(old_tag_ids - new_tag_ids, -1)
+        deltas.update(dict.fromkeys(new_tag_ids - old_tag_ids, 1))
+        Tag.incr_counter('article_count', deltas)
+
+    @classmethod
+    def refresh_counts(cls):
+        """按 article 和 article_tag 重新统计分类和标签的文章数，修复计数偏差
+
+        只更新计数变化的行，并更新这些行的 updated_time
+        """
+        from .category import Category
+
+        category_count = db.select([db.func.count(cls.id)])\
+            .where(db.and_(cls.category_id == Category.id, cls.deleted.is_(False)))\
+            .as_scalar()
+        Category.query.filter(Category.article_count != category_count).update(
+            {Category.article_count: category_count, Category.updated_time: datetime.utcnow()},
+            synchronize_session=False
+        )
+        record_change(db.session, Category.__tablename__)
+        tag_count = db.select([db.func.count(ArticleTag.id)])\
+            .where(db.and_(
+                ArticleTag.tag_id == Tag.id,
+                ArticleTag.deleted.is_(False),
+                ArticleTag.article_id == cls.id,
+                cls.deleted.is_(False),
+            ))\
+            .as_scalar()
+        Tag.query.filter(Tag.article_count != tag_count).update(
+            {Tag.article_count: tag_count, Tag.updated_time: datetime.utcnow()},
+            synchronize_session=False
+        )
+        record_change(db.session, Tag.__tablename__)
+        commit_or_flush()
+
+    def _sync_tags(self, tag_names):
+        """让 article_tag 与 tag_names 一致，不再使用的关联软删除，重新使用时恢复"""
+        tags = {tag.name: tag for tag in Tag.query.filter(Tag.name.in_(tag_names))} if tag_names else {}
+        for name in tag_names:
+            tag = tags.get(name)
+            if tag is None:
+                tag = tags[name] = Tag(name=name, author_id=self.author_id)
+                db.session.add(tag)
+            tag.deleted = False
+        db.session.flush()
+
+        wanted = {tags[name].id for name in tag_names}
+        changed = False
+        rows = {row.tag_id: row for row in ArticleTag.query.filter_by(article_id=self.id)}
+        for tag_id in wanted:
+            row = rows.get(tag_id)
+            if row is None:
+                db.session.add(ArticleTag(article_id=self.id, tag_id=tag_id))
+                changed = True
+            elif row.deleted:
+                row.deleted = False
+                changed = True
+        for tag_id, row in rows.items():
+            if tag_id not in wanted and not row.deleted:
+                row.deleted = True
+                changed = True
+        if changed:
+            # 标签只改了 article_tag，文章本身要刷新 updated_time，对账和重放才能看到这次修改
+            self.updated_time = datetime.utcnow()
+            self.mark_search_changed({'tags': list(tag_names)})
+
+    @classmethod
+    def search_documents(cls, objs):
+        # 标签不是列，一次查询这一批文章的标签，避免每篇文章一次查询
+        tags = cls.tag_names_by_article([obj.id for obj in objs]) if objs else {}
+        return [cls.search_document(obj, {'tags': tags.get(obj.id, [])}) for obj in objs]
+
+    @classmethod
+    def search_facet_column(cls, field):
+        if field == 'tags':
+            return Tag.name, [
+                (ArticleTag, db.and_(ArticleTag.article_id == cls.id, ArticleTag.deleted.is_(False))),
+                (Tag, db.and_(Tag.id == ArticleTag.tag_id, Tag.deleted.is_(False))),
+            ]
+        return super().search_facet_column(field)
+
+    @classmethod
+    def list_query(cls, rows=False):
+        """rows 为 True 时只查询 ArticleRow 的列，结果是行而不是模型实例"""
+        if rows:
+            return db.session.query(*(getattr(cls, field) for field in ArticleRow._fields))
+        # 列表只返回摘要，不从数据库读取正文
+        return cls.query.options(db.defer(cls.content))
+
+    @classmethod
+    def get_row_by_slug(cls, slug, deleted=None):
+        """详情页使用，返回 ArticleDetailRow，不存在时返回 None"""
+        table = cls.__table__
+        statement = db.select([table.c[field] for field in ArticleDetailRow._fields]).where(table.c.slug == slug)
+        if deleted is not None:
+            statement = statement.where(table.c.deleted.is_(deleted))
+        row = db.session.execute(statement.limit(1)).first()
+        return ArticleDetailRow._make(row) if row is not None else None
+
+    @staticmethod
+    def row_to_summary_dict(row, pending_views=0):
+        """与 to_summary_dict 一致，row 为 list_query(rows=True) 的结果或 ArticleRow"""
+        return {
+            'slug': row.slug,
+            'title': row.title,
+            'summary': row.summary,
+            'viewCount': row.view_count + pending_views,
+            'deleted': row.deleted,
+            'createTime': row.created_time + LOCAL_UTC_OFFSET,
+            'updateTime': row.updated_time + LOCAL_UTC_OFFSET
+        }
+
+    @classmethod
+    def rows_to_summary_dicts(cls, rows):
+        # 一次取出 view_counter 的函数，避免每行都查找 current_app
+        pending = current_app.view_counter.pending
+        return [cls.row_to_summary_dict(row, pending(row.id)) for row in rows]
+
+    @classmethod
+    def row_to_dict(cls, row, pending_views=0):
+        """与 to_dict 一致，row 为 ArticleDetailRow"""
+        data = cls.row_to_summary_dict(row, pending_views)
+        data['content'] = row.content
+        return data
+
+    def to_summary_dict(self):
+        """列表项，不包含正文"""
         return {
             'slug': self.slug,
             'title': self.title,
             'summary': self.summary,
-            'content': self.content,
-            'viewCount': self.view_count,
+            'viewCount': self.live_view_count,
             'deleted': self.deleted,
             'createTime': self.created_time + timedelta(hours=8),
             'updateTime': self.updated_time + timedelta(hours=8)
         }
 
-    def paginate_comments(self, deleted=None, order='asc', page=1, per_page=10):
-        query = self.comments
+    def to_dict(self):
+        data = self.to_summary_dict()
+        data['content'] = self.content
+        return data
+
+    @staticmethod
+    def search_document_to_dict(document):
+        """把索引中的文档转换为与 to_summary_dict 一致的列表项
+
+        加入 updated_time 之前写入的文档以创建时间作为更新时间，没有高亮时为空字典
+        """
+        def parse(value):
+            # Elasticsearch 返回字符串，本地索引返回 datetime
+            return isoparse(value) if isinstance(value, str) else value
+
+        created_time = parse(document['created_time'])
+        updated_time = parse(document.get('updated_time')) or created_time
+        return {
+            'slug': document['slug'],
+            'title': document['title'],
+            'summary': document.get('summary'),
+            'highlights': document.get('highlights') or {},
+            'createTime': created_time + timedelta(hours=8),
+            'updateTime': updated_time + timedelta(hours=8)
+        }
+
+    def paginate_comments(self, deleted=None, order='asc', page=1, per_page=10, after=None, count='exact'):
+        query = Comment.query.filter_by(article_id=self.id)
         if deleted is not None:
             query = query.filter_by(deleted=deleted)
-        order_param = Comment.id.asc() if order == 'asc' else Comment.id.desc()
-        return query.order_by(order_param).paginate(page, per_page)
+        return Comment.paginate_query(query, order, page, per_page, after, count)
 
     @classmethod
-    def paginate(cls, deleted=None, order='asc', page=1, per_page=10):
-        query = cls.query
+    def paginate(cls, deleted=None, order='asc', page=1, per_page=10, after=None, count='exact', rows=False):
+        query = cls.list_query(rows)
         if deleted is not None:
-            query = query.filter_by(deleted=deleted)
-        order_param = cls.id.asc() if order == 'asc' else cls.id.desc()
-        return query.order_by(order_param).paginate(page, per_page)
+            query = query.filter(cls.deleted == deleted)
+        return cls.paginate_query(query, order, page, per_page, after, count)
 
     @classmethod
-    def paginate_by_tag(cls, tag, deleted=None, order='asc', page=1, per_page=10):
-        query = cls.query.filter(cls.tags.like(f'%{tag}%'))
+    def paginate_by_tag(cls, tag, deleted=None, order='asc', page=1, per_page=10, after=None, count='exact',
+                        rows=False):
+        # 通过 tag.name 的唯一索引和 article_tag 的 (tag_id, article_id) 索引连接，只匹配完整的标签名
+        query = cls.list_query(rows)\
+            .join(ArticleTag, db.and_(ArticleTag.article_id == cls.id, ArticleTag.deleted.is_(False)))\
+            .join(Tag, Tag.id == ArticleTag.tag_id)\
+            .filter(Tag.name == tag, Tag.deleted.is_(False))
         if deleted is not None:
-            query = query.filter_by(deleted=deleted)
-        order_param = cls.id.asc() if order == 'asc' else cls.id.desc()
-        return query.order_by(order_param).paginate(page, per_page)
+            # join 之后 filter_by 作用于最后连接的 Tag，这里必须指明 Article 的列
+            query = query.filter(cls.deleted == deleted)
+        return cls.paginate_query(query, order, page, per_page, after, count)
 
     @classmethod
+    @cached_query
     def get_by_slug(cls, slug, deleted=None):
         query = cls.query
         if deleted is not None:
@@ -96,11 +406,47 @@ class Article(Model, SearchableMixin):
 
     @classmethod
     def list_tags(cls, deleted=None, order='asc'):
-        query = cls.query
+        """返回文章使用中的标签名，deleted 为文章的删除状态"""
+        used = db.session.query(ArticleTag.tag_id)\
+            .join(cls, cls.id == ArticleTag.article_id)\
+            .filter(ArticleTag.deleted.is_(False))
         if deleted is not None:
-            query = query.filter_by(deleted=deleted)
-        order_param = cls.id.asc() if order == 'asc' else cls.id.desc()
-        return query.order_by(order_param).with_entities(cls.tags).all()
+            used = used.filter(cls.deleted == deleted)
+        order_param = Tag.id.asc() if order == 'asc' else Tag.id.desc()
+        query = Tag.query.filter(Tag.id.in_(used), Tag.deleted.is_(False))
+        return [name for name, in query.order_by(order_param).with_entities(Tag.name)]
+
+    @classmethod
+    def archive(cls, year=None):
+        """按月归档未删除的文章，返回 [(月份, [{'slug': ..., 'title': ...}, ...]), ...]，新的月份和文章在前
+
+        只读取 slug、title 和 created_time，分组和排序都在数据库中完成
+        """
+        month = db.func.date_trunc('month', cls.created_time + ARCHIVE_UTC_OFFSET).label('month')
+        article = db.func.json_build_object('slug', cls.slug, 'title', cls.title)
+        query = db.session.query(month, db.func.json_agg(aggregate_order_by(article, cls.created_time.desc())))\
+            .filter(cls.deleted.is_(False))
+        if year is not None:
+            # 用 created_time 的范围过滤，可以使用索引
+            query = query.filter(
+                cls.created_time >= datetime(year, 1, 1) - ARCHIVE_UTC_OFFSET,
+                cls.created_time < datetime(year + 1, 1, 1) - ARCHIVE_UTC_OFFSET,
+            )
+        return query.group_by(month).order_by(month.desc()).all()
+
+    @classmethod
+    def archive_after_flush(cls, session, flush_context):
+        """发布、删除文章或修改标题等字段后，提交时让归档缓存失效"""
+        for obj in session.new | session.deleted:
+            if isinstance(obj, cls):
+                mark_stale(session, ARCHIVE_CACHE)
+                return
+        for obj in session.dirty:
+            if isinstance(obj, cls):
+                attrs = db.inspect(obj).attrs
+                if any(attrs[field].history.has_changes() for field in ARCHIVE_FIELDS):
+                    mark_stale(session, ARCHIVE_CACHE)
+                    return
 
     @classmethod
     def get_by_title(cls, title, deleted=None):
@@ -110,5 +456,9 @@ class Article(Model, SearchableMixin):
         return query.filter_by(title=title).first()
 
 
-db.event.listen(db.session, 'before_commit', Article.before_commit)
+register_suggest_model(Article)
+db.event.listen(db.session, 'before_flush', Article.before_flush)
+db.event.listen(db.session, 'after_flush', Article.after_flush)
 db.event.listen(db.session, 'after_commit', Article.after_commit)
+db.event.listen(db.session, 'after_rollback', Article.after_rollback)
+db.event.listen(db.session, 'after_flush', Article.archive_after_flush)
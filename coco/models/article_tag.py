@@ -3,8 +3,13 @@ from .mixin import db, Model
 
 class ArticleTag(Model):
     __tablename__ = 'article_tag'
+    __cache_parents__ = {'article_id': 'article', 'tag_id': 'tag'}
     __table_args__ = (
         db.UniqueConstraint('article_id', 'tag_id'),
+        # 按标签查文章时在 (tag_id, article_id) 上定位
+        db.Index('ix_article_tag_tag_id_article_id', 'tag_id', 'article_id'),
+        # 条件请求读取 max(updated_time)
+        db.Index('ix_article_tag_updated_time', 'updated_time'),
     )
 
     article_id = db.Column(db.Integer, nullable=False, comment='外键，文章的ID')
@@ -1,5 +1,5 @@
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import jwt
 from flask import current_app
@@ -20,13 +20,10 @@ class UserGroup:
     Visitor = 2
 
 
+# 每个用户组的权限位
 GROUP_PERMISSIONS = {
-    UserGroup.Visitor: (
-        UserGroupPermission.WriteComment,
-    ),
-    UserGroup.Admin: (
-        UserGroupPermission.All,
-    ),
+    UserGroup.Visitor: UserGroupPermission.WriteComment,
+    UserGroup.Admin: UserGroupPermission.All | UserGroupPermission.WriteComment,
 }
 
 
@@ -80,7 +77,29 @@ class AuthUser(Model, UserMixin):
         return (group_permission & permission) == permission
 
     def update_last_login_time(self):
-        self.last_login_time = datetime.utcnow()
+        """每个已登录的请求都会调用，距上次记录不到 LAST_LOGIN_UPDATE_INTERVAL 秒时不写入
+
+        在独立的短事务中立即提交，只读请求的会话不会提交，也不应长时间持有该行的锁
+        """
+        interval = current_app.config['LAST_LOGIN_UPDATE_INTERVAL']
+        now = datetime.utcnow()
+        threshold = now - timedelta(seconds=interval)
+        if self.last_login_time is not None and self.last_login_time >= threshold:
+            return
+        # current_user 可能是模型缓存中的快照，写入后快照中的时间不变，最近写入过的用户记录在缓存后端中
+        cache, key = current_app.cache_backend, ('last_login', self.id)
+        if cache.get(key) is not None:
+            return
+        # 不记录为缓存失效，否则每个请求都会让该用户的缓存失效；
+        # 条件中再次比较时间，并发的请求只有一个写入
+        table = type(self).__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                table.update()
+                .where(db.and_(table.c.id == self.id, table.c.last_login_time < threshold))
+                .values(last_login_time=now)
+            )
+        cache.set(key, now, interval)
 
     @classmethod
     def get_by_email(cls, email, deleted=None):
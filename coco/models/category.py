@@ -11,6 +11,8 @@ class Category(Model):
 
     author_id = db.Column(db.Integer(), nullable=False, index=True, comment='用户的ID')
     name = db.Column(db.String(20), nullable=False, comment='名称')
+    # 由 Article.save 增量维护，Article.refresh_counts 可以重新统计
+    article_count = db.Column(db.Integer(), nullable=False, default=0, server_default='0', comment='文章数')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -19,9 +21,12 @@ class Category(Model):
         return f'<Category({self.name!r})>'
 
     def to_dict(self):
-        return {'name': self.name}
-
-    def paginate_articles(self, order='asc', page=1, per_page=10):
-        order_param = Article.id.asc() if order == 'asc' else Article.id.desc()
-        return self.articles.order_by(order_param).paginate(page, per_page)
+        return {'name': self.name, 'articleCount': self.article_count}
+
+    def paginate_articles(self, deleted=None, order='asc', page=1, per_page=10, after=None, count='exact',
+                          rows=False):
+        query = Article.list_query(rows).filter(Article.category_id == self.id)
+        if deleted is not None:
+            query = query.filter(Article.deleted == deleted)
+        return Article.paginate_query(query, order, page, per_page, after, count)
 
@@ -6,6 +6,13 @@ from .mixin import db, Model
 class Comment(Model):
     """评论表"""
     __tablename__ = 'comment'
+    __cache_parents__ = {'article_id': 'article'}
+    __table_args__ = (
+        # 文章评论的游标分页在 (article_id, id) 上定位
+        db.Index('ix_comment_article_id_id', 'article_id', 'id'),
+        # 条件请求读取 max(updated_time)
+        db.Index('ix_comment_updated_time', 'updated_time'),
+    )
 
     article_id = db.Column(db.SmallInteger(), nullable=False, index=True, comment='外键，文章的ID')
     nickname = db.Column(db.String(50), nullable=False, comment='昵称')
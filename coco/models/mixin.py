@@ -1,9 +1,20 @@
-from datetime import datetime
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
 
+from flask import abort, current_app
 from sqlalchemy.orm.interfaces import MapperExtension
 
+from coco.count_cache import estimate_count
 from coco.extensions import db
-from coco.search import query_index, add_to_index, remove_from_index
+from coco.model_cache import cached_query, record_change
+from coco.search import get_search_backend, SearchResult
+from coco.unit_of_work import commit_or_flush, in_unit_of_work
+
+
+# 分页结果，total 为 None 表示没有统计总数，approximate 表示 total 是估算值；
+# next_after 为游标分页的下一页位置，为 None 表示没有下一页
+Page = namedtuple('Page', ['items', 'total', 'next_after', 'approximate'])
 
 
 class ModelUpdateExtension(MapperExtension):
@@ -16,6 +27,8 @@ class ModelMixin:
     __mapper_args__ = {
         'extension': ModelUpdateExtension()
     }
+    # {列名: 父表名}，行变化时父表中该列指向的行也视为变化，用于缓存失效
+    __cache_parents__ = {}
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True, comment='主键ID')
     created_time = db.Column(db.DateTime(False), nullable=False, default=datetime.utcnow, comment='创建时间')
@@ -28,7 +41,9 @@ class ModelMixin:
             instance = cls(*args, **kwargs)
             instance.save()
         except Exception as e:
-            db.session.rollback()
+            # unit_of_work 中由最外层回滚整个事务
+            if not in_unit_of_work():
+                db.session.rollback()
             raise e
         else:
             return instance
@@ -40,14 +55,15 @@ class ModelMixin:
 
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        commit_or_flush()
         return self
 
     def delete(self):
         db.session.delete(self)
-        return db.session.commit()
+        return commit_or_flush()
 
     @classmethod
+    @cached_query
     def get_by_id(cls, id, deleted=None):
         query = cls.query
         if deleted is not None:
@@ -55,6 +71,29 @@ class ModelMixin:
         return query.filter_by(id=id).first()
 
     @classmethod
+    def list_query(cls):
+        """列表使用的查询，子类可以在这里延迟加载列表中不需要的大字段"""
+        return cls.query
+
+    @classmethod
+    def incr_counter(cls, column, deltas):
+        """按 {id: 增量} 在数据库中累加计数列，增量相同的记录共用一条 UPDATE
+
+        同时更新 updated_time，条件请求由它判断计数是否变化
+        """
+        ids_by_delta = defaultdict(list)
+        for obj_id, delta in deltas.items():
+            if obj_id is not None and delta:
+                ids_by_delta[delta].append(obj_id)
+        counter = getattr(cls, column)
+        for delta, ids in ids_by_delta.items():
+            cls.query.filter(cls.id.in_(ids)).update(
+                {counter: counter + delta, cls.updated_time: datetime.utcnow()}, synchronize_session=False
+            )
+            record_change(db.session, cls.__tablename__, ids)
+
+    @classmethod
+    @cached_query
     def list_all(cls, deleted=None, order='asc'):
         query = cls.query
         if deleted is not None:
@@ -62,41 +101,242 @@ class ModelMixin:
         order_param = cls.id.asc() if order == 'asc' else cls.id.desc()
         return query.order_by(order_param).all()
 
+    @classmethod
+    def count_query(cls, query, count='exact'):
+        """返回 (总数, 是否为估算值)
+
+        count 为 exact 时通过 count_cache 统计；为 estimate 时使用 PostgreSQL 估算的行数，
+        估算值小于 COUNT_ESTIMATE_MIN 时统计的代价很低，仍然返回精确值。
+        """
+        if count == 'estimate':
+            estimate = estimate_count(query)
+            if estimate >= current_app.config['COUNT_ESTIMATE_MIN']:
+                return estimate, True
+        return current_app.count_cache.count(query), False
+
+    @classmethod
+    def paginate_query(cls, query, order='asc', page=1, per_page=10, after=None, count='exact'):
+        """按 id 排序分页，返回 Page
+
+        after 为 None 时使用 OFFSET 分页；否则使用游标分页，after 为上一页返回的 next_after（第一页为空列表），
+        按 id 在索引上定位，页数再大也不会变慢。游标格式错误时抛出 ValueError。
+        count 为 exact、estimate 或 None（不统计总数），含义见 count_query。
+        """
+        order_param = cls.id.asc() if order == 'asc' else cls.id.desc()
+        if after and (len(after) != 1 or type(after[0]) is not int):
+            raise ValueError(f'Invalid cursor: {after!r}')
+        if after is None:
+            # 与 Flask-SQLAlchemy 的 paginate 一致，页码无效时返回 404
+            if page < 1:
+                abort(404)
+            offset = (page - 1) * per_page
+            items = query.order_by(order_param).offset(offset).limit(per_page).all()
+            # 先取当前页，超出范围的页码直接返回 404，不再统计总数
+            if not items and page != 1:
+                abort(404)
+            if count and len(items) < per_page:
+                # 不满一页说明是最后一页，总数不需要再查询
+                return Page(items, offset + len(items), None, False)
+            total, approximate = cls.count_query(query, count) if count else (None, False)
+            return Page(items, total, None, approximate)
+        if after:
+            query = query.filter(cls.id > after[0] if order == 'asc' else cls.id < after[0])
+        # 多取一条判断是否还有下一页
+        items = query.order_by(order_param).limit(per_page + 1).all()
+        next_after = [items[per_page - 1].id] if len(items) > per_page else None
+        total, approximate = cls.count_query(query, count) if count else (None, False)
+        return Page(items[:per_page], total, next_after, approximate)
+
 
 class SearchableMixin:
+    # 全文检索的字段
+    __searchable__ = []
+    # 不参与检索、只随文档保存的字段
+    __search_stored__ = []
+    # 不查询数据库时，搜索结果返回的文档字段
+    __search_source__ = None
+    # PostgreSQL 后端使用的 tsvector 列
+    __search_vector__ = 'search_vector'
+    # 可以过滤和分面统计的字段，{分面名: (文档字段, 类型)}，
+    # 类型为 term（数值）、keyword（字符串，可以是列表）或 month（按月统计的时间）
+    __search_facets__ = {}
+
     @classmethod
-    def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            return [], 0
+    def search(cls, expression, page, per_page, after=None, load=True, filters=None, facets=False):
+        """返回 SearchResult(结果, total, next_after, facets)
+
+        load 为 False 时直接返回搜索后端中的文档和高亮片段，不再查询数据库；
+        filters 和 facets 的含义见 SearchBackend
+        """
+        backend = get_search_backend()
+        if backend is None:
+            return SearchResult([], 0, None, {} if facets else None)
+        if not load:
+            return backend.query_documents(cls, expression, page, per_page, after, filters, facets)
+        result = backend.query_ids(cls, expression, page, per_page, after, filters, facets)
+        if not result.items:
+            return result
         when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        return cls.query.filter(cls.id.in_(ids)).filter_by(deleted=False)\
-            .order_by(db.case(when, value=cls.id)).all(), total
+        for i in range(len(result.items)):
+            when.append((result.items[i], i))
+        objs = cls.list_query().filter(cls.id.in_(result.items)).filter_by(deleted=False)\
+            .order_by(db.case(when, value=cls.id)).all()
+        return result._replace(items=objs)
+
+    @classmethod
+    def search_facet_column(cls, field):
+        """PostgreSQL 后端过滤和分面统计时使用，返回 (SQL 表达式, [(连接的表, 连接条件)])"""
+        return getattr(cls, field), []
+
+    @classmethod
+    def search_document(cls, obj, values=None):
+        """values 为预先批量读取的字段值（如标签），其余字段从 obj 读取"""
+        # id 字段用于排序，保证翻页结果稳定
+        document = {'id': obj.id}
+        for field in cls.__searchable__ + cls.__search_stored__:
+            document[field] = values[field] if values and field in values else getattr(obj, field)
+        # updated_time 每次 UPDATE 都会变化，不参与变更判断，只随文档一起写入
+        if hasattr(obj, 'updated_time'):
+            document['updated_time'] = obj.updated_time
+        return document
+
+    @classmethod
+    def search_documents(cls, objs):
+        """批量生成文档，需要额外查询的字段由子类一次读取全部 objs 的值"""
+        return [cls.search_document(obj) for obj in objs]
+
+    @classmethod
+    def _iter_chunked_documents(cls, query, chunk_size):
+        """按 chunk_size 分批读取记录并生成 (记录, 文档)，已删除的记录文档为 None"""
+        objs = iter(query.yield_per(chunk_size))
+        while True:
+            chunk = list(islice(objs, chunk_size))
+            if not chunk:
+                return
+            documents = iter(cls.search_documents([obj for obj in chunk if not obj.deleted]))
+            for obj in chunk:
+                yield obj, next(documents) if not obj.deleted else None
 
     @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': [obj for obj in session.new if isinstance(obj, cls)],
-            'update': [obj for obj in session.dirty if isinstance(obj, cls)],
-            'delete': [obj for obj in session.deleted if isinstance(obj, cls)]
-        }
+    def searchable_changed(cls, obj):
+        """只有 __searchable__ 字段或删除标记发生变化时才需要更新索引"""
+        attrs = db.inspect(obj).attrs
+        for field in cls.__searchable__ + cls.__search_stored__ + ['deleted']:
+            # 不是列的存储字段（如标签）没有属性历史
+            if field in attrs.keys() and attrs[field].history.has_changes():
+                return True
+        return False
+
+    @classmethod
+    def before_flush(cls, session, flush_context, instances):
+        backend = get_search_backend()
+        if backend is None:
+            return
+        for obj in session.new:
+            if isinstance(obj, cls):
+                backend.prepare(cls, obj)
+        for obj in session.dirty:
+            if isinstance(obj, cls) and cls.searchable_changed(obj):
+                backend.prepare(cls, obj)
+        for obj, values in session.info.get('search_marked', {}).items():
+            if isinstance(obj, cls) and not obj.deleted:
+                backend.prepare(cls, obj, values)
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        # after_flush 中 new/dirty/deleted 和属性历史仍是 flush 之前的状态，
+        # 在这里记录变更可以覆盖提交前的 autoflush，每个模型使用独立的变更记录
+        changes = session.info.setdefault('search_changes', {}).setdefault(cls.__tablename__, {})
+        for obj in session.new:
+            if isinstance(obj, cls):
+                changes[obj.id] = cls.search_document(obj)
+        for obj in session.dirty:
+            if isinstance(obj, cls) and cls.searchable_changed(obj):
+                changes[obj.id] = cls.search_document(obj) if not obj.deleted else None
+        for obj in session.deleted:
+            if isinstance(obj, cls):
+                changes[obj.id] = None
+        marked = session.info.get('search_marked', {})
+        for obj in [obj for obj in marked if isinstance(obj, cls)]:
+            values = marked.pop(obj)
+            changes[obj.id] = cls.search_document(obj, values) if not obj.deleted else None
+
+    def mark_search_changed(self, values=None):
+        """不是列的检索字段（如标签）变化后调用，下一次 flush 时更新该对象的索引
+
+        values 为这些字段的新值，flush 时关联表的修改还没有写入，不能从数据库读取
+        """
+        db.session.info.setdefault('search_marked', {}).setdefault(self, {}).update(values or {})
 
     @classmethod
     def after_commit(cls, session):
-        for obj in session._changes['add']:
-            add_to_index(cls.__tablename__, obj)
-        for obj in session._changes['update']:
-            add_to_index(cls.__tablename__, obj)
-        for obj in session._changes['delete']:
-            remove_from_index(cls.__tablename__, obj)
-        session._changes = None
-
-    @classmethod
-    def reindex(cls):
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+        changes = session.info.get('search_changes', {}).pop(cls.__tablename__, {})
+        backend = get_search_backend()
+        if changes and backend is not None:
+            backend.apply_changes(cls, changes)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.get('search_changes', {}).pop(cls.__tablename__, None)
+        session.info.pop('search_marked', None)
+
+    @classmethod
+    def get_searchable_model(cls, tablename):
+        for model in SearchableMixin.__subclasses__():
+            if model.__tablename__ == tablename:
+                return model
+        raise KeyError(tablename)
+
+    @classmethod
+    def id_ranges(cls, count):
+        """把主键范围平均切分为 count 段，返回 [(first_id, last_id), ...]"""
+        first_id, last_id = db.session.query(db.func.min(cls.id), db.func.max(cls.id)).one()
+        if first_id is None:
+            return []
+        step = (last_id - first_id) // count + 1
+        return [(start, min(start + step - 1, last_id)) for start in range(first_id, last_id + 1, step)]
+
+    @classmethod
+    def iter_search_documents(cls, first_id, last_id, chunk_size=500):
+        # yield_per 使用服务端游标分批读取，避免一次加载全部记录
+        query = cls.query.filter(cls.id.between(first_id, last_id)).filter_by(deleted=False).order_by(cls.id)
+        return (document for _, document in cls._iter_chunked_documents(query, chunk_size))
+
+    @classmethod
+    def iter_changed_documents(cls, since, chunk_size=500):
+        """返回 updated_time 不早于 since 的 (id, 文档)，已删除的记录文档为 None"""
+        query = cls.query.filter(cls.updated_time >= since).order_by(cls.id)
+        return ((obj.id, document) for obj, document in cls._iter_chunked_documents(query, chunk_size))
+
+    @classmethod
+    def reindex(cls, workers=1, chunk_size=500):
+        """通过当前的搜索后端重建索引，返回 (索引名, 写入的文档数)"""
+        from .search_watermark import SearchWatermark
+
+        started_time = datetime.utcnow()
+        result = get_search_backend().rebuild(cls, workers=workers, chunk_size=chunk_size)
+        # 重建开始之前的变更都已写入新索引，之后由对账任务接着同步
+        SearchWatermark.set_watermark(cls.__tablename__, started_time)
+        return result
+
+    @classmethod
+    def reconcile(cls, overlap=60, chunk_size=500):
+        """把上次对账以来 updated_time 变化的记录（包括软删除的记录）同步到搜索索引
+
+        用于修复提交钩子遗漏的变更，如 Elasticsearch 不可用、进程在提交后退出等。
+        起点比水位提前 overlap 秒，覆盖水位之前开始、之后才提交的事务；
+        硬删除的记录和不修改 updated_time 的批量 UPDATE 无法发现，需要 reindex。
+        返回 (起点, 同步的记录数)，从未对账过时从最早的记录开始。
+        """
+        from .search_watermark import SearchWatermark
+
+        started_time = datetime.utcnow()
+        watermark = SearchWatermark.get_watermark(cls.__tablename__)
+        since = watermark - timedelta(seconds=overlap) if watermark else datetime.min
+        changes = cls.iter_changed_documents(since, chunk_size)
+        count = get_search_backend().sync_changes(cls, changes, chunk_size)
+        SearchWatermark.set_watermark(cls.__tablename__, started_time)
+        return since, count
 
 
 class Model(ModelMixin, db.Model):
@@ -0,0 +1,28 @@
+from .mixin import db, Model
+
+
+class SearchWatermark(Model):
+    """搜索索引对账进度表"""
+    __tablename__ = 'search_watermark'
+
+    table_name = db.Column(db.String(64), nullable=False, unique=True, comment='表名')
+    watermark = db.Column(db.DateTime(False), nullable=False, comment='该时间之前的变更已同步到索引')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<SearchWatermark({self.table_name!r})>'
+
+    @classmethod
+    def get_watermark(cls, table_name):
+        obj = cls.query.filter_by(table_name=table_name).first()
+        return obj.watermark if obj else None
+
+    @classmethod
+    def set_watermark(cls, table_name, watermark):
+        obj = cls.query.filter_by(table_name=table_name).first()
+        if obj is None:
+            obj = cls(table_name=table_name)
+        obj.watermark = watermark
+        return obj.save()
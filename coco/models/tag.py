@@ -1,18 +1,38 @@
+from coco.search import register_suggest_model
 from .mixin import db, Model
 
 
+# 标签名的最大长度
+TAG_NAME_LENGTH = 10
+
+
 class Tag(Model):
     """标签表"""
     __tablename__ = 'tag'
+    __suggest__ = 'name'
     __table_args__ = (
         db.UniqueConstraint('author_id', 'name', 'deleted'),
     )
 
     author_id = db.Column(db.Integer(), nullable=False, index=True, comment='用户的ID')
-    name = db.Column(db.String(10), nullable=False, unique=True, comment='名称')
+    name = db.Column(db.String(TAG_NAME_LENGTH), nullable=False, unique=True, comment='名称')
+    # 未删除的文章数，由 Article.save 增量维护，Article.refresh_counts 可以重新统计
+    article_count = db.Column(db.Integer(), nullable=False, default=0, server_default='0', comment='文章数')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
     def __repr__(self):
         return f'<Tag({self.name!r})>'
+
+    def to_dict(self):
+        return {'name': self.name, 'articleCount': self.article_count}
+
+    @classmethod
+    def list_used(cls, order='asc'):
+        """有文章的标签，只读取 tag 表"""
+        order_param = cls.id.asc() if order == 'asc' else cls.id.desc()
+        return cls.query.filter(cls.deleted.is_(False), cls.article_count > 0).order_by(order_param).all()
+
+
+register_suggest_model(Tag)
@@ -2,12 +2,14 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, IntegerField
 from wtforms.validators import InputRequired, Length, NumberRange
 
+from coco.utils.form_util import TagsRequired
+
 
 class ArticleDetailForm(FlaskForm):
     title = StringField(validators=[InputRequired(), Length(min=1, max=64)])
     content = StringField(validators=[InputRequired()])
     category_id = IntegerField(validators=[NumberRange(min=1)])
-    tags = StringField(validators=[InputRequired(), Length(min=1, max=200)])
+    tags = StringField(validators=[InputRequired(), Length(min=1, max=200), TagsRequired()])
 
 
 class CommentDetailForm(FlaskForm):
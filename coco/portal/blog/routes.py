@@ -1,16 +1,20 @@
-from collections import defaultdict
-from datetime import timedelta
+from datetime import datetime, timedelta
 
-from flask import Blueprint, request, url_for
+from flask import Blueprint, current_app, request, url_for
 from flask_login import login_required, current_user
 
 from coco.utils.json_util import gen_success_json, gen_error_json
-from coco.utils.other_utils import permission_required, page_meta_data
+from coco.utils.other_utils import permission_required, page_meta_data, encode_cursor, decode_cursor
 from coco.models.auth_user import UserGroupPermission
 from coco.models.category import Category
-from coco.models.article import Article
+from coco.models.article import Article, ARCHIVE_CACHE
 from coco.models.comment import Comment
+from coco.models.tag import Tag
+from coco.models.article_tag import ArticleTag
+from coco.model_cache import members_version, row_versions, table_version
+from coco.response_cache import cached_response, depends_on
 from coco.const import Constant
+from coco.search import SearchUnavailableError
 from coco import errors
 from .forms import CommentDetailForm, ArticleDetailForm
 
@@ -18,25 +22,127 @@ from .forms import CommentDetailForm, ArticleDetailForm
 blueprint = Blueprint('main', __name__)
 
 
+def _search_filters(args):
+    """解析搜索的过滤参数，日期为东八区的 YYYY-MM-DD，结束日期包含当天"""
+    filters = {}
+    category_id = args.get('category', None)
+    if category_id is not None:
+        filters['category_id'] = int(category_id)
+    tag = args.get('tag', None)
+    if tag:
+        filters['tags'] = tag
+    start = args.get('start', None)
+    end = args.get('end', None)
+    if start or end:
+        offset = timedelta(hours=8)
+        filters['created_time'] = (
+            datetime.strptime(start, '%Y-%m-%d') - offset if start else None,
+            datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) - offset if end else None,
+        )
+    return filters
+
+
+# total 参数对应的统计方式
+TOTAL_COUNT_MODES = {
+    '0': None,
+    '1': 'exact',
+    'exact': 'exact',
+    'estimate': 'estimate',
+}
+
+
+def _pagination_args(args):
+    """返回 (page, after, count)
+
+    带 after 参数时使用游标分页，值为上一页返回的 nextCursor，为空表示第一页；
+    OFFSET 分页默认统计精确的总数，游标分页默认不统计，total=1 时统计精确的总数，
+    total=estimate 时返回估算值。参数格式错误时抛出 ValueError。
+    """
+    page = args.get('page', default=1, type=int)
+    after = None
+    if 'after' in args:
+        after = decode_cursor(args['after']) if args['after'] else []
+    count = 'exact' if after is None else None
+    if 'total' in args:
+        count = TOTAL_COUNT_MODES.get(args['total'], count)
+    return page, after, count
+
+
+def _pagination_meta_data(page, page_size, pagination):
+    next_cursor = encode_cursor(pagination.next_after) if pagination.next_after is not None else None
+    return page_meta_data(page, page_size, pagination.total, next_cursor, pagination.approximate)
+
+
+def _depends_on_articles(rows, *names):
+    """文章列表依赖页面中的每篇文章，以及文章的增删和归属变化（新文章会出现在列表中）"""
+    depends_on(members_version(Article.__tablename__), *names)
+    for row in rows:
+        depends_on(*row_versions(Article.__tablename__, row.id))
+
+
+def _count_view(article_id):
+    current_app.view_counter.incr(article_id)
+
+
 @blueprint.route('/articles/search', methods=['GET'])
 def search_articles():
     keyword = request.args.get('query', None)
     if not keyword:
         return gen_error_json(errors.QUERY_WORD_NOT_FOUND)
     page = request.args.get('page', 1, type=int)
+    after = request.args.get('after', None)
+    if after is not None:
+        try:
+            after = decode_cursor(after)
+        except ValueError:
+            return gen_error_json(errors.INVALID_CURSOR)
+    try:
+        filters = _search_filters(request.args)
+    except ValueError:
+        return gen_error_json(errors.FILTER_TYPE_ERROR)
+    # full=1 时从数据库读取完整文章，否则直接使用索引中的字段
+    full = request.args.get('full', 0, type=int) == 1
+    # facets=1 时在同一次查询中返回按分类、标签和月份的统计
+    facets = request.args.get('facets', 0, type=int) == 1
     page_size = Constant.ARTICLE_PAGE_SIZE
-    articles, total = Article.search(keyword, page, page_size)
-    articles_json = [article.to_dict() for article in articles]
+    try:
+        result = Article.search(keyword, page, page_size, after=after, load=full, filters=filters, facets=facets)
+    except SearchUnavailableError:
+        return gen_error_json(errors.SEARCH_UNAVAILABLE)
+    if full:
+        articles_json = [article.to_summary_dict() for article in result.items]
+    else:
+        articles_json = [Article.search_document_to_dict(document) for document in result.items]
     data = {
         'articles': articles_json
     }
-    data.update(page_meta_data(page, page_size, total))
+    if facets:
+        data['facets'] = result.facets
+    total, next_after = result.total, result.next_after
+    next_cursor = encode_cursor(next_after) if next_after is not None else None
+    data.update(page_meta_data(page, page_size, total, next_cursor))
+    return gen_success_json(data)
+
+
+@blueprint.route('/articles/suggest', methods=['GET'])
+def suggest_articles():
+    """搜索输入提示，按前缀匹配文章标题和标签"""
+    prefix = request.args.get('prefix', '').strip()
+    if not prefix:
+        return gen_error_json(errors.QUERY_WORD_NOT_FOUND)
+    size = current_app.config['SUGGEST_SIZE']
+    limit = max(1, min(request.args.get('limit', size, type=int), size))
+    data = {
+        'suggestions': current_app.suggester.suggest(prefix, limit)
+    }
     return gen_success_json(data)
 
 
 @blueprint.route('/categories/', methods=['GET'])
+@cached_response(validate=(Category, Article))
 def category_list():
-    categories = Category.list_all(deleted=False)
+    categories = Category.list_all(deleted=False, cached=True)
+    depends_on(table_version(Category.__tablename__))
     data = {
         'categories': [category.to_dict() for category in categories]
     }
@@ -44,126 +150,162 @@ def category_list():
 
 
 @blueprint.route('/tags/', methods=['GET'])
+@cached_response(validate=(Tag, ArticleTag))
 def tag_list():
-    tags_list = Article.list_tags(deleted=False)
-    tags_set = set()
-    for t in tags_list:
-        tag_list = t[0].split(',') if t[0] else []
-        for tag in tag_list:
-            tags_set.add(tag)
+    tags = Tag.list_used()
+    depends_on(table_version(Tag.__tablename__))
     data = {
-        'tags': list(tags_set)
+        'tags': [tag.to_dict() for tag in tags]
     }
     return gen_success_json(data)
 
 
+def _build_archive(year):
+    # 只调用一次 url_for，其余文章替换其中的 slug
+    placeholder = '0' * 16
+    url = url_for('main.article_detail', article_slug=placeholder, _external=True)
+    archive_dict = {}
+    for month, articles in Article.archive(year):
+        archive_dict[f'{month.year}年{month.month}月'] = [
+            {'title': article['title'], 'url': url.replace(placeholder, article['slug'])}
+            for article in articles
+        ]
+    return {'archive': archive_dict}
+
+
 @blueprint.route('/archive', methods=['GET'])
+@cached_response(validate=(Article,))
 def archive():
-    articles = Article.list_all(deleted=False, order='desc')
-    archive_dict = defaultdict(list)
-    for article in articles:
-        article_create_datetime = article.created_time + timedelta(hours=8)
-        archive_date_str = (f'{article_create_datetime.year}年'
-                            f'{article_create_datetime.month}月')
-        article_json = {
-            'title': article.title,
-            'url': url_for(
-                'main.article_detail',
-                article_slug=article.slug,
-                _external=True
-            )
-        }
-        archive_dict[archive_date_str].append(article_json)
-    data = {
-        'archive': archive_dict
-    }
+    year = request.args.get('year', None)
+    if year is not None:
+        try:
+            year = int(year)
+        except ValueError:
+            return gen_error_json(errors.FILTER_TYPE_ERROR)
+        if not 1 < year < 9999:
+            return gen_error_json(errors.FILTER_TYPE_ERROR)
+    # 结果包含完整的 URL，按访问的域名分别缓存
+    key = (ARCHIVE_CACHE, year, request.host_url)
+    data = current_app.result_cache.get_or_build(key, lambda: _build_archive(year))
+    depends_on(table_version(Article.__tablename__))
     return gen_success_json(data)
 
 
 @blueprint.route('/articles/<string:article_slug>', methods=['GET'])
+@cached_response(on_hit=_count_view, validate=(Article, ArticleTag))
 def article_detail(article_slug):
-    article = Article.get_by_slug(article_slug, deleted=False)
+    # 只读接口直接使用查询结果的行，不创建模型实例
+    article = Article.get_row_by_slug(article_slug, deleted=False)
     if not article:
         return gen_error_json(errors.ARTICLE_NOT_EXISTS)
 
-    view_count = article.view_count + 1
-    article.update(view_count=view_count)
+    # 浏览数交给 view_counter 批量累加，不再每次浏览都 UPDATE 并提交
+    view_counter = current_app.view_counter
+    article_json = Article.row_to_dict(article, view_counter.pending(article.id) + 1)
+    view_counter.incr(article.id)
+    article_json['tags'] = Article.tag_names(article.id)
+    # 标签的变化通过 article_tag 的 __cache_parents__ 记录为文章的变化；缓存的浏览数在失效前不变
+    depends_on(*row_versions(Article.__tablename__, article.id), article_id=article.id)
     data = {
-        'article': article.to_dict()
+        'article': article_json
     }
     return gen_success_json(data)
 
 
 @blueprint.route('/articles/', methods=['GET'])
+@cached_response(validate=(Article,))
 def article_list():
-    page = request.args.get('page', default=1, type=int)
     page_size = Constant.ARTICLE_PAGE_SIZE
-    pagination = Article.paginate(
-        deleted=False,
-        order='desc',
-        page=page,
-        per_page=page_size
-    )
-    articles = pagination.items
-    articles_json = [article.to_dict() for article in articles]
+    try:
+        page, after, count = _pagination_args(request.args)
+        pagination = Article.paginate(
+            deleted=False,
+            order='desc',
+            page=page,
+            per_page=page_size,
+            after=after,
+            count=count,
+            rows=True
+        )
+    except ValueError:
+        return gen_error_json(errors.INVALID_CURSOR)
+    _depends_on_articles(pagination.items)
     data = {
-        'articles': articles_json
+        'articles': Article.rows_to_summary_dicts(pagination.items)
     }
-    data.update(page_meta_data(page, page_size, pagination.total))
+    data.update(_pagination_meta_data(page, page_size, pagination))
     return gen_success_json(data)
 
 
 @blueprint.route('/categories/<int:category_id>/articles/', methods=['GET'])
+@cached_response(validate=(Article, Category))
 def article_list_by_category_id(category_id):
-    category = Category.get_by_id(category_id, deleted=False)
+    category = Category.get_by_id(category_id, deleted=False, cached=True)
     if not category:
         return gen_error_json(errors.CATEGORY_NOT_EXISTS)
-    page = request.args.get('page', default=1, type=int)
     page_size = Constant.ARTICLE_PAGE_SIZE
-    pagination = category.paginate_articles(
-        order='desc', page=page, per_page=page_size
-    )
-    articles = pagination.items
+    try:
+        page, after, count = _pagination_args(request.args)
+        pagination = category.paginate_articles(
+            order='desc', page=page, per_page=page_size, after=after, count=count, rows=True
+        )
+    except ValueError:
+        return gen_error_json(errors.INVALID_CURSOR)
+    _depends_on_articles(pagination.items, *row_versions(Category.__tablename__, category.id))
     data = {
-        'articles': [article.to_dict() for article in articles]
+        'articles': Article.rows_to_summary_dicts(pagination.items)
     }
-    data.update(page_meta_data(page, page_size, pagination.total))
+    data.update(_pagination_meta_data(page, page_size, pagination))
     return gen_success_json(data)
 
 
 @blueprint.route('/tags/<string:tag>/articles/', methods=['GET'])
+@cached_response(validate=(Article, ArticleTag, Tag))
 def article_list_by_tag(tag):
-    page = request.args.get('page', default=1, type=int)
     page_size = Constant.ARTICLE_PAGE_SIZE
-    pagination = Article.paginate_by_tag(
-        tag,
-        order='desc',
-        page=page,
-        per_page=page_size
-    )
-    articles = pagination.items
+    try:
+        page, after, count = _pagination_args(request.args)
+        pagination = Article.paginate_by_tag(
+            tag,
+            order='desc',
+            page=page,
+            per_page=page_size,
+            after=after,
+            count=count,
+            rows=True
+        )
+    except ValueError:
+        return gen_error_json(errors.INVALID_CURSOR)
+    # 文章增减标签时 article_tag 的归属变化
+    _depends_on_articles(pagination.items, members_version(ArticleTag.__tablename__))
     data = {
-        'articles': [article.to_dict() for article in articles]
+        'articles': Article.rows_to_summary_dicts(pagination.items)
     }
-    data.update(page_meta_data(page, page_size, pagination.total))
+    data.update(_pagination_meta_data(page, page_size, pagination))
     return gen_success_json(data)
 
 
 @blueprint.route('/articles/<string:article_slug>/comments', methods=['GET'])
+@cached_response(validate=(Article, Comment))
 def comment_list_by_article_slug(article_slug):
-    article = Article.get_by_slug(article_slug, deleted=False)
+    article = Article.get_by_slug(article_slug, deleted=False, cached=True)
     if not article:
         return gen_error_json(errors.ARTICLE_NOT_EXISTS)
-    page = request.args.get('page', default=1, type=int)
     page_size = Constant.COMMENT_PAGE_SIZE
-    pagination = article.paginate_comments(
-        order='desc', page=page, per_page=page_size
-    )
+    try:
+        page, after, count = _pagination_args(request.args)
+        pagination = article.paginate_comments(
+            order='desc', page=page, per_page=page_size, after=after, count=count
+        )
+    except ValueError:
+        return gen_error_json(errors.INVALID_CURSOR)
     comments = pagination.items
+    # 评论的变化通过 comment 的 __cache_parents__ 记录为文章的变化
+    depends_on(*row_versions(Article.__tablename__, article.id))
     data = {
         'comments': [comment.to_dict() for comment in comments]
     }
-    data.update(page_meta_data(page, page_size, pagination.total))
+    data.update(_pagination_meta_data(page, page_size, pagination))
     return gen_success_json(data)
 
 
@@ -178,7 +320,7 @@ def publish_article():
 
     Article.create(
         title=form.title.data,
-        body_text=form.body.data,
+        content=form.content.data,
         category_id=form.category_id.data,
         author_id=current_user.id,
         tags=form.tags.data
@@ -199,7 +341,7 @@ def edit_article(article_slug):
         return gen_error_json(errors.ARTICLE_NOT_EXISTS)
     article.update(
         title=form.title.data,
-        body_text=form.body.data,
+        content=form.content.data,
         category_id=form.category_id.data,
         tags=form.tags.data
     )
@@ -231,8 +373,9 @@ def publish_comment(article_slug):
     if not form.validate_on_submit():
         return gen_error_json(errors.ILLEGAL_FORM)
     Comment.create(
-        body=form.body.data,
-        author_id=current_user.id,
+        content=form.content.data,
+        nickname=current_user.username,
+        email=current_user.email,
         article_id=article.id
     )
     return gen_success_json()
@@ -246,10 +389,11 @@ def modify_comment(comment_id):
     comment = Comment.get_by_id(comment_id, deleted=False)
     if not comment:
         return gen_error_json(errors.COMMENT_NOT_EXISTS)
-    if comment.author_id != current_user.id:
+    # 评论没有作者 ID，以邮箱判断是否为本人发表
+    if comment.email != current_user.email:
         return gen_error_json(errors.USER_PERMISSION_DENIED)
     form = CommentDetailForm(meta={'csrf': False})
     if not form.validate_on_submit():
         return gen_error_json(errors.ILLEGAL_FORM)
-    comment.update(body=form.body.data)
+    comment.update(content=form.content.data)
     return gen_success_json()
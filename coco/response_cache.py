@@ -0,0 +1,151 @@
+import gzip
+from collections import namedtuple
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+from flask_login import current_user
+
+from coco.conditional import is_not_modified, not_modified_response, probe, set_validators
+from coco.model_cache import MODEL_VERSION
+
+
+# encoding 为 'gzip' 时 body 是压缩后的内容；meta 为视图记录的值，命中时传给 on_hit；
+# validators 为生成响应时的 ETag 和 Last-Modified，没有时为 None
+CachedResponse = namedtuple(
+    'CachedResponse', ['status', 'mimetype', 'body', 'encoding', 'meta', 'versions', 'validators']
+)
+
+
+class ResponseCache:
+    """公开 GET 接口的完整响应缓存
+
+    键为 (域名, 路径, 查询字符串)，值为序列化后的响应体，达到 compress_min_size 字节时保存 gzip 压缩后的内容，
+    客户端支持 gzip 时直接返回，否则解压后返回。
+    视图用 depends_on 声明响应包含的实体对应的版本号名称（见 model_cache），任一版本号变化后响应失效，
+    因此修改一篇文章只会让包含它的页面失效。没有声明的响应（如错误信息）不缓存。
+    """
+
+    def __init__(self, backend, ttl=60, compress_min_size=500):
+        self.backend = backend
+        self.ttl = ttl
+        self.compress_min_size = compress_min_size
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.cache_backend, app.config['RESPONSE_CACHE_TTL'], app.config['RESPONSE_CACHE_COMPRESS_MIN_SIZE'])
+
+    def get(self, key):
+        entry = self.backend.get(('response',) + key)
+        if entry is not None and all(self.backend.get_version(name) == version for name, version in entry.versions):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, response, names, meta, version, validators=None):
+        """version 为生成响应之前的 MODEL_VERSION，期间有提交时不保存，避免以新版本号缓存旧数据"""
+        versions = [(name, self.backend.get_version(name)) for name in names]
+        if self.backend.get_version(MODEL_VERSION) != version:
+            return
+        body, encoding = response.get_data(), None
+        if len(body) >= self.compress_min_size:
+            body, encoding = gzip.compress(body, 6), 'gzip'
+        entry = CachedResponse(response.status_code, response.mimetype, body, encoding, meta, versions, validators)
+        if self.backend.set(('response',) + key, entry, self.ttl):
+            self.stored += 1
+
+    @staticmethod
+    def to_response(entry):
+        if entry.validators is not None and is_not_modified(entry.validators):
+            return not_modified_response(entry.validators)
+        body = entry.body
+        response = current_app.response_class(mimetype=entry.mimetype, status=entry.status)
+        if entry.encoding is not None:
+            if entry.encoding in request.accept_encodings:
+                response.headers['Content-Encoding'] = entry.encoding
+            else:
+                body = gzip.decompress(body)
+        response.set_data(body)
+        if entry.validators is not None:
+            set_validators(response, entry.validators)
+        return response
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stored': self.stored,
+        }
+
+
+def depends_on(*names, **meta):
+    """视图中调用，声明响应依赖的版本号名称，可以多次调用；meta 在缓存命中时作为参数传给 on_hit"""
+    if 'response_dependencies' in g:
+        g.response_dependencies.update(names)
+        g.response_meta.update(meta)
+
+
+def _not_modified(validators):
+    return validators is not None and is_not_modified(validators)
+
+
+def _finish(response, validators):
+    """视图返回正常结果时加上校验值，条件请求满足时改为 304"""
+    if validators is None or response.status_code != 200:
+        return response
+    if is_not_modified(validators):
+        return not_modified_response(validators)
+    return set_validators(response, validators)
+
+
+def cached_response(on_hit=None, validate=()):
+    """缓存匿名用户的 GET 响应，放在 @blueprint.route 下面
+
+    响应头 X-Cache 为 HIT、MISS 或 BYPASS（已登录用户或没有开启缓存）。
+    命中时不执行视图，需要在每次访问时执行的操作（如累加浏览数）放在 on_hit 中。
+    validate 为响应读取的模型，由它们的 max(updated_time) 生成 ETag 和 Last-Modified（见 conditional），
+    条件请求满足时返回 304：命中时使用缓存的校验值，不查询数据库；未命中时在执行视图之前检查，
+    有 on_hit 的视图仍然执行，保证每次访问都调用 on_hit。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.response_cache
+            if cache is None or request.method != 'GET' or current_user.is_authenticated:
+                validators = probe(validate) if validate and request.method == 'GET' else None
+                if on_hit is None and _not_modified(validators):
+                    response = not_modified_response(validators)
+                else:
+                    response = _finish(make_response(view(*args, **kwargs)), validators)
+                response.headers['X-Cache'] = 'BYPASS'
+                return response
+
+            key = (request.host, request.path, request.query_string)
+            entry = cache.get(key)
+            if entry is not None:
+                if on_hit is not None:
+                    on_hit(**entry.meta)
+                response = cache.to_response(entry)
+                response.headers['X-Cache'] = 'HIT'
+            else:
+                version = cache.backend.get_version(MODEL_VERSION)
+                validators = probe(validate) if validate else None
+                if on_hit is None and _not_modified(validators):
+                    response = not_modified_response(validators)
+                else:
+                    g.response_dependencies, g.response_meta = set(), {}
+                    try:
+                        response = make_response(view(*args, **kwargs))
+                    finally:
+                        names, meta = g.pop('response_dependencies'), g.pop('response_meta')
+                    if names and response.status_code == 200 and 'Set-Cookie' not in response.headers:
+                        cache.put(key, response, sorted(names), meta, version, validators)
+                    response = _finish(response, validators)
+                response.headers['X-Cache'] = 'MISS'
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
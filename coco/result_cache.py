@@ -0,0 +1,53 @@
+from flask import current_app, has_app_context
+
+from coco.extensions import db
+
+
+class ResultCache:
+    """按名称分组的结果缓存
+
+    键为 (名称, 参数...)，例如 ('archive', 2018)，结果保存在缓存后端中。每个名称有一个版本号，
+    提交钩子在相关数据变化后增加版本号，同名的全部结果随之失效。
+    版本号保存在缓存后端中，使用共享的后端时所有进程立即看到失效。
+    """
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.cache_backend, app.config['RESULT_CACHE_TTL'])
+
+    def get_or_build(self, key, build):
+        """返回缓存的结果，没有或已失效时调用 build() 生成"""
+        # 先读取版本号，生成期间失效的结果记录的是旧版本号，下次读取时会重新生成
+        version = self.backend.get_version(f'result:{key[0]}')
+        entry = self.backend.get(('result',) + key)
+        if entry is not None and entry[1] == version:
+            return entry[0]
+        value = build()
+        self.backend.set(('result',) + key, (value, version), self.ttl)
+        return value
+
+    def invalidate(self, names):
+        self.backend.incr_versions([f'result:{name}' for name in names])
+
+
+def mark_stale(session, name):
+    """在 flush 钩子中调用，事务提交后名为 name 的缓存结果失效"""
+    session.info.setdefault('stale_results', set()).add(name)
+
+
+def _after_commit(session):
+    names = session.info.pop('stale_results', None)
+    if names and has_app_context() and current_app.result_cache is not None:
+        current_app.result_cache.invalidate(names)
+
+
+def _after_rollback(session):
+    session.info.pop('stale_results', None)
+
+
+db.event.listen(db.session, 'after_commit', _after_commit)
+db.event.listen(db.session, 'after_rollback', _after_rollback)
@@ -0,0 +1,28 @@
+from flask import current_app
+
+from .base import SearchBackend, SearchResult, SearchUnavailableError
+from .breaker import CircuitBreaker, CircuitOpenError
+from .elastic import (
+    ElasticsearchBackend, BulkIndexer, create_client, create_versioned_index, bulk_load, publish_index
+)
+from .local import LocalBackend
+from .postgres import PostgresBackend
+from .suggest import Suggester, register_suggest_model
+
+
+BACKENDS = {
+    'elasticsearch': ElasticsearchBackend,
+    'postgres': PostgresBackend,
+    'local': LocalBackend,
+}
+
+
+def init_search_backend(app):
+    name = app.config['SEARCH_BACKEND']
+    backend = BACKENDS[name].from_app(app) if name else None
+    setattr(app, 'search_backend', backend)
+    setattr(app, 'suggester', Suggester.from_app(app))
+
+
+def get_search_backend():
+    return current_app.search_backend
@@ -0,0 +1,60 @@
+import re
+
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[^\W_{_CJK}]+')
+
+
+def _is_cjk(word):
+    return re.match(f'[{_CJK}]', word) is not None
+
+
+def tokenize(text, for_query=False):
+    """把文本切分为检索词，text 可以是字符串列表（如标签）
+
+    英文和数字按单词切分并转为小写；中文没有分词器，按二元组（bigram）切分，
+    文档中额外保留单字，保证单字查询也能命中。查询只使用二元组，减少误命中。
+    """
+    if isinstance(text, (list, tuple)):
+        # 各项之间用空格分开，不会产生跨项的二元组
+        text = ' '.join(text)
+    tokens = []
+    for match in _TOKEN_RE.finditer(text or ''):
+        word = match.group().lower()
+        if not _is_cjk(word) or len(word) == 1:
+            tokens.append(word)
+            continue
+        if not for_query:
+            tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def highlight_fragments(value, tokens):
+    """value 为字符串或字符串列表，返回命中的片段列表，与 Elasticsearch 的 highlight 一致"""
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [fragment for fragment in (highlight(text, tokens) for text in values) if fragment]
+
+
+def highlight(text, tokens, pre_tag='<em>', post_tag='</em>'):
+    """用 pre_tag/post_tag 包围 text 中出现的检索词，没有命中时返回 None"""
+    if not text or not tokens:
+        return None
+    lower_text = text.lower()
+    marked = [False] * len(text)
+    for token in set(tokens):
+        start = lower_text.find(token)
+        while start != -1:
+            for i in range(start, start + len(token)):
+                marked[i] = True
+            start = lower_text.find(token, start + 1)
+    if not any(marked):
+        return None
+    parts = []
+    for i, char in enumerate(text):
+        if marked[i] and (i == 0 or not marked[i - 1]):
+            parts.append(pre_tag)
+        parts.append(char)
+        if marked[i] and (i == len(text) - 1 or not marked[i + 1]):
+            parts.append(post_tag)
+    return ''.join(parts)
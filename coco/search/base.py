@@ -0,0 +1,80 @@
+import abc
+from collections import namedtuple
+from datetime import timedelta
+
+
+# 查询结果，facets 为 {分面名: [{'value': 值, 'count': 数量}]}，没有请求分面统计时为 None
+SearchResult = namedtuple('SearchResult', ['items', 'total', 'next_after', 'facets'])
+
+# 每个分面最多返回的取值数
+FACET_SIZE = 20
+
+# 时间按东八区展示，按月分面以东八区的月份为准
+TIME_ZONE = '+08:00'
+UTC_OFFSET = timedelta(hours=8)
+
+
+class SearchUnavailableError(Exception):
+    """搜索服务暂时不可用，调用方应当降级处理而不是等待"""
+    pass
+
+
+class SearchBackend(abc.ABC):
+    """搜索后端
+
+    SearchableMixin 的提交钩子和查询都通过当前应用的搜索后端完成。
+    文档为 SearchableMixin.search_document 生成的字典。
+
+    filters 为 {文档字段: 值}，值为 (起, 止) 时表示左闭右开的范围，任意一端可以为 None；
+    facets 为 True 时在同一次查询中按模型的 __search_facets__ 统计各分面的数量。
+    """
+
+    @classmethod
+    def from_app(cls, app):
+        """根据应用配置创建后端，配置不完整时返回 None（不启用搜索）"""
+        return cls()
+
+    def prepare(self, model, obj, values=None):
+        """flush 之前对需要更新索引的新增或修改对象调用，可以为对象设置额外的列
+
+        values 为 mark_search_changed 传入的字段值，其余字段从 obj 读取
+        """
+        pass
+
+    def apply_changes(self, model, changes):
+        """提交之后调用，changes 为 {id: 文档}，文档为 None 表示从索引中删除"""
+        pass
+
+    def sync_changes(self, model, changes, chunk_size=500):
+        """对账时调用，changes 为 (id, 文档) 的迭代器，写入完成后返回处理的记录数"""
+        count = 0
+        chunk = {}
+        for doc_id, document in changes:
+            chunk[doc_id] = document
+            if len(chunk) >= chunk_size:
+                self.apply_changes(model, chunk)
+                count += len(chunk)
+                chunk = {}
+        if chunk:
+            self.apply_changes(model, chunk)
+            count += len(chunk)
+        return count
+
+    @abc.abstractmethod
+    def query_ids(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        """按相关度返回 SearchResult，items 为 id 列表，after 为上一页返回的 next_after"""
+        pass
+
+    @abc.abstractmethod
+    def query_documents(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        """返回 SearchResult，items 为包含 __search_source__ 字段和 highlights 的文档"""
+        pass
+
+    def status(self):
+        """返回供运维查看的运行状态"""
+        return {}
+
+    @abc.abstractmethod
+    def rebuild(self, model, workers=1, chunk_size=500):
+        """重建整个索引，返回 (索引名, 写入的文档数)"""
+        pass
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续失败 failure_threshold 次后断开，断开期间的调用直接抛出 CircuitOpenError；
+    reset_timeout 秒后进入半开状态，只放行一次试探调用，成功则恢复，失败则重新计时。
+    is_failure 判断异常是否说明服务不可用，其它异常只是请求本身的错误，不计入失败次数。
+    同时记录最近 window 次调用的耗时，供 stats 输出。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, window=100, is_failure=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda error: True)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_time = 0
+        self._probing = False
+        self._calls = 0
+        self._errors = 0
+        self._rejected = 0
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_time >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def allow(self):
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._calls += 1
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._calls += 1
+            self._errors += 1
+            self._failures += 1
+            # 半开状态下试探失败立即重新断开
+            if self._state != self.CLOSED or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_time = time.monotonic()
+            self._probing = False
+
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError('circuit is open')
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self.record_failure(time.monotonic() - start)
+            else:
+                self.record_success(time.monotonic() - start)
+            raise
+        self.record_success(time.monotonic() - start)
+        return result
+
+    def stats(self):
+        """返回状态、计数和最近调用的耗时（毫秒）"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'state': self._current_state(),
+                'consecutiveFailures': self._failures,
+                'calls': self._calls,
+                'errors': self._errors,
+                'rejected': self._rejected,
+            }
+        if latencies:
+            stats['latency'] = {
+                'count': len(latencies),
+                'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+                'p50': round(latencies[len(latencies) // 2] * 1000, 2),
+                'p95': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            }
+        return stats
@@ -0,0 +1,509 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from elasticsearch import Elasticsearch, ConnectionError as ESConnectionError, TransportError
+from elasticsearch.helpers import bulk, streaming_bulk, BulkIndexError
+from elasticsearch_dsl import Search
+from urllib3 import Timeout
+
+from .base import SearchBackend, SearchResult, SearchUnavailableError, FACET_SIZE, TIME_ZONE
+from .breaker import CircuitBreaker, CircuitOpenError
+
+
+# bulk 响应中这些状态码表示可以重试（限流或服务端错误）
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# 重建时补写变更的起点提前的秒数，覆盖开始之前 flush、之后才提交的事务
+REPLAY_OVERLAP = 60
+
+
+def is_unavailable(error):
+    """连接失败、超时、限流和服务端错误说明 Elasticsearch 不可用，查询语法等错误不计入熔断"""
+    if isinstance(error, ESConnectionError):
+        return True
+    return isinstance(error, TransportError) and error.status_code in RETRYABLE_STATUS
+
+
+def create_client(app):
+    """按配置的超时、连接池大小和重试次数创建客户端，没有配置地址时返回 None"""
+    url = app.config['ELASTICSEARCH_URL']
+    if not url:
+        return None
+    return Elasticsearch(
+        [url],
+        timeout=Timeout(
+            connect=app.config['ELASTICSEARCH_CONNECT_TIMEOUT'],
+            read=app.config['ELASTICSEARCH_READ_TIMEOUT'],
+        ),
+        maxsize=app.config['ELASTICSEARCH_MAXSIZE'],
+        max_retries=app.config['ELASTICSEARCH_MAX_RETRIES'],
+        # 超时说明集群已经很慢，换节点重试只会让请求等待更久
+        retry_on_timeout=False,
+    )
+
+
+class BulkIndexer:
+    """Elasticsearch 批量索引队列
+
+    提交的索引操作先按 (index, id) 合并到内存队列中，同一文档只保留最后一次操作；
+    后台线程在队列达到 batch_size 条或等待超过 flush_interval 秒后通过 bulk API 发送。
+    asynchronous 为 False 时在调用线程中立即发送，供测试和命令行使用。
+
+    Elasticsearch 不可用或熔断器断开时，操作留在队列中等待恢复后再发送，
+    队列超过 max_pending 条时丢弃最早的操作，由对账任务补齐。
+    """
+
+    def __init__(self, client, batch_size=500, flush_interval=1.0, max_retries=3,
+                 retry_backoff=0.5, asynchronous=True, logger=None, breaker=None, max_pending=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.asynchronous = asynchronous
+        self.logger = logger
+        self.breaker = breaker or CircuitBreaker(is_failure=is_unavailable)
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._pid = None
+
+    @classmethod
+    def from_app(cls, app, breaker=None):
+        indexer = cls(
+            app.elasticsearch,
+            batch_size=app.config['SEARCH_INDEX_BATCH_SIZE'],
+            flush_interval=app.config['SEARCH_INDEX_FLUSH_INTERVAL'],
+            max_retries=app.config['SEARCH_INDEX_MAX_RETRIES'],
+            asynchronous=app.config['SEARCH_INDEX_ASYNC'],
+            logger=app.logger,
+            breaker=breaker,
+            max_pending=app.config['SEARCH_INDEX_MAX_PENDING'],
+        )
+        atexit.register(indexer.close, app.config['SEARCH_INDEX_DRAIN_TIMEOUT'])
+        return indexer
+
+    def submit(self, action):
+        self.submit_many([action])
+
+    def submit_many(self, actions):
+        with self._cond:
+            if self._closed and self.asynchronous:
+                raise RuntimeError('BulkIndexer is closed')
+            for action in actions:
+                key = (action['_index'], action['_id'])
+                self._pending.pop(key, None)
+                self._pending[key] = action
+            self._trim()
+            if self.asynchronous:
+                self._ensure_worker()
+                self._cond.notify()
+        if not self.asynchronous:
+            self.flush()
+
+    def flush(self):
+        """在调用线程中发送队列中的全部操作，Elasticsearch 不可用时提前返回"""
+        while True:
+            with self._cond:
+                actions = self._take(self.batch_size)
+            if not actions or not self._send(actions):
+                return
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def close(self, timeout=None):
+        """停止接收新操作，并等待后台线程把队列发送完毕"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+        if thread is None or not thread.is_alive():
+            self.flush()
+        pending = len(self._pending)
+        if pending and self.logger:
+            self.logger.error(f'BulkIndexer closed with {pending} pending actions')
+
+    def _ensure_worker(self):
+        # 进程 fork 之后（如 gunicorn preload）父进程的线程不会被继承，需要重新启动
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='search-bulk-indexer', daemon=True)
+        self._thread.start()
+
+    def _trim(self):
+        if self.max_pending is None or len(self._pending) <= self.max_pending:
+            return
+        dropped = len(self._pending) - self.max_pending
+        for _ in range(dropped):
+            self._pending.popitem(last=False)
+        if self.logger:
+            self.logger.error(f'Dropped {dropped} search index actions, pending queue is full')
+
+    def _defer(self, actions):
+        """把未发送的操作放回队列头部，队列中已有同一文档更新的操作时丢弃旧操作"""
+        with self._cond:
+            for action in reversed(actions):
+                key = (action['_index'], action['_id'])
+                if key not in self._pending:
+                    self._pending[key] = action
+                    self._pending.move_to_end(key, last=False)
+            self._trim()
+
+    def _take(self, size):
+        actions = []
+        while self._pending and len(actions) < size:
+            actions.append(self._pending.popitem(last=False)[1])
+        return actions
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._pending)
+                # 等待凑满一批，最多等待 flush_interval 秒
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.batch_size,
+                    timeout=self.flush_interval
+                )
+                actions = self._take(self.batch_size)
+                finished = self._closed and not self._pending
+            if actions and not self._send(actions):
+                with self._cond:
+                    # Elasticsearch 不可用，关闭时不再等待，否则间隔 flush_interval 后重试
+                    if self._closed:
+                        return
+                    self._cond.wait_for(lambda: self._closed, timeout=self.flush_interval)
+                continue
+            if finished:
+                return
+
+    def _send(self, actions):
+        """发送完成（包括放弃重试）时返回 True，Elasticsearch 不可用时把操作放回队列并返回 False"""
+        attempt = 0
+        while actions:
+            try:
+                _, errors = self.breaker.call(bulk, self.client, actions, raise_on_error=False)
+            except CircuitOpenError:
+                self._defer(actions)
+                return False
+            except (ESConnectionError, TransportError) as e:
+                if is_unavailable(e):
+                    self._defer(actions)
+                    return False
+                failed = actions
+                reason = e
+            else:
+                failed = self._retryable(actions, errors)
+                reason = errors
+            if not failed:
+                return True
+            attempt += 1
+            if attempt > self.max_retries:
+                if self.logger:
+                    self.logger.error(f'Dropped {len(failed)} search index actions: {reason}')
+                return True
+            time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            actions = failed
+
+    def _retryable(self, actions, errors):
+        retry_keys = set()
+        for error in errors:
+            op_type, item = next(iter(error.items()))
+            status = item.get('status')
+            if op_type == 'delete' and status == 404:
+                continue
+            if status in RETRYABLE_STATUS:
+                retry_keys.add((item['_index'], item['_id']))
+            elif self.logger:
+                self.logger.error(f'Search index action failed: {error}')
+        return [a for a in actions if (a['_index'], str(a['_id'])) in retry_keys]
+
+
+def create_versioned_index(client, alias):
+    """创建 {alias}_{时间戳} 索引，导入期间关闭 refresh 和副本以加快写入"""
+    index = f'{alias}_{datetime.utcnow():%Y%m%d%H%M%S%f}'
+    client.indices.create(index=index, body={
+        'settings': {
+            'index': {
+                'refresh_interval': '-1',
+                'number_of_replicas': 0,
+            }
+        }
+    })
+    return index
+
+
+def bulk_load(client, actions, chunk_size=500):
+    """通过 streaming bulk 写入，返回成功的操作数
+
+    删除不存在的文档不算失败，其它失败在全部发送后以 BulkIndexError 抛出。
+    """
+    count = 0
+    errors = []
+    for ok, item in streaming_bulk(client, actions, chunk_size=chunk_size,
+                                   max_retries=3, raise_on_error=False):
+        op_type, result = next(iter(item.items()))
+        if ok:
+            count += 1
+        elif not (op_type == 'delete' and result.get('status') == 404):
+            errors.append(item)
+    if errors:
+        raise BulkIndexError(f'{len(errors)} document(s) failed to index.', errors)
+    return count
+
+
+def publish_index(client, alias, index, replicas=1):
+    """恢复索引设置后把别名原子地切换到 index，并删除别名原先指向的索引"""
+    client.indices.put_settings(index=index, body={
+        'index': {
+            'refresh_interval': None,
+            'number_of_replicas': replicas,
+        }
+    })
+    client.indices.refresh(index=index)
+
+    actions = [{'add': {'index': index, 'alias': alias}}]
+    old_indexes = []
+    if client.indices.exists_alias(name=alias):
+        old_indexes = [i for i in client.indices.get_alias(name=alias) if i != index]
+        actions = [{'remove': {'index': i, 'alias': alias}} for i in old_indexes] + actions
+    elif client.indices.exists(index=alias):
+        # 引入别名之前直接以 alias 命名的索引，在同一个操作中删除
+        actions.insert(0, {'remove_index': {'index': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+    for old_index in old_indexes:
+        client.indices.delete(index=old_index)
+
+
+class ElasticsearchBackend(SearchBackend):
+    """以 Elasticsearch 作为搜索后端，索引名为表名对应的别名
+
+    查询和批量索引共用一个熔断器，熔断期间查询直接抛出 SearchUnavailableError，
+    索引操作留在 BulkIndexer 的队列中。
+    """
+
+    def __init__(self, client, indexer, max_result_window=10000, replicas=1, breaker=None):
+        self.client = client
+        self.indexer = indexer
+        self.max_result_window = max_result_window
+        self.replicas = replicas
+        self.breaker = breaker or indexer.breaker
+
+    @classmethod
+    def from_app(cls, app):
+        if not app.elasticsearch:
+            return None
+        breaker = CircuitBreaker(
+            failure_threshold=app.config['ELASTICSEARCH_BREAKER_THRESHOLD'],
+            reset_timeout=app.config['ELASTICSEARCH_BREAKER_RESET_TIMEOUT'],
+            is_failure=is_unavailable,
+        )
+        return cls(
+            app.elasticsearch,
+            BulkIndexer.from_app(app, breaker),
+            max_result_window=app.config['SEARCH_MAX_RESULT_WINDOW'],
+            replicas=app.config['SEARCH_INDEX_REPLICAS'],
+            breaker=breaker,
+        )
+
+    def status(self):
+        return {
+            'breaker': self.breaker.stats(),
+            'pendingActions': self.indexer.pending,
+        }
+
+    @staticmethod
+    def document_action(index, model, doc_id, document):
+        """document 为 None 时生成删除操作"""
+        action = {
+            '_op_type': 'index' if document is not None else 'delete',
+            '_index': index,
+            '_type': model.__tablename__,
+            '_id': doc_id,
+        }
+        if document is not None:
+            action['_source'] = document
+        return action
+
+    def apply_changes(self, model, changes):
+        # 索引操作交给后台队列批量发送，提交不必等待 Elasticsearch
+        index = model.__tablename__
+        self.indexer.submit_many([
+            self.document_action(index, model, doc_id, document)
+            for doc_id, document in changes.items()
+        ])
+
+    @staticmethod
+    def _field(model, field):
+        """字符串字段由动态映射生成 text 类型，精确过滤和聚合需要使用 keyword 子字段"""
+        for facet_field, kind in model.__search_facets__.values():
+            if facet_field == field and kind == 'keyword':
+                return f'{field}.keyword'
+        return field
+
+    def _build_search(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        """默认使用 from/size 分页，from + size 不能超过 max_result_window；
+        传入 after（上一页最后一条结果的排序值）时使用 search_after 翻页，不受窗口限制。
+
+        过滤条件放在 bool 查询的 filter 中，不参与打分并且可以被 Elasticsearch 缓存；
+        分面统计作为聚合与查询在同一个请求中返回。
+        """
+        # id 字段用于排序，保证 search_after 分页结果稳定
+        s = Search(using=self.client, index=model.__tablename__)\
+            .query('multi_match', query=expression, fields=model.__searchable__)\
+            .sort('_score', {'id': 'desc'})
+        for field, value in (filters or {}).items():
+            if isinstance(value, tuple):
+                start, end = value
+                bounds = {}
+                if start is not None:
+                    bounds['gte'] = start
+                if end is not None:
+                    bounds['lt'] = end
+                s = s.filter('range', **{field: bounds})
+            else:
+                s = s.filter('term', **{self._field(model, field): value})
+        if facets:
+            for name, (field, kind) in model.__search_facets__.items():
+                if kind == 'month':
+                    s.aggs.bucket(name, 'date_histogram', field=field, interval='month',
+                                  format='yyyy-MM', time_zone=TIME_ZONE, min_doc_count=1)
+                else:
+                    s.aggs.bucket(name, 'terms', field=self._field(model, field), size=FACET_SIZE)
+        if after is not None:
+            return s.extra(search_after=after)[:per_page]
+        start = (max(page, 1) - 1) * per_page
+        window = self.max_result_window
+        return s[start:start + min(per_page, window - start)] if start < window else s[0:0]
+
+    def _execute(self, model, s, per_page, facets):
+        try:
+            response = self.breaker.call(s.execute)
+        except CircuitOpenError as e:
+            raise SearchUnavailableError('Elasticsearch circuit is open') from e
+        except TransportError as e:
+            if is_unavailable(e):
+                raise SearchUnavailableError(str(e)) from e
+            raise
+        hits = response.hits
+        next_after = list(hits[-1].meta.sort) if len(hits) == per_page else None
+        facet_counts = None
+        if facets:
+            facet_counts = {}
+            for name, (_, kind) in model.__search_facets__.items():
+                buckets = getattr(response.aggregations, name).buckets
+                if kind == 'month':
+                    # date_histogram 按时间升序返回，最近的月份排在前面
+                    facet_counts[name] = [
+                        {'value': bucket.key_as_string, 'count': bucket.doc_count}
+                        for bucket in reversed(buckets)
+                    ]
+                else:
+                    facet_counts[name] = [
+                        {'value': bucket.key, 'count': bucket.doc_count}
+                        for bucket in buckets
+                    ]
+        return hits, hits.total, next_after, facet_counts
+
+    def query_ids(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        s = self._build_search(model, expression, page, per_page, after, filters, facets).source(False)
+        hits, total, next_after, facet_counts = self._execute(model, s, per_page, facets)
+        return SearchResult([int(hit.meta.id) for hit in hits], total, next_after, facet_counts)
+
+    def query_documents(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        s = self._build_search(model, expression, page, per_page, after, filters, facets)\
+            .source(includes=model.__search_source__)\
+            .highlight(*model.__searchable__, fragment_size=100, number_of_fragments=1)\
+            .highlight_options(pre_tags=['<em>'], post_tags=['</em>'])
+        hits, total, next_after, facet_counts = self._execute(model, s, per_page, facets)
+        documents = []
+        for hit in hits:
+            document = hit.to_dict()
+            document['id'] = int(hit.meta.id)
+            document['highlights'] = hit.meta.highlight.to_dict() if 'highlight' in hit.meta else {}
+            documents.append(document)
+        return SearchResult(documents, total, next_after, facet_counts)
+
+    def sync_changes(self, model, changes, chunk_size=500):
+        # 对账需要确认写入成功后才能推进水位，不经过后台队列
+        count = 0
+
+        def actions():
+            nonlocal count
+            for doc_id, document in changes:
+                count += 1
+                yield self.document_action(model.__tablename__, model, doc_id, document)
+
+        try:
+            self.breaker.call(bulk_load, self.client, actions(), chunk_size)
+        except CircuitOpenError as e:
+            raise SearchUnavailableError('Elasticsearch circuit is open') from e
+        return count
+
+    def load_range(self, model, index, first_id, last_id, chunk_size=500):
+        return bulk_load(self.client, (
+            self.document_action(index, model, document['id'], document)
+            for document in model.iter_search_documents(first_id, last_id, chunk_size)
+        ), chunk_size)
+
+    def replay_changes(self, model, index, since, chunk_size=500):
+        """把 updated_time 不早于 since 的记录写入 index（包括软删除的记录），返回写入的操作数"""
+        return bulk_load(self.client, (
+            self.document_action(index, model, doc_id, document)
+            for doc_id, document in model.iter_changed_documents(since, chunk_size)
+        ), chunk_size)
+
+    def rebuild(self, model, workers=1, chunk_size=500):
+        """在新的版本化索引中重建全部文档，完成后把与表同名的别名原子地切换过去
+
+        workers 大于 1 时按主键范围分给多个进程并行导入。导入失败时删除新索引，
+        线上别名不受影响。
+
+        导入期间提交钩子仍然写入旧索引，这些变更按 updated_time 补写两次：切换前补到新索引，
+        切换后再补一次切换前这段时间的变更，此后的提交直接写入新索引。
+        补写只能发现仍在表中的记录，硬删除的记录会留在新索引中，
+        需要删除的记录应当软删除（deleted 并更新 updated_time）作为墓碑，由补写生成删除操作。
+        """
+        alias = model.__tablename__
+        started_time = datetime.utcnow()
+        index = create_versioned_index(self.client, alias)
+        try:
+            ranges = model.id_ranges(workers)
+            if workers > 1 and len(ranges) > 1:
+                tasks = [(alias, index, first, last, chunk_size) for first, last in ranges]
+                with multiprocessing.Pool(workers) as pool:
+                    count = sum(pool.starmap(_rebuild_worker, tasks))
+            else:
+                count = sum(self.load_range(model, index, first, last, chunk_size)
+                            for first, last in ranges)
+            replayed_time = datetime.utcnow()
+            self.replay_changes(model, index, started_time - timedelta(seconds=REPLAY_OVERLAP), chunk_size)
+            publish_index(self.client, alias, index, self.replicas)
+        except Exception:
+            self.client.indices.delete(index=index, ignore=404)
+            raise
+        # 别名已经切换，旧索引已被删除，这里失败时由对账任务补齐，不能再删除新索引
+        self.replay_changes(model, index, replayed_time - timedelta(seconds=REPLAY_OVERLAP), chunk_size)
+        return index, count
+
+
+def _rebuild_worker(tablename, index, first_id, last_id, chunk_size):
+    """rebuild 的子进程入口，使用独立的应用、数据库连接和 Elasticsearch 客户端"""
+    from flask.helpers import get_env
+    from coco import create_app
+    from coco.models.mixin import SearchableMixin
+
+    app = create_app(get_env())
+    with app.app_context():
+        model = SearchableMixin.get_searchable_model(tablename)
+        return app.search_backend.load_range(model, index, first_id, last_id, chunk_size)
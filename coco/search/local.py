@@ -0,0 +1,575 @@
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import date
+
+from dateutil.parser import isoparse
+
+from .analysis import tokenize, highlight_fragments
+from .base import SearchBackend, SearchResult, FACET_SIZE, UTC_OFFSET
+
+
+# 段文件格式：
+#   头部 | 文档表 | 删除标记 | 词项表 | 词项 | 倒排表 | 存储字段
+# 文档表和词项表为定长记录，词项按 UTF-8 字节序排列，查询时在 mmap 上二分查找；
+# 倒排表中的文档序号做差分后与词频一起用 varint 编码。
+MAGIC = b'COCOSEG1'
+HEADER = struct.Struct('<8sIII')  # magic, doc_count, term_count, tombstone_count
+DOC = struct.Struct('<qIQI')  # doc_id, length, stored_offset, stored_length
+TOMBSTONE = struct.Struct('<q')  # doc_id
+TERM = struct.Struct('<QHIQI')  # term_offset, term_length, doc_freq, postings_offset, postings_length
+
+# 按 __searchable__ 中的顺序依次使用的词频权重
+FIELD_WEIGHTS = (3, 2, 1)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varints(data):
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'{value!r} is not JSON serializable')
+
+
+def write_segment(path, documents, postings, tombstones=()):
+    """写入一个段文件
+
+    documents 为按文档序号排列的 [(doc_id, length, stored_bytes)]，
+    postings 为 {term_bytes: [(ordinal, tf), ...]}，tombstones 为需要在更早的段中删除的 doc_id。
+    """
+    terms = sorted(postings)
+    tombstones = sorted(set(tombstones))
+    offset = HEADER.size + DOC.size * len(documents) + TOMBSTONE.size * len(tombstones) + TERM.size * len(terms)
+
+    term_blob = b''.join(terms)
+    term_offset = offset
+    offset += len(term_blob)
+
+    postings_blob = bytearray()
+    term_entries = []
+    for term in terms:
+        start = len(postings_blob)
+        previous = 0
+        for ordinal, tf in postings[term]:
+            _encode_varint(ordinal - previous, postings_blob)
+            _encode_varint(tf, postings_blob)
+            previous = ordinal
+        term_entries.append((term_offset, len(term), len(postings[term]), offset + start, len(postings_blob) - start))
+        term_offset += len(term)
+    offset += len(postings_blob)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(documents), len(terms), len(tombstones)))
+        for doc_id, length, stored in documents:
+            f.write(DOC.pack(doc_id, length, offset, len(stored)))
+            offset += len(stored)
+        for doc_id in tombstones:
+            f.write(TOMBSTONE.pack(doc_id))
+        for entry in term_entries:
+            f.write(TERM.pack(*entry))
+        f.write(term_blob)
+        f.write(postings_blob)
+        for _, _, stored in documents:
+            f.write(stored)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    """只读的段文件，通过 mmap 读取，多个进程打开同一个文件时共享页缓存
+
+    不显式关闭：查询使用的快照可能仍在其它线程中读取已经不在 manifest 中的段，
+    没有快照引用后由垃圾回收关闭 mmap；文件删除后已经建立的映射仍然可以读取。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.doc_count, self.term_count, tombstone_count = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a search segment')
+        docs_offset = HEADER.size
+        tombstones_offset = docs_offset + DOC.size * self.doc_count
+        self._terms_offset = tombstones_offset + TOMBSTONE.size * tombstone_count
+        self._docs = [DOC.unpack_from(self._buf, docs_offset + DOC.size * i) for i in range(self.doc_count)]
+        self.doc_ids = [doc[0] for doc in self._docs]
+        self.tombstones = {
+            TOMBSTONE.unpack_from(self._buf, tombstones_offset + TOMBSTONE.size * i)[0]
+            for i in range(tombstone_count)
+        }
+
+    def length(self, ordinal):
+        return self._docs[ordinal][1]
+
+    def stored_bytes(self, ordinal):
+        _, _, offset, length = self._docs[ordinal]
+        return self._buf[offset:offset + length]
+
+    def stored(self, ordinal):
+        return json.loads(self.stored_bytes(ordinal).decode('utf-8'))
+
+    def _term_entry(self, i):
+        return TERM.unpack_from(self._buf, self._terms_offset + TERM.size * i)
+
+    def _term_bytes(self, entry):
+        return self._buf[entry[0]:entry[0] + entry[1]]
+
+    def _find(self, term):
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._term_entry(middle)
+            current = self._term_bytes(entry)
+            if current == term:
+                return entry
+            if current < term:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def doc_freq(self, term):
+        entry = self._find(term)
+        return entry[2] if entry else 0
+
+    def _decode(self, entry):
+        values = _decode_varints(self._buf[entry[3]:entry[3] + entry[4]])
+        postings = []
+        ordinal = 0
+        for i in range(0, len(values), 2):
+            ordinal += values[i]
+            postings.append((ordinal, values[i + 1]))
+        return postings
+
+    def postings(self, term):
+        entry = self._find(term)
+        return self._decode(entry) if entry else []
+
+    def iter_terms(self):
+        for i in range(self.term_count):
+            entry = self._term_entry(i)
+            yield self._term_bytes(entry), self._decode(entry)
+
+
+def _live_masks(segments):
+    """返回每个段中需要屏蔽的 doc_id：被更新的段中的新版本覆盖或被删除标记删除"""
+    masks = []
+    masked = set()
+    for segment in reversed(segments):
+        masks.append(masked)
+        masked = masked | set(segment.doc_ids) | segment.tombstones
+    masks.reverse()
+    return masks
+
+
+class LocalIndex:
+    """一个模型在本地目录中的倒排索引
+
+    manifest.json 记录当前生效的段文件，写入时持有文件锁并通过 os.replace 原子替换，
+    查询前检查 manifest 是否变化，变化时重新打开段文件。
+    合并和重建先写入新的 manifest 再删除被替换的段文件。
+    """
+
+    def __init__(self, path, max_segments=8):
+        self.path = path
+        self.max_segments = max_segments
+        os.makedirs(path, exist_ok=True)
+        self._manifest_path = os.path.join(path, 'manifest.json')
+        self._lock = threading.Lock()
+        self._loaded_key = None
+        self._snapshot = ([], [], 0, 0.0)
+
+    @contextmanager
+    def _write_lock(self):
+        with open(os.path.join(self.path, 'write.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'generation': 0, 'segments': []}
+
+    def _write_manifest(self, manifest):
+        tmp_path = f'{self._manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _segment_path(self, generation):
+        return os.path.join(self.path, f'seg_{generation:010d}.seg')
+
+    def _manifest_key(self):
+        try:
+            stat = os.stat(self._manifest_path)
+            return stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def snapshot(self):
+        """返回 (segments, masks, 有效文档数, 平均文档长度)"""
+        key = self._manifest_key()
+        with self._lock:
+            if key != self._loaded_key:
+                self._reload(key)
+            return self._snapshot
+
+    def _reload(self, key, retries=3):
+        opened = {segment.name: segment for segment in self._snapshot[0]}
+        for attempt in range(retries):
+            try:
+                segments = [
+                    opened.get(name) or Segment(os.path.join(self.path, name))
+                    for name in self._read_manifest()['segments']
+                ]
+                break
+            except FileNotFoundError:
+                # 读取 manifest 之后其它进程完成了合并并删除了旧的段文件，重新读取 manifest
+                if attempt == retries - 1:
+                    raise
+                key = self._manifest_key()
+        # 不再使用的段不关闭，由垃圾回收在没有快照引用后释放
+        masks = _live_masks(segments)
+        doc_count = 0
+        total_length = 0
+        for segment, masked in zip(segments, masks):
+            for ordinal, doc_id in enumerate(segment.doc_ids):
+                if doc_id not in masked:
+                    doc_count += 1
+                    total_length += segment.length(ordinal)
+        avg_length = total_length / doc_count if total_length else 1.0
+        self._snapshot = (segments, masks, doc_count, avg_length)
+        self._loaded_key = key
+
+    def add_segment(self, documents, postings, tombstones):
+        """追加一个段，返回追加后的段数；段数超过 max_segments 时由调用方安排 merge"""
+        with self._write_lock():
+            manifest = self._read_manifest()
+            generation = manifest['generation'] + 1
+            write_segment(self._segment_path(generation), documents, postings, tombstones)
+            self._write_manifest({
+                'generation': generation,
+                'segments': manifest['segments'] + [os.path.basename(self._segment_path(generation))],
+            })
+            return len(manifest['segments']) + 1
+
+    def merge(self):
+        """把当前的全部段合并为一个段，合并后不再需要删除标记，返回是否完成合并
+
+        读取和写出新段时不持有写锁，不阻塞提交钩子追加新段，合并期间追加的段保留在合并结果之后；
+        合并期间索引被重建或被其它进程合并时放弃本次结果。
+        """
+        names = self._read_manifest()['segments']
+        if len(names) < 2:
+            return False
+        try:
+            segments = [Segment(os.path.join(self.path, name)) for name in names]
+        except FileNotFoundError:
+            return False
+        documents = []
+        postings = defaultdict(list)
+        for segment, masked in zip(segments, _live_masks(segments)):
+            ordinals = {}
+            for ordinal, doc_id in enumerate(segment.doc_ids):
+                if doc_id not in masked:
+                    ordinals[ordinal] = len(documents)
+                    documents.append((doc_id, segment.length(ordinal), segment.stored_bytes(ordinal)))
+            for term, term_postings in segment.iter_terms():
+                for ordinal, tf in term_postings:
+                    if ordinal in ordinals:
+                        postings[term].append((ordinals[ordinal], tf))
+        tmp_path = os.path.join(self.path, f'merge_{os.getpid()}_{threading.get_ident()}.seg')
+        write_segment(tmp_path, documents, postings)
+        with self._write_lock():
+            manifest = self._read_manifest()
+            if manifest['segments'][:len(names)] != names:
+                os.remove(tmp_path)
+                return False
+            generation = manifest['generation'] + 1
+            # 名称中的第一个代数为被合并的最后一个段的代数，replace 据此判断合并结果是否早于重建
+            name = f'seg_{int(names[-1][4:14]):010d}_{generation:010d}.seg'
+            os.replace(tmp_path, os.path.join(self.path, name))
+            self._write_manifest({
+                'generation': generation,
+                'segments': [name] + manifest['segments'][len(names):],
+            })
+        for name in names:
+            os.remove(os.path.join(self.path, name))
+        return True
+
+    def replace(self, documents, postings, since_generation):
+        """用新段替换 since_generation 及之前的全部段，之后新增的段保留在新段之后"""
+        with self._write_lock():
+            manifest = self._read_manifest()
+            generation = manifest['generation'] + 1
+            write_segment(self._segment_path(generation), documents, postings)
+            kept = [name for name in manifest['segments'] if int(name[4:14]) > since_generation]
+            self._write_manifest({
+                'generation': generation,
+                'segments': [os.path.basename(self._segment_path(generation))] + kept,
+            })
+            for name in manifest['segments']:
+                if name not in kept:
+                    os.remove(os.path.join(self.path, name))
+
+    @property
+    def generation(self):
+        return self._read_manifest()['generation']
+
+    def search(self, tokens):
+        """所有检索词都命中的文档按 BM25 打分，返回 [(score, doc_id, segment, ordinal)]"""
+        segments, masks, doc_count, avg_length = self.snapshot()
+        terms = list(dict.fromkeys(token.encode('utf-8') for token in tokens))
+        if not terms or not doc_count:
+            return []
+        idf = {}
+        for term in terms:
+            doc_freq = sum(segment.doc_freq(term) for segment in segments)
+            if not doc_freq:
+                return []
+            idf[term] = math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        results = []
+        for segment, masked in zip(segments, masks):
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for ordinal, tf in segment.postings(term):
+                    if scores is not None and ordinal not in scores:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * segment.length(ordinal) / avg_length)
+                    term_scores[ordinal] = idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+                scores = term_scores if scores is None else {
+                    ordinal: scores[ordinal] + score for ordinal, score in term_scores.items()
+                }
+                if not scores:
+                    break
+            for ordinal, score in (scores or {}).items():
+                doc_id = segment.doc_ids[ordinal]
+                if doc_id not in masked:
+                    results.append((score, doc_id, segment, ordinal))
+        return results
+
+
+class LocalBackend(SearchBackend):
+    """纯 Python 实现的本地倒排索引后端，适合单机部署和没有 Elasticsearch 的环境
+
+    每个模型一个目录，提交钩子把变更写成新的小段，段数超过 max_segments 时在后台线程中合并，
+    不占用提交所在的请求；asynchronous 为 False 时立即合并，供测试使用。
+    """
+
+    def __init__(self, path, max_segments=8, asynchronous=True, logger=None):
+        self.path = path
+        self.max_segments = max_segments
+        self.asynchronous = asynchronous
+        self.logger = logger
+        self._indexes = {}
+        self._merging = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(
+            app.config['SEARCH_LOCAL_PATH'],
+            app.config['SEARCH_LOCAL_MAX_SEGMENTS'],
+            asynchronous=app.config['SEARCH_INDEX_ASYNC'],
+            logger=app.logger,
+        )
+
+    def index(self, model):
+        with self._lock:
+            if model.__tablename__ not in self._indexes:
+                path = os.path.join(self.path, model.__tablename__)
+                self._indexes[model.__tablename__] = LocalIndex(path, self.max_segments)
+            return self._indexes[model.__tablename__]
+
+    @staticmethod
+    def analyze(model, document):
+        """返回 (doc_id, 文档长度, 存储字段, {term_bytes: 加权词频})"""
+        frequencies = defaultdict(int)
+        length = 0
+        for i, field in enumerate(model.__searchable__):
+            weight = FIELD_WEIGHTS[min(i, len(FIELD_WEIGHTS) - 1)]
+            tokens = tokenize(document.get(field))
+            length += len(tokens)
+            for token in tokens:
+                frequencies[token.encode('utf-8')] += weight
+        # 过滤和分面统计使用的字段也一起存储
+        fields = (model.__search_source__ or list(document)) + \
+            [field for field, _ in model.__search_facets__.values()]
+        stored = {field: document.get(field) for field in fields}
+        stored['id'] = document['id']
+        stored_bytes = json.dumps(stored, default=_json_default, ensure_ascii=False).encode('utf-8')
+        return document['id'], length, stored_bytes, frequencies
+
+    def _build(self, model, documents):
+        rows = []
+        postings = defaultdict(list)
+        for document in documents:
+            doc_id, length, stored_bytes, frequencies = self.analyze(model, document)
+            for term, tf in frequencies.items():
+                postings[term].append((len(rows), tf))
+            rows.append((doc_id, length, stored_bytes))
+        return rows, postings
+
+    def apply_changes(self, model, changes):
+        rows, postings = self._build(model, [document for document in changes.values() if document is not None])
+        index = self.index(model)
+        if index.add_segment(rows, postings, tombstones=changes.keys()) > self.max_segments:
+            self._schedule_merge(index)
+
+    def _schedule_merge(self, index):
+        if not self.asynchronous:
+            index.merge()
+            return
+        with self._lock:
+            # 同一个索引同时只有一个合并线程
+            if index.path in self._merging:
+                return
+            self._merging.add(index.path)
+        threading.Thread(target=self._merge, args=(index,), name='search-segment-merge', daemon=True).start()
+
+    def _merge(self, index):
+        try:
+            index.merge()
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f'Failed to merge search segments in {index.path}: {e}')
+        finally:
+            with self._lock:
+                self._merging.discard(index.path)
+
+    @staticmethod
+    def _values(value):
+        if isinstance(value, list):
+            return value
+        return [value] if value is not None else []
+
+    @staticmethod
+    def _as_datetime(value):
+        # 存储字段中的时间为 isoformat 字符串
+        return isoparse(value) if isinstance(value, str) else value
+
+    @classmethod
+    def _matches(cls, document, filters):
+        for field, expected in filters.items():
+            values = cls._values(document.get(field))
+            if isinstance(expected, tuple):
+                start, end = expected
+                values = [cls._as_datetime(value) for value in values]
+                if not any((start is None or value >= start) and (end is None or value < end)
+                           for value in values):
+                    return False
+            elif expected not in values:
+                return False
+        return True
+
+    @classmethod
+    def _facets(cls, model, documents):
+        facets = {}
+        for name, (field, kind) in model.__search_facets__.items():
+            counter = Counter()
+            for document in documents:
+                for value in cls._values(document.get(field)):
+                    if kind == 'month':
+                        value = (cls._as_datetime(value) + UTC_OFFSET).strftime('%Y-%m')
+                    counter[value] += 1
+            if kind == 'month':
+                items = [(value, counter[value]) for value in sorted(counter, reverse=True)]
+            else:
+                items = counter.most_common(FACET_SIZE)
+            facets[name] = [{'value': value, 'count': count} for value, count in items]
+        return facets
+
+    def _query(self, model, expression, page, per_page, after, filters=None, facets=False):
+        tokens = tokenize(expression, for_query=True)
+        results = self.index(model).search(tokens)
+        facet_counts = None
+        if filters or facets:
+            # 过滤和分面统计需要读取命中文档的存储字段
+            documents = [segment.stored(ordinal) for _, _, segment, ordinal in results]
+            if filters:
+                kept = [i for i, document in enumerate(documents) if self._matches(document, filters)]
+                results = [results[i] for i in kept]
+                documents = [documents[i] for i in kept]
+            if facets:
+                facet_counts = self._facets(model, documents)
+        results.sort(key=lambda result: (-result[0], -result[1]))
+        total = len(results)
+        if after is not None:
+            after_score, after_id = after
+            results = [r for r in results if r[0] < after_score or (r[0] == after_score and r[1] < after_id)]
+            results = results[:per_page]
+        else:
+            start = (max(page, 1) - 1) * per_page
+            results = results[start:start + per_page]
+        next_after = [results[-1][0], results[-1][1]] if len(results) == per_page else None
+        return tokens, results, total, next_after, facet_counts
+
+    def query_ids(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        _, results, total, next_after, facet_counts = \
+            self._query(model, expression, page, per_page, after, filters, facets)
+        return SearchResult([result[1] for result in results], total, next_after, facet_counts)
+
+    def query_documents(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        tokens, results, total, next_after, facet_counts = \
+            self._query(model, expression, page, per_page, after, filters, facets)
+        documents = []
+        for _, _, segment, ordinal in results:
+            document = segment.stored(ordinal)
+            document['highlights'] = {}
+            for field in model.__searchable__:
+                fragments = highlight_fragments(document.get(field), tokens)
+                if fragments:
+                    document['highlights'][field] = fragments
+            documents.append(document)
+        return SearchResult(documents, total, next_after, facet_counts)
+
+    def rebuild(self, model, workers=1, chunk_size=500):
+        """在后台写出包含全部文档的新段，再替换重建开始前已有的段；重建期间提交的变更保留在新段之后"""
+        index = self.index(model)
+        since_generation = index.generation
+        documents = (
+            document
+            for first, last in model.id_ranges(1)
+            for document in model.iter_search_documents(first, last, chunk_size)
+        )
+        rows, postings = self._build(model, documents)
+        index.replace(rows, postings, since_generation)
+        return index.path, len(rows)
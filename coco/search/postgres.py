@@ -0,0 +1,188 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import and_, bindparam, cast, func, or_, Numeric
+
+from coco.extensions import db
+from .analysis import tokenize, highlight_fragments
+from .base import SearchBackend, SearchResult, FACET_SIZE, UTC_OFFSET
+
+
+# 按 __searchable__ 中的顺序依次使用的权重，靠前的字段命中时排名更高
+WEIGHTS = 'ABCD'
+
+
+class PostgresBackend(SearchBackend):
+    """以 PostgreSQL 全文检索作为搜索后端
+
+    模型需要在 __search_vector__ 指定的 tsvector 列上建立 GIN 索引。
+    中文由 tokenize 切分为二元组后用 simple 配置写入 tsvector，提交钩子在 flush 之前更新该列。
+    分面统计为每个分面一条 GROUP BY 查询。
+    """
+
+    @staticmethod
+    def _vector_expression(model, values):
+        """values 为 {字段名: 已切分并用空格连接的检索词（字符串或绑定参数）}"""
+        expression = None
+        for i, field in enumerate(model.__searchable__):
+            weight = WEIGHTS[min(i, len(WEIGHTS) - 1)]
+            part = func.setweight(func.to_tsvector('simple', values[field]), weight)
+            expression = part if expression is None else expression.op('||')(part)
+        return expression
+
+    def prepare(self, model, obj, values=None):
+        values = {
+            field: ' '.join(tokenize(values[field] if values and field in values else getattr(obj, field)))
+            for field in model.__searchable__
+        }
+        setattr(obj, model.__search_vector__, self._vector_expression(model, values))
+
+    @staticmethod
+    def _filter(model, query, filters):
+        for field, value in (filters or {}).items():
+            column, joins = model.search_facet_column(field)
+            if isinstance(value, tuple):
+                start, end = value
+                clauses = []
+                if start is not None:
+                    clauses.append(column >= start)
+                if end is not None:
+                    clauses.append(column < end)
+                clause = and_(*clauses)
+            else:
+                clause = column == value
+            if joins:
+                # 需要连接其它表的字段（如标签）用子查询过滤，避免连接产生重复的行
+                subquery = db.session.query(model.id)
+                for target, onclause in joins:
+                    subquery = subquery.join(target, onclause)
+                clause = model.id.in_(subquery.filter(clause))
+            query = query.filter(clause)
+        return query
+
+    @staticmethod
+    def _facets(model, query):
+        facets = {}
+        for name, (field, kind) in model.__search_facets__.items():
+            column, joins = model.search_facet_column(field)
+            if kind == 'month':
+                value = func.to_char(column + UTC_OFFSET, 'YYYY-MM')
+                order = value.desc()
+            else:
+                value = column
+                order = func.count(model.id).desc()
+            entities = query.with_entities(value.label('value'), func.count(model.id).label('count'))
+            for target, onclause in joins:
+                entities = entities.join(target, onclause)
+            entities = entities.group_by(value).order_by(order)
+            if kind != 'month':
+                entities = entities.limit(FACET_SIZE)
+            facets[name] = [{'value': row.value, 'count': row.count} for row in entities]
+        return facets
+
+    def _match(self, model, expression, filters=None):
+        tokens = tokenize(expression, for_query=True)
+        vector = getattr(model, model.__search_vector__)
+        tsquery = func.plainto_tsquery('simple', ' '.join(tokens))
+        # 排名保留 6 位小数，保证游标中的值可以精确比较
+        rank = func.round(cast(func.ts_rank(vector, tsquery), Numeric), 6)
+        query = model.query.filter(vector.op('@@')(tsquery)).filter_by(deleted=False)
+        return tokens, rank, self._filter(model, query, filters)
+
+    def _paginate(self, model, query, rank, page, per_page, after, *columns):
+        """按 (rank, id) 倒序分页，返回 (rows, total, next_after)"""
+        entities = query.with_entities(model.id, rank.label('rank'), *columns)
+        if after is not None:
+            after_rank, after_id = Decimal(after[0]), after[1]
+            entities = entities.filter(or_(
+                rank < after_rank,
+                and_(rank == after_rank, model.id < after_id)
+            ))
+            offset = 0
+        else:
+            entities = entities.add_columns(func.count().over().label('total'))
+            offset = (max(page, 1) - 1) * per_page
+        rows = entities.order_by(rank.desc(), model.id.desc()).offset(offset).limit(per_page).all()
+        if rows and after is None:
+            total = rows[0].total
+        else:
+            total = query.with_entities(func.count(model.id)).scalar()
+        next_after = [str(rows[-1].rank), rows[-1].id] if len(rows) == per_page else None
+        return rows, total, next_after
+
+    def query_ids(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        tokens, rank, query = self._match(model, expression, filters)
+        if not tokens:
+            return SearchResult([], 0, None, {} if facets else None)
+        rows, total, next_after = self._paginate(model, query, rank, page, per_page, after)
+        facet_counts = self._facets(model, query) if facets else None
+        return SearchResult([row.id for row in rows], total, next_after, facet_counts)
+
+    def query_documents(self, model, expression, page, per_page, after=None, filters=None, facets=False):
+        tokens, rank, query = self._match(model, expression, filters)
+        if not tokens:
+            return SearchResult([], 0, None, {} if facets else None)
+        fields = [field for field in model.__search_source__ if field != 'id']
+        columns = [getattr(model, field) for field in fields]
+        rows, total, next_after = self._paginate(model, query, rank, page, per_page, after, *columns)
+        documents = []
+        for row in rows:
+            document = {'id': row.id}
+            for field in fields:
+                value = getattr(row, field)
+                # 与 Elasticsearch 返回的 source 保持一致
+                document[field] = value.isoformat() if isinstance(value, datetime) else value
+            document['highlights'] = {}
+            for field in model.__searchable__:
+                if field in document:
+                    fragments = highlight_fragments(document[field], tokens)
+                    if fragments:
+                        document['highlights'][field] = fragments
+            documents.append(document)
+        facet_counts = self._facets(model, query) if facets else None
+        return SearchResult(documents, total, next_after, facet_counts)
+
+    def _update_vectors(self, model, documents):
+        """用 executemany 重新计算 documents 对应记录的 tsvector，不修改 updated_time"""
+        table = model.__table__
+        values = {field: bindparam(f'_{field}') for field in model.__searchable__}
+        statement = table.update()\
+            .where(table.c.id == bindparam('_id'))\
+            .values({model.__search_vector__: self._vector_expression(model, values)})
+        db.session.execute(statement, [
+            dict({f'_{field}': ' '.join(tokenize(document[field]))
+                  for field in model.__searchable__}, _id=document['id'])
+            for document in documents
+        ])
+
+    def sync_changes(self, model, changes, chunk_size=500):
+        # 已删除的记录在查询时按 deleted 过滤，只需要更新其它记录的 tsvector；由调用方提交事务
+        count = 0
+        chunk = []
+        for _, document in changes:
+            count += 1
+            if document is not None:
+                chunk.append(document)
+            if len(chunk) >= chunk_size:
+                self._update_vectors(model, chunk)
+                chunk = []
+        if chunk:
+            self._update_vectors(model, chunk)
+        return count
+
+    def rebuild(self, model, workers=1, chunk_size=500):
+        """按主键顺序分批重新计算全部记录的 tsvector，不修改 updated_time
+
+        检索字段不一定都是列（如标签），由 search_documents 生成，每批提交一次
+        """
+        count = 0
+        last_id = 0
+        while True:
+            objs = model.query.filter(model.id > last_id).order_by(model.id).limit(chunk_size).all()
+            if not objs:
+                break
+            self._update_vectors(model, model.search_documents(objs))
+            db.session.commit()
+            count += len(objs)
+            last_id = objs[-1].id
+        return model.__tablename__, count
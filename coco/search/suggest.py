@@ -0,0 +1,244 @@
+import bisect
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from coco.extensions import db
+
+
+# 注册了输入提示的模型，模型的 __suggest__ 为提示使用的字段名
+SUGGEST_MODELS = []
+
+
+class _Node:
+    __slots__ = ('children', 'keys', 'top')
+
+    def __init__(self):
+        self.children = {}
+        # 在该节点结束的条目
+        self.keys = set()
+        # 子树中排序最靠前的条目，查询时直接返回
+        self.top = []
+
+
+class PrefixIndex:
+    """前缀树，每个节点缓存子树中最靠前的 size 个条目，查询耗时只与前缀长度有关
+
+    条目按文本长度和文本排序，较短的补全排在前面。
+    """
+
+    def __init__(self, size=10):
+        self.size = size
+        self._root = _Node()
+        self._texts = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _sort_key(key, text):
+        return len(text), text, key
+
+    def _path(self, text, create=False):
+        nodes = []
+        node = self._root
+        for char in text.lower():
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return nodes
+                child = node.children[char] = _Node()
+            node = child
+            nodes.append(node)
+        return nodes
+
+    def add(self, key, text):
+        if not text:
+            self.remove(key)
+            return
+        with self._lock:
+            if self._texts.get(key) == text:
+                return
+            self.remove(key)
+            self._texts[key] = text
+            item = self._sort_key(key, text)
+            nodes = self._path(text, create=True)
+            nodes[-1].keys.add(key)
+            for node in nodes:
+                bisect.insort(node.top, item)
+                if len(node.top) > self.size:
+                    node.top.pop()
+
+    def remove(self, key):
+        with self._lock:
+            text = self._texts.pop(key, None)
+            if text is None:
+                return
+            item = self._sort_key(key, text)
+            nodes = self._path(text)
+            nodes[-1].keys.discard(key)
+            for node in nodes:
+                if item in node.top:
+                    node.top.remove(item)
+                    # 列表原本是满的，子树中可能还有其它条目，重新收集
+                    if len(node.top) == self.size - 1:
+                        node.top = self._collect(node)
+
+    def _collect(self, node):
+        items = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            items.extend(self._sort_key(key, self._texts[key]) for key in current.keys)
+            stack.extend(current.children.values())
+        items.sort()
+        return items[:self.size]
+
+    def search(self, prefix, limit=None):
+        """返回 [(key, text)]"""
+        with self._lock:
+            nodes = self._path(prefix)
+            if not nodes or len(nodes) != len(prefix.lower()):
+                return []
+            return [(key, text) for _, text, key in nodes[-1].top[:limit or self.size]]
+
+
+class Suggester:
+    """搜索输入提示
+
+    首次查询时从数据库加载所有已注册模型的提示字段，之后由提交钩子增量更新；
+    其它进程的修改在超过 refresh_interval 秒后重新加载时生效。
+    重新加载在后台线程中进行，期间继续使用旧的前缀树，加载期间提交的变更在替换前补到新的前缀树中。
+    asynchronous 为 False 时在查询的线程中重新加载。
+    """
+
+    def __init__(self, size=10, refresh_interval=300, asynchronous=True, logger=None):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.asynchronous = asynchronous
+        self.logger = logger
+        self._index = None
+        self._loaded_time = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # 正在重新加载的进程号和加载期间提交的变更
+        self._reloading = None
+        self._replay = []
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(app.config['SUGGEST_SIZE'], app.config['SUGGEST_REFRESH_INTERVAL'],
+                   asynchronous=app.config['SEARCH_INDEX_ASYNC'], logger=app.logger)
+
+    def _load(self):
+        index = PrefixIndex(self.size)
+        for model in SUGGEST_MODELS:
+            field = getattr(model, model.__suggest__)
+            for obj_id, text in model.query.filter_by(deleted=False).with_entities(model.id, field):
+                index.add((model.__tablename__, obj_id), text)
+        return index
+
+    def _expired(self):
+        return time.time() - self._loaded_time > self.refresh_interval
+
+    def _get_index(self):
+        if self._index is None:
+            with self._load_lock:
+                if self._index is None:
+                    self._index = self._load()
+                    self._loaded_time = time.time()
+        elif self._expired() and self._reloading != os.getpid():
+            self._start_reload()
+        return self._index
+
+    def _start_reload(self):
+        with self._lock:
+            # fork 之后父进程的加载线程不会被继承，按进程号判断
+            if not self._expired() or self._reloading == os.getpid():
+                return
+            self._reloading = os.getpid()
+            self._replay = []
+        if not self.asynchronous:
+            self._reload()
+            return
+        app = current_app._get_current_object()
+        threading.Thread(target=self._run_reload, args=(app,), name='suggest-reload', daemon=True).start()
+
+    def _run_reload(self, app):
+        with app.app_context():
+            self._reload()
+
+    def _reload(self):
+        try:
+            index = self._load()
+        except Exception as e:
+            index = None
+            if self.logger:
+                self.logger.error(f'Failed to reload suggestions: {e}')
+        with self._lock:
+            if index is not None:
+                for changes in self._replay:
+                    self._apply(index, changes)
+                self._index = index
+            # 加载失败时同样推迟到下一个间隔再重试
+            self._loaded_time = time.time()
+            self._reloading = None
+            self._replay = []
+
+    def suggest(self, prefix, limit=None):
+        return [
+            {'text': text, 'type': tablename}
+            for (tablename, _), text in self._get_index().search(prefix, limit)
+        ]
+
+    @staticmethod
+    def _apply(index, changes):
+        for key, text in changes.items():
+            if text is None:
+                index.remove(key)
+            else:
+                index.add(key, text)
+
+    def apply_changes(self, changes):
+        """changes 为 {(表名, id): 文本}，文本为 None 表示删除"""
+        with self._lock:
+            index = self._index
+            if self._reloading == os.getpid():
+                self._replay.append(changes)
+        if index is not None:
+            self._apply(index, changes)
+
+
+def register_suggest_model(model):
+    SUGGEST_MODELS.append(model)
+
+
+def _after_flush(session, flush_context):
+    changes = session.info.setdefault('suggest_changes', {})
+    for obj in session.new | session.dirty:
+        model = type(obj)
+        if model in SUGGEST_MODELS:
+            attrs = db.inspect(obj).attrs
+            if obj in session.new or attrs[model.__suggest__].history.has_changes() \
+                    or attrs['deleted'].history.has_changes():
+                text = getattr(obj, model.__suggest__) if not obj.deleted else None
+                changes[(model.__tablename__, obj.id)] = text
+    for obj in session.deleted:
+        model = type(obj)
+        if model in SUGGEST_MODELS:
+            changes[(model.__tablename__, obj.id)] = None
+
+
+def _after_commit(session):
+    changes = session.info.pop('suggest_changes', None)
+    if changes and has_app_context() and current_app.suggester is not None:
+        current_app.suggester.apply_changes(changes)
+
+
+def _after_rollback(session):
+    session.info.pop('suggest_changes', None)
+
+
+db.event.listen(db.session, 'after_flush', _after_flush)
+db.event.listen(db.session, 'after_commit', _after_commit)
+db.event.listen(db.session, 'after_rollback', _after_rollback)
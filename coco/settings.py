@@ -21,6 +21,93 @@ class Config:
 
     # Elasticsearch 配置
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL', None)
+    # 建立连接和等待响应的超时秒数
+    ELASTICSEARCH_CONNECT_TIMEOUT = 2
+    ELASTICSEARCH_READ_TIMEOUT = 5
+    # 每个节点的连接池大小，不应小于每个进程的线程数
+    ELASTICSEARCH_MAXSIZE = 10
+    # 连接失败时换节点重试的次数，超时不重试
+    ELASTICSEARCH_MAX_RETRIES = 1
+    # 连续失败多少次后熔断，熔断期间搜索直接返回错误，索引操作留在队列中
+    ELASTICSEARCH_BREAKER_THRESHOLD = 5
+    # 熔断多少秒后放行一次试探请求
+    ELASTICSEARCH_BREAKER_RESET_TIMEOUT = 30
+    # 搜索后端：elasticsearch、postgres 或 local，为空时不启用搜索；未配置 Elasticsearch 时使用 PostgreSQL 全文检索
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'elasticsearch' if ELASTICSEARCH_URL else 'postgres')
+    # 索引操作由后台线程批量发送，为 False 时在提交后同步发送
+    SEARCH_INDEX_ASYNC = True
+    # 每批最多发送的操作数
+    SEARCH_INDEX_BATCH_SIZE = 500
+    # 未凑满一批时最多等待的秒数
+    SEARCH_INDEX_FLUSH_INTERVAL = 1.0
+    # 发送失败后的最大重试次数
+    SEARCH_INDEX_MAX_RETRIES = 3
+    # 进程退出时等待队列发送完毕的最长秒数
+    SEARCH_INDEX_DRAIN_TIMEOUT = 10
+    # Elasticsearch 不可用期间队列中最多保留的操作数，超出时丢弃最早的操作
+    SEARCH_INDEX_MAX_PENDING = 100000
+    # 对账任务的执行间隔秒数
+    SEARCH_RECONCILE_INTERVAL = 10
+    # 对账起点比上次的水位提前的秒数，应大于最长事务的耗时
+    SEARCH_RECONCILE_OVERLAP = 60
+    # from/size 分页允许访问的最大结果数，与索引的 index.max_result_window 一致
+    SEARCH_MAX_RESULT_WINDOW = 10000
+    # 重建索引完成后恢复的副本数
+    SEARCH_INDEX_REPLICAS = 1
+    # 本地倒排索引的存放目录
+    SEARCH_LOCAL_PATH = os.environ.get('SEARCH_LOCAL_PATH', os.path.join(os.path.dirname(BASE_DIR), 'search-index'))
+    # 本地倒排索引的段数超过该值时合并为一个段
+    SEARCH_LOCAL_MAX_SEGMENTS = 8
+    # 浏览数由后台线程批量写入，为 False 时每次浏览后立即写入
+    VIEW_COUNT_ASYNC = True
+    # 浏览数的写入间隔秒数
+    VIEW_COUNT_FLUSH_INTERVAL = 5.0
+    # 累计浏览次数达到该值时提前写入
+    VIEW_COUNT_MAX_PENDING = 1000
+    # 进程退出时等待写入的最长秒数
+    VIEW_COUNT_DRAIN_TIMEOUT = 5
+    # 上次登录时间的最短记录间隔秒数，避免每个请求都更新用户表
+    LAST_LOGIN_UPDATE_INTERVAL = 300
+    # 缓存后端：local（进程内）、shm（同一台机器的 worker 共享内存）或 redis
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')
+    # local 后端最多保存的条数
+    CACHE_LOCAL_MAX_SIZE = 4096
+    # shm 后端的文件，槽数和每个槽的字节数（序列化后超过槽大小的值不缓存）以及版本号的个数
+    CACHE_SHM_PATH = os.environ.get('CACHE_SHM_PATH', '/dev/shm/coco-cache')
+    CACHE_SHM_SLOTS = 8192
+    CACHE_SHM_SLOT_SIZE = 8192
+    CACHE_SHM_VERSION_SLOTS = 4096
+    # redis 后端的地址、超时秒数和键前缀
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_REDIS_TIMEOUT = 0.2
+    CACHE_REDIS_PREFIX = 'coco:'
+    # 为 True 时提交后通过 PostgreSQL NOTIFY 通知其它进程和机器失效缓存，local 和 shm 后端多进程、多机器部署时开启
+    CACHE_INVALIDATION_BUS = False
+    CACHE_INVALIDATION_CHANNEL = 'coco_cache'
+    # 监听连接断开后重新连接的间隔秒数
+    CACHE_INVALIDATION_RECONNECT_INTERVAL = 5.0
+    # 分页总数缓存的有效秒数，local 后端未开启失效通知时其它进程的修改最多在这段时间后生效
+    COUNT_CACHE_TTL = 60
+    # total=estimate 时，估算的行数不小于该值才返回估算值，否则仍然精确统计
+    COUNT_ESTIMATE_MIN = 10000
+    # 模型查询缓存的有效秒数，local 后端未开启失效通知时其它进程的修改最多在这段时间后生效
+    MODEL_CACHE_TTL = 60
+    # 为 True 时每个请求是一个事务，模型的修改在返回响应前一次提交；为 False 时每次 save 都提交
+    REQUEST_UNIT_OF_WORK = False
+    # 为 True 时缓存匿名用户访问的公开接口的完整响应
+    RESPONSE_CACHE = True
+    # 响应缓存的有效秒数，文章详情中缓存的浏览数在这段时间内不变
+    RESPONSE_CACHE_TTL = 60
+    # 响应体达到该字节数时压缩保存
+    RESPONSE_CACHE_COMPRESS_MIN_SIZE = 500
+    # 参与生成 ETag，部署改变了响应格式的版本时修改，让客户端缓存的结果失效
+    ETAG_SALT = os.environ.get('ETAG_SALT', '')
+    # 归档等结果缓存的有效秒数，local 后端未开启失效通知时其它进程的修改最多在这段时间后生效
+    RESULT_CACHE_TTL = 300
+    # 输入提示最多返回的条数
+    SUGGEST_SIZE = 10
+    # 输入提示重新从数据库加载的间隔秒数，用于同步其它进程的修改
+    SUGGEST_REFRESH_INTERVAL = 300
 
     # 分页大小
     ARTICLES_PER_PAGE = 10
@@ -81,6 +168,10 @@ class TestConfig(Config):
     # 禁用表单 CSRF 保护
     WTF_CSRF_deleted = False
 
+    # 测试中同步写入索引，提交后即可搜索
+    SEARCH_INDEX_ASYNC = False
+    VIEW_COUNT_ASYNC = False
+
     # 数据库配置
     SQLALCHEMY_DATABASE_URI = os.environ['TEST_DATABASE_URI']
 
@@ -0,0 +1,102 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from werkzeug.exceptions import NotFound
+
+from coco import create_app, db
+from coco.models.article import Article
+from coco.utils.testing_utils import create_fake_data
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        create_fake_data()
+
+    def tearDown(self):
+        db.session.remove()
+        if self.app.elasticsearch:
+            self.app.elasticsearch.indices.delete('article', ignore=404)
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_rows_serialize_like_models(self):
+        article = Article.get_by_slug('01234567', deleted=False)
+        row = Article.get_row_by_slug('01234567', deleted=False)
+        self.assertEqual(Article.row_to_dict(row), article.to_dict())
+        self.assertIsNone(Article.get_row_by_slug('missing'))
+
+        models = Article.paginate(deleted=False, order='desc').items
+        rows = Article.paginate(deleted=False, order='desc', rows=True).items
+        self.assertEqual(Article.rows_to_summary_dicts(rows), [model.to_summary_dict() for model in models])
+
+    def test_rows_by_tag_exclude_deleted_articles(self):
+        Article.get_by_slug('23456789').update(deleted=True)
+        rows = Article.paginate_by_tag('技术', deleted=False, rows=True).items
+        self.assertEqual([row.slug for row in rows], ['12345678'])
+
+    def test_search_documents_load_tags_per_chunk(self):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(self.app)
+        db.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            documents = list(Article.iter_search_documents(1, 3, chunk_size=10))
+        finally:
+            db.event.remove(engine, 'before_cursor_execute', count)
+        self.assertEqual({document['slug']: document['tags'] for document in documents}, {
+            '01234567': ['好玩', '程序员'],
+            '12345678': ['程序员', '技术', '招聘'],
+            '23456789': ['技术', '网络', '交易'],
+        })
+        # 一次读取文章，一次读取全部标签
+        self.assertEqual(len(statements), 2)
+
+    def test_save_reads_count_state_only_when_counts_change(self):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(self.app)
+        article = Article.get_by_slug('01234567')
+        db.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            article.update(title='新的标题')
+            self.assertFalse([statement for statement in statements if 'FOR UPDATE' in statement])
+            article.update(deleted=True)
+            self.assertTrue([statement for statement in statements if 'FOR UPDATE' in statement])
+        finally:
+            db.event.remove(engine, 'before_cursor_execute', count)
+
+    def test_search_document_to_dict_fills_missing_fields(self):
+        data = Article.search_document_to_dict({
+            'slug': '01234567',
+            'title': '标题',
+            'created_time': '2019-01-02T03:04:05',
+        })
+        self.assertEqual(data['highlights'], {})
+        self.assertIsNone(data['summary'])
+        self.assertEqual(data['createTime'], datetime(2019, 1, 2, 11, 4, 5))
+        self.assertEqual(data['updateTime'], data['createTime'])
+
+    def test_paginate_counts_only_full_pages(self):
+        with patch.object(Article, 'count_query', return_value=(3, False)) as mock_count:
+            page = Article.paginate(deleted=False, page=2, per_page=2)
+            self.assertEqual((len(page.items), page.total), (1, 3))
+            # 最后一页不满，总数由页码和条数得出
+            mock_count.assert_not_called()
+            page = Article.paginate(deleted=False, page=1, per_page=2)
+            self.assertEqual((len(page.items), page.total), (2, 3))
+            mock_count.assert_called_once()
+            # 超出范围的页码先取当前页，直接返回 404
+            with self.assertRaises(NotFound):
+                Article.paginate(deleted=False, page=3, per_page=2)
+            mock_count.assert_called_once()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from coco.cache import LocalCache, SharedMemoryCache
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def shared_cache(self, **kwargs):
+        cache = SharedMemoryCache(self.path, **dict(dict(slots=8, slot_size=256, version_slots=8), **kwargs))
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_local_cache_evicts_least_recently_used(self):
+        cache = LocalCache(max_size=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.incr_version('x'), 1)
+
+    def test_shared_cache_get_set_delete(self):
+        cache = self.shared_cache()
+        self.assertIsNone(cache.get(('article', 1)))
+        self.assertTrue(cache.set(('article', 1), {'title': '网速慢'}, 60))
+        self.assertEqual(cache.get(('article', 1)), {'title': '网速慢'})
+        cache.delete(('article', 1))
+        self.assertIsNone(cache.get(('article', 1)))
+        # 超过槽大小的值不缓存
+        self.assertFalse(cache.set('big', 'x' * 1000, 60))
+        self.assertIsNone(cache.get('big'))
+
+    def test_shared_cache_evicts_when_group_is_full(self):
+        cache = self.shared_cache()
+        for i in range(20):
+            cache.set(i, i, 60)
+        # 8 个槽最多保存 8 个值
+        self.assertLessEqual(sum(cache.get(i) is not None for i in range(20)), 8)
+        self.assertEqual(cache.get(19), 19)
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+    def test_shared_cache_is_visible_to_other_processes(self):
+        cache = self.shared_cache()
+        pid = os.fork()
+        if pid == 0:
+            child = SharedMemoryCache(self.path, slots=8, slot_size=256, version_slots=8)
+            child.set('from-child', [1, 2], 60)
+            child.incr_version('article')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(cache.get('from-child'), [1, 2])
+        self.assertEqual(cache.get_version('article'), 1)
+
+    def test_shared_cache_rejects_different_layout(self):
+        self.shared_cache()
+        with self.assertRaises(ValueError):
+            SharedMemoryCache(self.path, slots=16, slot_size=256, version_slots=8)
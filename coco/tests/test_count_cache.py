@@ -0,0 +1,55 @@
+import unittest
+
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from coco.cache import LocalCache
+from coco.count_cache import CountCache, query_tables
+
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = 'item'
+    id = sa.Column(sa.Integer, primary_key=True)
+    group_id = sa.Column(sa.Integer, nullable=False)
+
+
+class ItemTag(Base):
+    __tablename__ = 'item_tag'
+    id = sa.Column(sa.Integer, primary_key=True)
+    item_id = sa.Column(sa.Integer, nullable=False)
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        engine = sa.create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all([Item(id=1, group_id=1), Item(id=2, group_id=1), Item(id=3, group_id=2)])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_count_is_cached_per_filter_until_invalidated(self):
+        cache = CountCache(LocalCache(), ttl=60)
+        group_one = self.session.query(Item).filter(Item.group_id == 1)
+        self.assertEqual(cache.count(group_one.order_by(Item.id.desc())), 2)
+        self.assertEqual(cache.count(self.session.query(Item).filter(Item.group_id == 2)), 1)
+
+        self.session.add(Item(id=4, group_id=1))
+        self.session.commit()
+        # 排序不影响缓存键
+        self.assertEqual(cache.count(group_one), 2)
+        cache.invalidate(['item_tag'])
+        self.assertEqual(cache.count(group_one), 2)
+        cache.invalidate(['item'])
+        self.assertEqual(cache.count(group_one), 3)
+
+    def test_query_tables_includes_subqueries(self):
+        tagged = self.session.query(ItemTag.item_id)
+        query = self.session.query(Item).filter(Item.id.in_(tagged))
+        self.assertEqual(query_tables(query), ['item', 'item_tag'])
@@ -0,0 +1,53 @@
+import json
+import time
+import unittest
+
+from coco import create_app, db
+from coco.cache import InvalidationBus, LocalCache
+from coco.cache.bus import MAX_PAYLOAD
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+
+    def create_bus(self, host):
+        bus = InvalidationBus(LocalCache(), lambda: db.get_engine(self.app), poll_interval=0.1)
+        bus.host = host
+        self.addCleanup(bus.close)
+        return bus
+
+    def test_apply_ignores_own_and_invalid_messages(self):
+        bus = self.create_bus('web1')
+        bus.apply(json.dumps({'sender': bus.sender, 'versions': ['model:article']}))
+        bus.apply('not json')
+        self.assertEqual(bus.get_version('model:article'), 0)
+        bus.apply(json.dumps({'sender': 'web2:1', 'versions': ['model:article', 'model:article:1']}))
+        self.assertEqual((bus.get_version('model:article'), bus.get_version('model:article:1')), (1, 1))
+        self.assertEqual(bus.stats()['bus']['errors'], 1)
+
+    def test_large_changes_are_split(self):
+        bus = self.create_bus('web1')
+        names = [f'model:article:{i}' for i in range(2000)]
+        payloads = bus.payloads(names)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload.encode('utf-8')) <= MAX_PAYLOAD for payload in payloads))
+        self.assertEqual(sum((json.loads(payload)['versions'] for payload in payloads), []), names)
+
+    def test_invalidation_reaches_other_listeners(self):
+        publisher, listener = self.create_bus('web1'), self.create_bus('web2')
+        listener.ensure_listening()
+        # 等待监听线程执行 LISTEN
+        time.sleep(0.5)
+        self.assertEqual(publisher.incr_version('result:archive'), 1)
+        deadline = time.time() + 5
+        while listener.get_version('result:archive') == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(listener.get_version('result:archive'), 1)
+        self.assertEqual(publisher.stats()['bus']['published'], 1)
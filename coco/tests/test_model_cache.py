@@ -0,0 +1,65 @@
+import unittest
+from types import SimpleNamespace
+
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from coco.cache import LocalCache
+from coco.model_cache import ModelCache, snapshot
+
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = 'item'
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String(20), nullable=False)
+
+
+class TestCase(unittest.TestCase):
+    def test_invalidation_by_primary_key_and_table(self):
+        cache = ModelCache(LocalCache(), ttl=60)
+        one, two = SimpleNamespace(id=1), SimpleNamespace(id=2)
+        cache.get_or_load(('item', 'get_by_id', (1,)), 'item', lambda: one)
+        cache.get_or_load(('item', 'get_by_id', (2,)), 'item', lambda: two)
+        cache.get_or_load(('item', 'list_all', ()), 'item', lambda: [one, two])
+        cache.get_or_load(('item', 'get_by_id', (1,)), 'item', lambda: None)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        # 修改 id 为 2 的行：依赖它的结果和依赖整张表的列表失效，id 为 1 的结果仍然有效
+        cache.invalidate({'item': {2}})
+        self.assertIs(cache.get_or_load(('item', 'get_by_id', (1,)), 'item', lambda: None), one)
+        self.assertIsNone(cache.get_or_load(('item', 'get_by_id', (2,)), 'item', lambda: None))
+        self.assertEqual(cache.get_or_load(('item', 'list_all', ()), 'item', lambda: []), [])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations']), (2, 5, 2))
+
+        # 整张表失效时单行的结果也失效
+        cache.invalidate({'item': None})
+        self.assertIsNone(cache.get_or_load(('item', 'get_by_id', (1,)), 'item', lambda: None))
+
+    def test_changes_during_load_are_not_cached(self):
+        cache = ModelCache(LocalCache(), ttl=60)
+
+        def load():
+            cache.invalidate({'item': {1}})
+            return SimpleNamespace(id=1)
+
+        cache.get_or_load(('item', 'get_by_id', (1,)), 'item', load)
+        self.assertIsNone(cache.get_or_load(('item', 'get_by_id', (1,)), 'item', lambda: None))
+
+    def test_snapshot_is_detached(self):
+        engine = sa.create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add(Item(id=1, name='one'))
+        session.commit()
+
+        item = session.query(Item).get(1)
+        copy = snapshot(item)
+        self.assertIsNot(copy, item)
+        self.assertEqual((copy.id, copy.name), (1, 'one'))
+        self.assertTrue(sa.inspect(copy).detached)
+        session.close()
@@ -0,0 +1,102 @@
+import gzip
+import unittest
+from datetime import datetime
+
+from flask import Flask
+
+from coco.cache import LocalCache
+from coco.conditional import Validators, is_not_modified
+from coco.model_cache import MODEL_VERSION
+from coco.response_cache import ResponseCache
+
+
+KEY = ('localhost', '/articles/', b'')
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.cache = ResponseCache(LocalCache(), ttl=60, compress_min_size=100)
+
+    def response(self, body):
+        return self.app.response_class(body, mimetype='application/json')
+
+    def put(self, body, names=('model:article',), meta=None, validators=None):
+        version = self.cache.backend.get_version(MODEL_VERSION)
+        self.cache.put(KEY, self.response(body), list(names), meta or {}, version, validators)
+
+    def test_entries_expire_when_dependencies_change(self):
+        self.put('{}', names=['model:article', 'model:tag'], meta={'article_id': 1})
+        entry = self.cache.get(KEY)
+        self.assertEqual((entry.status, entry.body, entry.encoding), (200, b'{}', None))
+        self.assertEqual(entry.meta, {'article_id': 1})
+
+        self.cache.backend.incr_version('model:comment')
+        self.assertIsNotNone(self.cache.get(KEY))
+        self.cache.backend.incr_version('model:tag')
+        self.assertIsNone(self.cache.get(KEY))
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 1, 'stored': 1})
+
+    def test_put_skips_responses_built_across_a_commit(self):
+        version = self.cache.backend.get_version(MODEL_VERSION)
+        self.cache.backend.incr_version(MODEL_VERSION)
+        self.cache.put(KEY, self.response('{}'), ['model:article'], {}, version)
+        self.assertIsNone(self.cache.get(KEY))
+        self.assertEqual(self.cache.stats()['stored'], 0)
+
+    def test_large_bodies_are_served_compressed_or_decompressed(self):
+        body = '{"title": "%s"}' % ('房子' * 100)
+        self.put(body)
+        entry = self.cache.get(KEY)
+        self.assertEqual(entry.encoding, 'gzip')
+        self.assertEqual(gzip.decompress(entry.body), body.encode('utf-8'))
+
+        with self.app.test_request_context(headers={'Accept-Encoding': 'gzip, deflate'}):
+            response = ResponseCache.to_response(entry)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.get_data(), entry.body)
+
+        with self.app.test_request_context():
+            response = ResponseCache.to_response(entry)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_data(as_text=True), body)
+        self.assertEqual(response.mimetype, 'application/json')
+
+    def test_cached_validators_answer_conditional_requests(self):
+        validators = Validators('abc', datetime(2019, 1, 2, 3, 4, 5))
+        self.put('{}', validators=validators)
+        entry = self.cache.get(KEY)
+
+        with self.app.test_request_context():
+            response = ResponseCache.to_response(entry)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], 'W/"abc"')
+        self.assertEqual(response.last_modified, validators.last_modified)
+
+        with self.app.test_request_context(headers={'If-None-Match': 'W/"abc"'}):
+            response = ResponseCache.to_response(entry)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(response.headers['ETag'], 'W/"abc"')
+
+    def test_is_not_modified(self):
+        validators = Validators('abc', datetime(2019, 1, 2, 3, 4, 5, 600000))
+        cases = [
+            ({}, False),
+            ({'If-None-Match': 'W/"abc"'}, True),
+            ({'If-None-Match': '"abc"'}, True),
+            ({'If-None-Match': 'W/"xyz", W/"abc"'}, True),
+            ({'If-None-Match': '*'}, True),
+            ({'If-None-Match': 'W/"xyz"'}, False),
+            # HTTP 日期只精确到秒，同一秒内的修改视为未修改
+            ({'If-Modified-Since': 'Wed, 02 Jan 2019 03:04:05 GMT'}, True),
+            ({'If-Modified-Since': 'Wed, 02 Jan 2019 03:04:04 GMT'}, False),
+            # 同时带有两种条件时只看 If-None-Match
+            ({'If-None-Match': 'W/"xyz"', 'If-Modified-Since': 'Wed, 02 Jan 2019 03:04:05 GMT'}, False),
+        ]
+        for headers, expected in cases:
+            with self.app.test_request_context(headers=headers):
+                self.assertEqual(is_not_modified(validators), expected, headers)
+
+        with self.app.test_request_context(headers={'If-Modified-Since': 'Wed, 02 Jan 2019 03:04:05 GMT'}):
+            self.assertFalse(is_not_modified(Validators('abc', None)))
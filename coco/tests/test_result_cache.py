@@ -0,0 +1,29 @@
+import unittest
+
+from coco.cache import LocalCache
+from coco.result_cache import ResultCache
+
+
+class TestCase(unittest.TestCase):
+    def test_results_are_rebuilt_after_invalidate(self):
+        cache = ResultCache(LocalCache(), ttl=60)
+        calls = []
+
+        def build(value):
+            calls.append(value)
+            return value
+
+        self.assertEqual(cache.get_or_build(('archive', 2018), lambda: build(1)), 1)
+        self.assertEqual(cache.get_or_build(('archive', 2018), lambda: build(2)), 1)
+        cache.invalidate(['tags'])
+        self.assertEqual(cache.get_or_build(('archive', 2018), lambda: build(3)), 1)
+        cache.invalidate(['archive'])
+        self.assertEqual(cache.get_or_build(('archive', 2018), lambda: build(4)), 4)
+        self.assertEqual(calls, [1, 4])
+
+    def test_oldest_entries_are_evicted(self):
+        cache = ResultCache(LocalCache(max_size=2), ttl=60)
+        for year in (2017, 2018, 2019):
+            cache.get_or_build(('archive', year), lambda: year)
+        self.assertEqual(cache.get_or_build(('archive', 2017), lambda: 'rebuilt'), 'rebuilt')
+        self.assertEqual(cache.get_or_build(('archive', 2019), lambda: 'rebuilt'), 2019)
@@ -0,0 +1,310 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from elasticsearch import ConnectionError as ESConnectionError
+from flask import Flask
+
+from coco.search import BulkIndexer, CircuitBreaker, create_versioned_index, bulk_load, publish_index
+from coco.search.elastic import ElasticsearchBackend, is_unavailable
+from coco.search.analysis import tokenize, highlight
+from coco.search.local import LocalBackend
+from coco.search.suggest import PrefixIndex, Suggester
+from coco.utils.testing_utils import FakeElasticsearch
+
+
+def _action(doc_id, op_type='index', title=''):
+    action = {'_op_type': op_type, '_index': 'article', '_type': 'article', '_id': doc_id}
+    if op_type == 'index':
+        action['_source'] = {'title': title}
+    return action
+
+
+class _Searchable:
+    __tablename__ = 'article'
+    __searchable__ = ['title', 'summary', 'content']
+    __search_source__ = ['slug', 'title', 'summary', 'created_time']
+    __search_facets__ = {
+        'category': ('category_id', 'term'),
+        'tag': ('tags', 'keyword'),
+        'month': ('created_time', 'month'),
+    }
+
+
+def _document(doc_id, title, content, category_id=1, tags=()):
+    return {
+        'id': doc_id,
+        'slug': f'slug{doc_id}',
+        'title': title,
+        'summary': None,
+        'content': content,
+        'created_time': datetime(2019, 1, doc_id),
+        'category_id': category_id,
+        'tags': list(tags),
+    }
+
+
+class TestCase(unittest.TestCase):
+    def test_synchronous_submit_sends_one_bulk_request(self):
+        indexer = BulkIndexer(client=None, asynchronous=False)
+        with patch('coco.search.elastic.bulk', return_value=(2, [])) as mock_bulk:
+            indexer.submit_many([_action(1), _action(2, op_type='delete')])
+        mock_bulk.assert_called_once()
+        self.assertEqual(len(mock_bulk.call_args[0][1]), 2)
+
+    def test_pending_actions_are_merged_by_document(self):
+        indexer = BulkIndexer(client=None, batch_size=10, flush_interval=60)
+        with patch('coco.search.elastic.bulk', return_value=(2, [])) as mock_bulk:
+            indexer.submit(_action(1, title='a'))
+            indexer.submit(_action(1, title='b'))
+            indexer.submit(_action(2))
+            indexer.close(timeout=5)
+        sent = [action for call in mock_bulk.call_args_list for action in call[0][1]]
+        self.assertEqual(len(sent), 2)
+        # 同一文档只发送最后一次操作，发送顺序不重要
+        sent = {action['_id']: action for action in sent}
+        self.assertEqual(set(sent), {1, 2})
+        self.assertEqual(sent[1]['_source']['title'], 'b')
+
+    def test_retry_only_failed_actions(self):
+        indexer = BulkIndexer(client=None, asynchronous=False, retry_backoff=0)
+        errors = [{'index': {'_index': 'article', '_id': '2', 'status': 429}}]
+        with patch('coco.search.elastic.bulk', side_effect=[(1, errors), (1, [])]) as mock_bulk:
+            indexer.submit_many([_action(1), _action(2)])
+        self.assertEqual(mock_bulk.call_count, 2)
+        self.assertEqual([a['_id'] for a in mock_bulk.call_args[0][1]], [2])
+
+    def test_missing_document_delete_is_not_retried(self):
+        indexer = BulkIndexer(client=None, asynchronous=False, retry_backoff=0)
+        errors = [{'delete': {'_index': 'article', '_id': '1', 'status': 404}}]
+        with patch('coco.search.elastic.bulk', return_value=(0, errors)) as mock_bulk:
+            indexer.submit(_action(1, op_type='delete'))
+        mock_bulk.assert_called_once()
+
+    def test_unavailable_cluster_defers_actions(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60, is_failure=is_unavailable)
+        indexer = BulkIndexer(client=None, asynchronous=False, breaker=breaker)
+        error = ESConnectionError('N/A', 'connection refused', None)
+        with patch('coco.search.elastic.bulk', side_effect=error) as mock_bulk:
+            indexer.submit(_action(1))
+            # 熔断期间不再请求 Elasticsearch，操作留在队列中
+            indexer.submit(_action(2))
+        mock_bulk.assert_called_once()
+        self.assertEqual(indexer.pending, 2)
+        self.assertEqual(breaker.stats()['state'], CircuitBreaker.OPEN)
+
+    def test_circuit_breaker_half_open_probe(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            breaker.record_failure(0.1)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # 半开状态只放行一次试探请求
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success(0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.stats()['rejected'], 2)
+
+    def test_publish_index_swaps_alias(self):
+        es = FakeElasticsearch()
+        old_index = create_versioned_index(es, 'article')
+        publish_index(es, 'article', old_index)
+
+        new_index = create_versioned_index(es, 'article')
+        self.assertEqual(es.settings[new_index]['refresh_interval'], '-1')
+        count = bulk_load(es, [_action(1), _action(2), _action(3, op_type='delete')])
+        self.assertEqual(count, 2)
+        # 别名切换前新文档只写入别名当前指向的索引
+        self.assertEqual(set(es.documents[old_index]), {'1', '2'})
+
+        bulk_load(es, [dict(_action(4), _index=new_index)])
+        publish_index(es, 'article', new_index)
+        self.assertEqual(es.aliases['article'], {new_index})
+        self.assertNotIn(old_index, es.documents)
+        self.assertNotIn('refresh_interval', es.settings[new_index])
+        self.assertIn(new_index, es.refreshed)
+
+    def test_rebuild_replays_changes_after_alias_swap(self):
+        es = FakeElasticsearch()
+        old_index = create_versioned_index(es, 'article')
+        publish_index(es, 'article', old_index)
+        # 第一次补写时只有 1 变化，切换前又提交了 2 的修改和 1 的软删除
+        replays = iter([
+            [(1, _document(1, '找工作', '面试'))],
+            [(1, None), (2, _document(2, '网速快', '光纤'))],
+        ])
+
+        class Model(_Searchable):
+            @staticmethod
+            def id_ranges(count):
+                return [(1, 2)]
+
+            @staticmethod
+            def iter_search_documents(first_id, last_id, chunk_size=500):
+                return [_document(1, '找工作', ''), _document(2, '网速慢', '')]
+
+            @staticmethod
+            def iter_changed_documents(since, chunk_size=500):
+                return next(replays)
+
+        backend = ElasticsearchBackend(es, BulkIndexer(es, asynchronous=False))
+        index, count = backend.rebuild(Model)
+        self.assertEqual(count, 2)
+        self.assertEqual(es.aliases['article'], {index})
+        self.assertEqual(es.documents[index], {'2': es.documents[index]['2']})
+        self.assertEqual(es.documents[index]['2']['title'], '网速快')
+
+    def test_publish_index_replaces_legacy_index(self):
+        es = FakeElasticsearch()
+        es.indices.create(index='article')
+        new_index = create_versioned_index(es, 'article')
+        publish_index(es, 'article', new_index)
+        self.assertNotIn('article', es.documents)
+        self.assertEqual(es.aliases['article'], {new_index})
+
+    def test_tokenize_chinese_bigrams(self):
+        self.assertEqual(tokenize('网速慢 WebGL', for_query=True), ['网速', '速慢', 'webgl'])
+        tokens = tokenize('找工作，Python3')
+        self.assertIn('找', tokens)
+        self.assertIn('工作', tokens)
+        self.assertIn('python3', tokens)
+
+    def test_highlight_merges_adjacent_tokens(self):
+        self.assertEqual(highlight('网速慢怎么办', ['网速', '速慢']), '<em>网速慢</em>怎么办')
+        self.assertIsNone(highlight('宽带', ['网速']))
+
+    def test_local_backend_incremental_updates(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        backend = LocalBackend(path, max_segments=2, asynchronous=False)
+        backend.apply_changes(_Searchable, {
+            1: _document(1, '找工作', '工作，公司，面试，房子'),
+            2: _document(2, '网速慢', '宽带，路由器，房子'),
+        })
+        self.assertEqual(backend.query_ids(_Searchable, '房子', 1, 10)[:2], ([2, 1], 2))
+
+        backend.apply_changes(_Searchable, {1: None})
+        backend.apply_changes(_Searchable, {2: _document(2, '网速快', '光纤')})
+        self.assertEqual(backend.query_ids(_Searchable, '房子', 1, 10)[:2], ([], 0))
+        # 第三个段写入后段数超过 max_segments，全部合并为一个段
+        self.assertEqual(len(backend.index(_Searchable).snapshot()[0]), 1)
+
+        documents, total, _, _ = backend.query_documents(_Searchable, '网速', 1, 10)
+        self.assertEqual(total, 1)
+        self.assertEqual(documents[0]['slug'], 'slug2')
+        self.assertEqual(documents[0]['highlights']['title'], ['<em>网速</em>快'])
+
+    def test_local_backend_merge_keeps_snapshots_readable(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        backend = LocalBackend(path, max_segments=2, asynchronous=False)
+        index = backend.index(_Searchable)
+        backend.apply_changes(_Searchable, {1: _document(1, '房子', '')})
+        backend.apply_changes(_Searchable, {2: _document(2, '房子', '')})
+        segments = index.snapshot()[0]
+        backend.apply_changes(_Searchable, {3: _document(3, '房子', '')})
+        self.assertEqual(len(index.snapshot()[0]), 1)
+        # 合并前取得的快照中的段仍然可以读取
+        self.assertEqual(segments[0].stored(0)['id'], 1)
+        self.assertEqual(backend.query_ids(_Searchable, '房子', 1, 10).items, [3, 2, 1])
+        self.assertEqual([name for name in os.listdir(index.path) if name.endswith('.seg')],
+                         index.snapshot()[0][0].name.split())
+
+    def test_local_backend_search_after(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        backend = LocalBackend(path)
+        backend.apply_changes(_Searchable, {i: _document(i, '房子', '') for i in range(1, 6)})
+        ids, total, after, _ = backend.query_ids(_Searchable, '房子', 1, 3)
+        self.assertEqual((ids, total), ([5, 4, 3], 5))
+        ids, _, after, _ = backend.query_ids(_Searchable, '房子', 1, 3, after=after)
+        self.assertEqual(ids, [2, 1])
+        self.assertIsNone(after)
+
+    def test_local_backend_filters_and_facets(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        backend = LocalBackend(path)
+        backend.apply_changes(_Searchable, {
+            1: _document(1, '房子', '', category_id=1, tags=['生活']),
+            2: _document(2, '房子', '', category_id=2, tags=['生活', '理财']),
+            3: _document(3, '房子', '', category_id=2),
+        })
+        result = backend.query_ids(_Searchable, '房子', 1, 10, filters={'category_id': 2}, facets=True)
+        self.assertEqual((result.items, result.total), ([3, 2], 2))
+        self.assertEqual(result.facets['category'], [{'value': 2, 'count': 2}])
+        self.assertEqual(result.facets['tag'], [{'value': '生活', 'count': 1}, {'value': '理财', 'count': 1}])
+        # 2019-01-02 00:00 UTC 为东八区的 1 月 2 日 08:00
+        self.assertEqual(result.facets['month'], [{'value': '2019-01', 'count': 2}])
+
+        result = backend.query_ids(_Searchable, '房子', 1, 10, filters={
+            'tags': '生活',
+            'created_time': (datetime(2019, 1, 2), None),
+        })
+        self.assertEqual(result.items, [2])
+        self.assertIsNone(result.facets)
+
+    def test_sync_changes_in_chunks(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        backend = LocalBackend(path)
+        backend.apply_changes(_Searchable, {1: _document(1, '房子', '')})
+        changes = iter([(1, None), (2, _document(2, '房子', '')), (3, _document(3, '房子', ''))])
+        self.assertEqual(backend.sync_changes(_Searchable, changes, chunk_size=2), 3)
+        self.assertEqual(backend.query_ids(_Searchable, '房子', 1, 10).items, [3, 2])
+        self.assertEqual(len(backend.index(_Searchable).snapshot()[0]), 3)
+
+    def test_prefix_index(self):
+        index = PrefixIndex(size=2)
+        index.add(('article', 1), 'Python 入门')
+        index.add(('article', 2), 'Python 进阶与实践')
+        index.add(('tag', 1), 'Python')
+        self.assertEqual(index.search('py'), [(('tag', 1), 'Python'), (('article', 1), 'Python 入门')])
+        self.assertEqual(index.search('python 进'), [(('article', 2), 'Python 进阶与实践')])
+
+        index.remove(('tag', 1))
+        self.assertEqual([key for key, _ in index.search('py')], [('article', 1), ('article', 2)])
+        index.add(('article', 1), 'Flask 入门')
+        self.assertEqual([key for key, _ in index.search('py')], [('article', 2)])
+        self.assertEqual(index.search('java'), [])
+
+    def test_suggester_reloads_in_background(self):
+        loading, release = threading.Event(), threading.Event()
+        titles = {1: 'Python 入门'}
+
+        class _Suggester(Suggester):
+            def _load(self):
+                if self._index is not None:
+                    loading.set()
+                    release.wait(5)
+                index = PrefixIndex(self.size)
+                for obj_id, text in titles.items():
+                    index.add(('article', obj_id), text)
+                return index
+
+        suggester = _Suggester(refresh_interval=0.01)
+        with Flask(__name__).app_context():
+            self.assertEqual(suggester.suggest('py'), [{'text': 'Python 入门', 'type': 'article'}])
+            titles[2] = 'Python 进阶'
+            time.sleep(0.02)
+            # 过期后查询不等待加载，仍然返回旧的结果
+            self.assertEqual(len(suggester.suggest('py')), 1)
+            self.assertTrue(loading.wait(5))
+            # 加载期间提交的变更补到新的前缀树中
+            suggester.apply_changes({('article', 3): 'Python 实践'})
+            release.set()
+            for _ in range(100):
+                if suggester._reloading is None:
+                    break
+                time.sleep(0.01)
+        self.assertEqual(
+            [text for _, text in suggester._index.search('py')],
+            ['Python 入门', 'Python 实践', 'Python 进阶']
+        )
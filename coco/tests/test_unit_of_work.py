@@ -0,0 +1,70 @@
+import unittest
+
+from flask import abort
+
+from coco import create_app, db, errors
+from coco.models.category import Category
+from coco.unit_of_work import unit_of_work, register_unit_of_work
+from coco.utils.json_util import gen_error_json
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def category_names(self):
+        return [name for name, in db.session.query(Category.name).order_by(Category.id)]
+
+    def test_changes_are_committed_once(self):
+        with unit_of_work():
+            Category.create(name='杂谈', author_id=1)
+            with unit_of_work():
+                Category.create(name='计算机', author_id=1)
+            # 内层退出时没有提交，回滚会撤销全部修改
+            db.session.rollback()
+        self.assertEqual(self.category_names(), [])
+
+        with unit_of_work():
+            Category.create(name='杂谈', author_id=1)
+            Category.create(name='计算机', author_id=1)
+        db.session.remove()
+        self.assertEqual(self.category_names(), ['杂谈', '计算机'])
+
+    def test_exception_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with unit_of_work():
+                Category.create(name='杂谈', author_id=1)
+                raise RuntimeError
+        self.assertEqual(self.category_names(), [])
+
+    def test_request_is_one_transaction(self):
+        register_unit_of_work(self.app)
+
+        @self.app.route('/_uow/<int:fail>')
+        def create_categories(fail):
+            Category.create(name='杂谈', author_id=1)
+            Category.create(name='计算机', author_id=1)
+            if fail == 1:
+                abort(400)
+            if fail == 2:
+                return gen_error_json(errors.ILLEGAL_FORM)
+            return 'ok'
+
+        client = self.app.test_client()
+        # 错误处理函数返回 HTTP 200 的错误信息，仍然回滚
+        response = client.get('/_uow/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.get_json()['success'])
+        self.assertEqual(self.category_names(), [])
+        client.get('/_uow/2')
+        self.assertEqual(self.category_names(), [])
+        client.get('/_uow/0')
+        self.assertEqual(self.category_names(), ['杂谈', '计算机'])
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from coco.view_counter import ViewCounter
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.engine = sa.create_engine(f'sqlite:///{path}')
+        metadata = sa.MetaData()
+        self.table = sa.Table(
+            'article', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('view_count', sa.Integer, nullable=False),
+            sa.Column('updated_time', sa.DateTime, nullable=False),
+        )
+        metadata.create_all(self.engine)
+        self.updated_time = datetime(2019, 1, 1)
+        self.engine.execute(self.table.insert(), [
+            {'id': 1, 'view_count': 10, 'updated_time': self.updated_time},
+            {'id': 2, 'view_count': 0, 'updated_time': self.updated_time},
+        ])
+
+    def view_counts(self):
+        rows = self.engine.execute(sa.select([self.table.c.id, self.table.c.view_count])).fetchall()
+        return dict(rows)
+
+    def test_deltas_are_flushed_in_one_update(self):
+        counter = ViewCounter(lambda: self.engine, self.table, flush_interval=60, max_pending=100)
+        for _ in range(3):
+            counter.incr(1)
+        counter.incr(2)
+        self.assertEqual(counter.pending(1), 3)
+        self.assertEqual(self.view_counts(), {1: 10, 2: 0})
+
+        counter.close(timeout=5)
+        self.assertEqual(self.view_counts(), {1: 13, 2: 1})
+        self.assertEqual(counter.pending(1), 0)
+        updated_times = self.engine.execute(sa.select([self.table.c.updated_time])).fetchall()
+        self.assertEqual({row[0] for row in updated_times}, {self.updated_time})
+
+    def test_failed_flush_keeps_deltas(self):
+        counter = ViewCounter(lambda: self.engine, self.table, column='missing', asynchronous=False)
+        counter.incr(1)
+        self.assertEqual(counter.pending(1), 1)
@@ -0,0 +1,39 @@
+import unittest
+
+from coco.utils.other_utils import encode_cursor, decode_cursor, page_meta_data, gen_summary
+
+
+class TestCase(unittest.TestCase):
+    def test_cursor_round_trip(self):
+        values = [1.2345, 42, '2019-03-19T22:34:08']
+        cursor = encode_cursor(values)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), values)
+
+    def test_decode_invalid_cursor(self):
+        for cursor in ('not a cursor', encode_cursor({'id': 1})[:-2], 'eyJpZCI6IDF9'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_page_meta_data_with_next_cursor(self):
+        self.assertNotIn('nextCursor', page_meta_data(1, 10, 0)['_meta'])
+        meta = page_meta_data(1, 10, 25, next_cursor='abc')['_meta']
+        self.assertEqual(meta['nextCursor'], 'abc')
+
+    def test_page_meta_data_without_total(self):
+        meta = page_meta_data(1, 10, None, next_cursor='abc')['_meta']
+        self.assertNotIn('total', meta)
+
+    def test_page_meta_data_with_approximate_total(self):
+        meta = page_meta_data(1, 10, 120000, approximate=True)['_meta']
+        self.assertEqual(meta['total'], 120000)
+        self.assertTrue(meta['totalApproximate'])
+        self.assertNotIn('totalApproximate', page_meta_data(1, 10, 12)['_meta'])
+
+    def test_gen_summary_strips_markdown(self):
+        text = '# 标题\n\n这是 **粗体** 和 [链接](http://example.com) ![图](a.png)\n```\ncode\n```\n- 列表项'
+        self.assertEqual(gen_summary(text), '标题 这是 粗体 和 链接 列表项')
+
+    def test_gen_summary_truncates(self):
+        summary = gen_summary('字' * 200, length=10)
+        self.assertEqual(summary, '字' * 9 + '…')
@@ -1,4 +1,5 @@
 import unittest
+from datetime import datetime
 from unittest.mock import MagicMock, patch
 
 from flask import url_for, current_app
@@ -258,3 +259,28 @@ class TestCase(unittest.TestCase):
         self.assertTrue(json_data['success'])
         user = AuthUser.get_by_id(1, deleted=False)
         self.assertTrue(user.verify_password('123456789'))
+
+    def test_last_login_time_is_written_once_per_interval(self):
+        user = AuthUser.get_by_email('panda@gmail.com')
+        AuthUser.query.filter_by(id=user.id).update({'last_login_time': datetime(2019, 1, 1)})
+        db.session.commit()
+        self.client.post(url_for('admin_auth.login'), data={'email': 'panda@gmail.com', 'password': '123456'})
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            if statement.startswith('UPDATE auth_user'):
+                statements.append(statement)
+
+        engine = db.get_engine(self.app)
+        db.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            self.client.get(url_for('main.category_list'))
+            self.client.get(url_for('main.category_list'))
+        finally:
+            db.event.remove(engine, 'before_cursor_execute', count)
+        self.assertEqual(len(statements), 1)
+        # 写入已经提交，不随请求的会话回滚
+        db.session.remove()
+        last_login_time = db.session.query(AuthUser.last_login_time).filter_by(id=user.id).scalar()
+        self.assertGreater(last_login_time, datetime(2019, 1, 1))
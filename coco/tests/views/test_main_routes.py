@@ -1,10 +1,13 @@
 import unittest
+from unittest.mock import patch
 
 from flask import url_for
 
 from coco import create_app, db
 from coco.models.article import Article
+from coco.models.category import Category
 from coco.models.comment import Comment
+from coco.models.tag import Tag
 from coco.utils.testing_utils import create_fake_data
 
 
@@ -19,7 +22,8 @@ class TestCase(unittest.TestCase):
 
     def tearDown(self):
         db.session.remove()
-        self.app.elasticsearch.indices.delete('article')
+        if self.app.elasticsearch:
+            self.app.elasticsearch.indices.delete('article', ignore=404)
         db.drop_all()
         self.app_context.pop()
 
@@ -56,6 +60,21 @@ class TestCase(unittest.TestCase):
         article_slugs = [article['slug'] for article in result['articles']]
         self.assertEqual(article_slugs, ['12345678', '01234567'])
 
+    def test_search_articles_from_index(self):
+        import time
+        time.sleep(1)
+
+        # 不带 full=1 时列表项直接由索引中的文档生成
+        response = self.client.get(url_for('main.search_articles', query='网速'))
+        articles = response.get_json()['data']['articles']
+        article = Article.get_by_slug('23456789')
+        self.assertEqual([item['slug'] for item in articles], ['23456789'])
+        self.assertEqual(articles[0]['title'], article.title)
+        self.assertIn('网速', ''.join(fragment for fragments in articles[0]['highlights'].values()
+                                     for fragment in fragments))
+        self.assertIsNotNone(articles[0]['createTime'])
+        self.assertIsNotNone(articles[0]['updateTime'])
+
     def test_category_list(self):
         response = self.client.get(url_for('main.category_list'))
         json_data = response.get_json()
@@ -63,12 +82,25 @@ class TestCase(unittest.TestCase):
         self.assertEqual(len(categories), 2)
         self.assertEqual(categories[0]['name'], '杂谈')
         self.assertEqual(categories[1]['name'], '计算机')
+        self.assertEqual([category['articleCount'] for category in categories], [1, 2])
 
     def test_tag_list(self):
         response = self.client.get(url_for('main.tag_list'))
         json_data = response.get_json()
-        tags = json_data['data']['tags']
-        self.assertEqual(set(tags), {'好玩', '程序员', '技术', '招聘', '网络', '交易'})
+        counts = {tag['name']: tag['articleCount'] for tag in json_data['data']['tags']}
+        self.assertEqual(counts, {'好玩': 1, '程序员': 2, '技术': 2, '招聘': 1, '网络': 1, '交易': 1})
+
+    def test_counts_follow_article_changes(self):
+        article = Article.get_by_slug('01234567')
+        article.update(category_id=1, tags='好玩,技术')
+        Article.get_by_slug('23456789').update(deleted=True)
+        categories = {category.name: category.article_count for category in Category.list_all()}
+        self.assertEqual(categories, {'杂谈': 1, '计算机': 1})
+        counts = {tag.name: tag.to_dict()['articleCount'] for tag in Tag.list_used()}
+        self.assertEqual(counts, {'好玩': 1, '程序员': 1, '技术': 2, '招聘': 1})
+
+        Article.refresh_counts()
+        self.assertEqual({tag.name: tag.article_count for tag in Tag.list_used()}, counts)
 
     def test_archive(self):
         response = self.client.get(url_for('main.archive'))
@@ -76,6 +108,21 @@ class TestCase(unittest.TestCase):
         self.assertEqual(json_data['data']['archive']['2018年1月'][0]['title'], 'WebGL制作游戏')
         self.assertEqual(json_data['data']['archive']['2018年8月'][0]['title'], '找工作')
         self.assertEqual(json_data['data']['archive']['2017年5月'][0]['title'], '网速慢')
+        self.assertTrue(json_data['data']['archive']['2017年5月'][0]['url'].endswith('/articles/23456789'))
+
+    def test_archive_by_year(self):
+        response = self.client.get(url_for('main.archive', year=2018))
+        archive = response.get_json()['data']['archive']
+        self.assertEqual(set(archive), {'2018年1月', '2018年8月'})
+
+        response = self.client.get(url_for('main.archive', year='abc'))
+        self.assertEqual(response.get_json()['errorCode'], 'FILTER_TYPE_ERROR')
+
+    def test_archive_rebuilt_after_retitle(self):
+        self.client.get(url_for('main.archive'))
+        Article.get_by_slug('23456789').update(title='网速很慢')
+        response = self.client.get(url_for('main.archive'))
+        self.assertEqual(response.get_json()['data']['archive']['2017年5月'][0]['title'], '网速很慢')
 
     def test_article_detail(self):
         response = self.client.get(url_for('main.article_detail', article_slug='01234567'))
@@ -88,10 +135,33 @@ class TestCase(unittest.TestCase):
         self.assertEqual(result['category'], '计算机')
         self.assertEqual(result['author'], 'panda')
 
+    def test_article_detail_does_not_reindex(self):
+        # 只有浏览数变化，不需要更新搜索索引
+        with patch.object(self.app.search_backend, 'apply_changes') as mock_apply:
+            self.client.get(url_for('main.article_detail', article_slug='01234567'))
+        mock_apply.assert_not_called()
+
     def test_article_list(self):
         response = self.client.get(url_for('main.article_list'))
         json_data = response.get_json()
         self.assertEqual(len(json_data['data']['articles']), 3)
+        # 列表只返回摘要
+        self.assertNotIn('content', json_data['data']['articles'][0])
+        self.assertIn('summary', json_data['data']['articles'][0])
+
+    def test_article_list_with_cursor(self):
+        url = url_for('main.article_list')
+        json_data = self.client.get(f'{url}?after=').get_json()
+        meta = json_data['data']['_meta']
+        self.assertEqual(len(json_data['data']['articles']), 3)
+        self.assertNotIn('total', meta)
+        self.assertNotIn('nextCursor', meta)
+
+        json_data = self.client.get(f'{url}?after=&total=1').get_json()
+        self.assertEqual(json_data['data']['_meta']['total'], 3)
+
+        json_data = self.client.get(f'{url}?after=abc').get_json()
+        self.assertEqual(json_data['errorCode'], 'INVALID_CURSOR')
 
     def test_article_list_by_category_id(self):
         response = self.client.get(url_for('main.article_list_by_category_id', category_id=2))
@@ -109,17 +179,87 @@ class TestCase(unittest.TestCase):
         self.assertEqual(articles[0]['title'], '网速慢')
         self.assertEqual(articles[1]['title'], '找工作')
 
+    def test_article_list_by_tag_matches_whole_name(self):
+        response = self.client.get(url_for('main.article_list_by_tag', tag='程序'))
+        json_data = response.get_json()
+        self.assertEqual(json_data['data']['articles'], [])
+
+    def test_response_cache(self):
+        url = url_for('main.article_list')
+        self.assertEqual(self.client.get(url).headers['X-Cache'], 'MISS')
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        response = self.client.get(url)
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(len(response.get_json()['data']['articles']), 3)
+
+        # 修改列表中的文章后重新生成，不包含该文章的分类页面仍然有效
+        category_url = url_for('main.article_list_by_category_id', category_id=1)
+        self.client.get(category_url)
+        Article.get_by_slug('01234567').update(title='WebGL制作小游戏')
+        response = self.client.get(url)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertIn('WebGL制作小游戏', [article['title'] for article in response.get_json()['data']['articles']])
+        self.assertEqual(self.client.get(category_url).headers['X-Cache'], 'HIT')
+
+    def test_response_cache_counts_views_on_hit(self):
+        url = url_for('main.article_detail', article_slug='01234567')
+        self.client.get(url)
+        self.assertEqual(self.client.get(url).headers['X-Cache'], 'HIT')
+        view_count = db.session.query(Article.view_count).filter_by(slug='01234567').scalar()
+        self.assertEqual(view_count, 2)
+
+    def test_conditional_get(self):
+        url = url_for('main.article_list')
+        response = self.client.get(url)
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+        self.assertTrue(etag.startswith('W/'))
+
+        # 命中缓存和未命中缓存时都返回 304
+        for _ in range(2):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b'')
+        response = self.client.get(url_for('main.archive'), headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        Article.get_by_slug('01234567').update(title='WebGL制作小游戏')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_count_changes_update_etag(self):
+        etags = {}
+        for endpoint in ('main.tag_list', 'main.category_list'):
+            etags[endpoint] = self.client.get(url_for(endpoint)).headers['ETag']
+        # 删除文章只通过计数列改变标签和分类
+        Article.get_by_slug('23456789').update(deleted=True)
+        for endpoint, etag in etags.items():
+            response = self.client.get(url_for(endpoint), headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+
+    def test_view_count_does_not_change_etag(self):
+        url = url_for('main.article_detail', article_slug='01234567')
+        etag = self.client.get(url).headers['ETag']
+        self.app.response_cache.backend.clear()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        # 返回 304 时仍然累加浏览数
+        view_count = db.session.query(Article.view_count).filter_by(slug='01234567').scalar()
+        self.assertEqual(view_count, 2)
+
     def test_comment_list_by_article_slug(self):
         response = self.client.get(url_for('main.comment_list_by_article_slug', article_slug='12345678'))
         json_data = response.get_json()
         comments = json_data['data']['comments']
         self.assertEqual(len(comments), 2)
-        self.assertEqual(comments[0]['body'], '给我一份简历')
-        self.assertEqual(comments[1]['body'], '多面几家试试')
+        self.assertEqual(comments[0]['content'], '给我一份简历')
+        self.assertEqual(comments[1]['content'], '多面几家试试')
 
     def test_publish_article(self):
         response = self.client.post(
-            url_for('auth.login'),
+            url_for('admin_auth.login'),
             data={
                 'email': 'panda@gmail.com',
                 'password': '123456'
@@ -132,7 +272,7 @@ class TestCase(unittest.TestCase):
             url_for('main.publish_article'),
             data={
                 'title': 'Flask框架初探',
-                'body': 'Flask框架是一个用Python实现的微框架。...',
+                'content': 'Flask框架是一个用Python实现的微框架。...',
                 'category_id': 1,
                 'tags': 'Python,Flask,Web'
             }
@@ -141,13 +281,22 @@ class TestCase(unittest.TestCase):
         self.assertTrue(json_data['success'])
 
         article = Article.get_by_title(title='Flask框架初探', deleted=False)
-        self.assertEqual(article.body_text, 'Flask框架是一个用Python实现的微框架。...')
+        self.assertEqual(article.content, 'Flask框架是一个用Python实现的微框架。...')
         self.assertEqual(article.category_id, 1)
-        self.assertEqual(article.tags, 'Python,Flask,Web')
+        self.assertEqual(article.tags, ['Python', 'Flask', 'Web'])
+
+    def test_publish_article_with_long_tag(self):
+        self.client.post(url_for('admin_auth.login'), data={'email': 'panda@gmail.com', 'password': '123456'})
+        response = self.client.post(
+            url_for('main.publish_article'),
+            data={'title': 'Flask框架初探', 'content': '...', 'category_id': 1, 'tags': 'Python,' + '长' * 11}
+        )
+        self.assertEqual(response.get_json()['errorCode'], 'ILLEGAL_FORM')
+        self.assertIsNone(Article.get_by_title(title='Flask框架初探'))
 
     def test_edit_article(self):
         response = self.client.post(
-            url_for('auth.login'),
+            url_for('admin_auth.login'),
             data={
                 'email': 'panda@gmail.com',
                 'password': '123456'
@@ -160,7 +309,7 @@ class TestCase(unittest.TestCase):
             url_for('main.edit_article', article_slug='01234567'),
             data={
                 'title': '学习使用WebGL制作小游戏',
-                'body': '...',
+                'content': '...',
                 'category_id': 2,
                 'tags': '游戏,程序员,JavaScript'
             }
@@ -170,13 +319,13 @@ class TestCase(unittest.TestCase):
 
         article = Article.get_by_id(1, deleted=False)
         self.assertEqual(article.title, '学习使用WebGL制作小游戏')
-        self.assertEqual(article.body_text, '...')
+        self.assertEqual(article.content, '...')
         self.assertEqual(article.category_id, 2)
-        self.assertEqual(article.tags, '游戏,程序员,JavaScript')
+        self.assertEqual(sorted(article.tags), sorted(['游戏', '程序员', 'JavaScript']))
 
     def test_review_comment(self):
         response = self.client.post(
-            url_for('auth.login'),
+            url_for('admin_auth.login'),
             data={
                 'email': 'panda@gmail.com',
                 'password': '123456'
@@ -204,7 +353,7 @@ class TestCase(unittest.TestCase):
         self.assertEqual(comment.deleted, True)
 
     def test_publish_comment(self):
-        url = url_for('auth.login')
+        url = url_for('admin_auth.login')
         response = self.client.post(url, data={'email': 'panda@gmail.com', 'password': '123456'})
         json_data = response.get_json()
         self.assertTrue(json_data['success'])
@@ -213,7 +362,7 @@ class TestCase(unittest.TestCase):
         response = self.client.post(
             url_for('main.publish_comment', article_slug='01234567'),
             data={
-                'body': new_comment_body
+                'content': new_comment_body
             }
         )
         json_data = response.get_json()
@@ -223,17 +372,17 @@ class TestCase(unittest.TestCase):
         response = self.client.post(
             url_for('main.publish_comment', article_slug='01234567'),
             data={
-                'body': new_comment_body
+                'content': new_comment_body
             }
         )
         json_data = response.get_json()
         self.assertTrue(json_data['success'])
 
         comment = Comment.get_latest_by_article_id(article_id=1, deleted=False)
-        self.assertEqual(comment.body, new_comment_body)
+        self.assertEqual(comment.content, new_comment_body)
 
     def test_modify_comment(self):
-        url = url_for('auth.login')
+        url = url_for('admin_auth.login')
         response = self.client.post(url, data={'email': 'panda@gmail.com', 'password': '123456'})
         json_data = response.get_json()
         self.assertTrue(json_data['success'])
@@ -242,10 +391,10 @@ class TestCase(unittest.TestCase):
         response = self.client.post(
             url_for('main.modify_comment', comment_id=1),
             data={
-                'body': new_comment_body
+                'content': new_comment_body
             }
         )
         json_data = response.get_json()
         self.assertTrue(json_data['success'])
         comment = Comment.get_by_id(1, deleted=False)
-        self.assertEqual(comment.body, new_comment_body)
+        self.assertEqual(comment.content, new_comment_body)
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+
+from coco.extensions import db
+
+
+def in_unit_of_work():
+    return db.session.info.get('unit_of_work', 0) > 0
+
+
+def commit_or_flush():
+    """模型的 save/delete 调用：在 unit_of_work 中只 flush，由最外层统一提交，否则立即提交"""
+    if in_unit_of_work():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def mark_failed():
+    """请求返回错误信息时调用，请求的事务在返回响应前回滚
+
+    错误处理函数把 abort() 转换为 HTTP 200 的错误信息，不能按状态码判断请求是否失败
+    """
+    if in_unit_of_work():
+        db.session.info['unit_of_work_failed'] = True
+
+
+@contextmanager
+def unit_of_work():
+    """with 块中模型的增删改只 flush，正常退出时提交一次，出现异常时回滚
+
+    可以嵌套，只有最外层提交。供命令行和后台任务把多行修改合并为一个事务：
+        with unit_of_work():
+            article.update(title=...)
+            Comment.create(...)
+    """
+    session = db.session
+    depth = session.info.get('unit_of_work', 0)
+    session.info['unit_of_work'] = depth + 1
+    try:
+        yield session
+        if depth == 0:
+            session.commit()
+    except BaseException:
+        if depth == 0:
+            session.rollback()
+        raise
+    finally:
+        session.info['unit_of_work'] = depth
+
+
+def register_unit_of_work(app):
+    """每个请求作为一个事务：请求中模型的修改只 flush，返回响应前提交，出错时回滚"""
+
+    @app.before_request
+    def begin_unit_of_work():
+        db.session.info['unit_of_work'] = 1
+        db.session.info.pop('unit_of_work_failed', None)
+
+    @app.after_request
+    def commit_unit_of_work(response):
+        if db.session.info.get('unit_of_work'):
+            db.session.info['unit_of_work'] = 0
+            failed = db.session.info.pop('unit_of_work_failed', False)
+            # 返回错误信息（见 mark_failed）和未处理的异常产生的错误响应回滚；提交失败时抛出异常，客户端会收到 500
+            if not failed and response.status_code < 400:
+                db.session.commit()
+            else:
+                db.session.rollback()
+        return response
+
+    @app.teardown_request
+    def rollback_unit_of_work(exc):
+        # 视图抛出异常时 after_request 不会执行，在这里回滚
+        if db.session.info.get('unit_of_work'):
+            db.session.info['unit_of_work'] = 0
+            db.session.info.pop('unit_of_work_failed', None)
+            db.session.rollback()
@@ -1,4 +1,4 @@
-from wtforms.validators import Regexp
+from wtforms.validators import Regexp, ValidationError
 
 
 class PasswordRequired:
@@ -9,3 +9,16 @@ class PasswordRequired:
     def __call__(self, form, field):
         Regexp(self.password_format).__call__(form, field, self.message)
 
+
+class TagsRequired:
+    """逗号分隔的标签，每个标签名的长度不能超过数据库的限制"""
+    def __init__(self):
+        from coco.models.tag import TAG_NAME_LENGTH
+        self.message = f'每个标签不能超过{TAG_NAME_LENGTH}个字符'
+
+    def __call__(self, form, field):
+        from coco.models.article import Article
+        try:
+            Article.parse_tags(field.data)
+        except ValueError:
+            raise ValidationError(self.message)
@@ -1,5 +1,7 @@
 from flask import jsonify
 
+from coco.unit_of_work import mark_failed
+
 
 def gen_success_json(result=None):
     result = {} if result is None else result
@@ -11,6 +13,8 @@ def gen_success_json(result=None):
 
 
 def gen_error_json(error):
+    # 请求作为一个事务时，返回错误信息的请求不提交已经 flush 的修改
+    mark_failed()
     data = {
         'success': False,
         'errorCode': error.code,
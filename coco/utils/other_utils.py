@@ -1,3 +1,6 @@
+import base64
+import json
+import re
 from uuid import uuid1
 from functools import wraps
 from threading import Thread
@@ -33,11 +36,57 @@ def gen_slug(length=8):
     return str(hash_value)[0:length]
 
 
-def page_meta_data(page, page_size, total):
-    return {
-        '_meta': {
-            'page': page,
-            'pageSize': page_size,
-            'total': total
-        }
+# 生成摘要时去掉的 Markdown 标记
+_MARKDOWN_PATTERNS = [
+    (re.compile(r'```.*?```', re.S), ' '),              # 代码块
+    (re.compile(r'!\[[^\]]*\]\([^)]*\)'), ' '),          # 图片
+    (re.compile(r'\[([^\]]*)\]\([^)]*\)'), r'\1'),        # 链接只保留文字
+    (re.compile(r'<[^>]+>'), ' '),                      # HTML 标签
+    (re.compile(r'^\s{0,3}(#{1,6}|>|[-*+]|\d+\.)\s+', re.M), ''),  # 标题、引用和列表标记
+    (re.compile(r'[`*_~]+'), ''),                       # 行内代码和强调
+]
+
+
+def gen_summary(text, length=120):
+    """从 Markdown 正文生成纯文本摘要，超过 length 个字符时截断并加省略号"""
+    for pattern, repl in _MARKDOWN_PATTERNS:
+        text = pattern.sub(repl, text or '')
+    text = ' '.join(text.split())
+    if len(text) > length:
+        text = text[:length - 1].rstrip() + '…'
+    return text
+
+
+def page_meta_data(page, page_size, total, next_cursor=None, approximate=False):
+    """游标分页时 total 可以为 None（客户端没有要求统计总数），此时不返回 total；
+    approximate 为 True 表示 total 是估算值
+    """
+    meta = {
+        'page': page,
+        'pageSize': page_size,
     }
+    if total is not None:
+        meta['total'] = total
+        if approximate:
+            meta['totalApproximate'] = True
+    if next_cursor is not None:
+        meta['nextCursor'] = next_cursor
+    return {'_meta': meta}
+
+
+def encode_cursor(values):
+    """把分页位置编码为对客户端不透明的字符串"""
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解码 encode_cursor 生成的字符串，格式错误时抛出 ValueError"""
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+    if not isinstance(values, list):
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+    return values
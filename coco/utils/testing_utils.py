@@ -1,4 +1,8 @@
+import json
 from datetime import datetime
+from types import SimpleNamespace
+
+from elasticsearch.serializer import JSONSerializer
 
 from coco.models.auth_user import AuthUser, UserGroup
 from coco.models.category import Category
@@ -8,17 +12,17 @@ from coco.models.comment import Comment
 
 def create_fake_data():
     user1 = AuthUser.create(
-        nickname='panda',
+        username='panda',
         email='panda@gmail.com',
         password='123456',
-        role=UserGroup.Admin
+        group=UserGroup.Admin
     )
-    user2 = AuthUser.create(nickname='lori', email='lori@gmail.com', password='000000')
-    category1 = Category.create(name='杂谈')
-    category2 = Category.create(name='计算机')
+    user2 = AuthUser.create(username='lori', email='lori@gmail.com', password='000000', group=UserGroup.Visitor)
+    category1 = Category.create(name='杂谈', author_id=user1.id)
+    category2 = Category.create(name='计算机', author_id=user1.id)
     article1 = Article.create(
         title='WebGL制作游戏',
-        body_text='WebGL 游戏 难',
+        content='WebGL 游戏 难',
         tags='好玩,程序员',
         author_id=user1.id,
         category_id=category2.id,
@@ -28,7 +32,7 @@ def create_fake_data():
     article2 = Article.create(
         slug='12345678',
         title='找工作',
-        body_text='工作，公司，面试，笔试，房子',
+        content='工作，公司，面试，笔试，房子',
         tags='程序员,技术,招聘',
         author_id=user2.id,
         category_id=category2.id,
@@ -38,20 +42,94 @@ def create_fake_data():
     article3 = Article.create(
         slug='23456789',
         title='网速慢',
-        body_text='宽带，联通、电信，屏蔽，路由器 房子',
+        content='宽带，联通、电信，屏蔽，路由器 房子',
         tags='网络,技术,交易',
         author_id=user1.id,
         category_id=category1.id,
         created_time=datetime(2017, 5, 3)
     )
     article3.update(slug='23456789')
-    Comment.create(body='多面几家试试', author_id=1, article_id=2)
-    Comment.create(body='我家的也很慢', author_id=2, article_id=3)
-    Comment.create(body='可以学习three.js', author_id=2, article_id=1)
-    Comment.create(body='给我一份简历', author_id=1, article_id=2)
+    Comment.create(content='多面几家试试', nickname='panda', email='panda@gmail.com', article_id=2)
+    Comment.create(content='我家的也很慢', nickname='lori', email='lori@gmail.com', article_id=3)
+    Comment.create(content='可以学习three.js', nickname='lori', email='lori@gmail.com', article_id=1)
+    Comment.create(content='给我一份简历', nickname='panda', email='panda@gmail.com', article_id=2)
 
 
 def create_user_data():
-    AuthUser.create(nickname='panda', email='panda@gmail.com', password='123456')
-    AuthUser.create(nickname='dog', email='dog@gmail.com', password='000000')
+    AuthUser.create(username='panda', email='panda@gmail.com', password='123456', group=UserGroup.Admin)
+    AuthUser.create(username='dog', email='dog@gmail.com', password='000000', group=UserGroup.Visitor)
+
+
+class _FakeIndices:
+    def __init__(self, es):
+        self.es = es
+
+    def create(self, index, body=None, **kwargs):
+        self.es.documents[index] = {}
+        self.es.settings[index] = dict((body or {}).get('settings', {}).get('index', {}))
+
+    def exists(self, index, **kwargs):
+        return index in self.es.documents or index in self.es.aliases
+
+    def exists_alias(self, name, **kwargs):
+        return name in self.es.aliases
+
+    def get_alias(self, name, **kwargs):
+        return {index: {'aliases': {name: {}}} for index in self.es.aliases[name]}
+
+    def put_settings(self, body, index, **kwargs):
+        for key, value in body['index'].items():
+            if value is None:
+                self.es.settings[index].pop(key, None)
+            else:
+                self.es.settings[index][key] = value
+
+    def refresh(self, index=None, **kwargs):
+        self.es.refreshed.append(index)
+
+    def update_aliases(self, body, **kwargs):
+        for action in body['actions']:
+            (op, params), = action.items()
+            if op == 'add':
+                self.es.aliases.setdefault(params['alias'], set()).add(params['index'])
+            elif op == 'remove':
+                self.es.aliases[params['alias']].discard(params['index'])
+            elif op == 'remove_index':
+                self.delete(params['index'])
+
+    def delete(self, index, ignore=None, **kwargs):
+        self.es.documents.pop(index, None)
+        self.es.settings.pop(index, None)
+
+
+class FakeElasticsearch:
+    """测试用的 Elasticsearch 替身，只实现索引管理和 bulk 写入"""
+
+    def __init__(self):
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+        self.documents = {}
+        self.settings = {}
+        self.aliases = {}
+        self.refreshed = []
+        self.indices = _FakeIndices(self)
+
+    def resolve(self, name):
+        if name in self.aliases:
+            return sorted(self.aliases[name])[0]
+        return name
 
+    def bulk(self, body, index=None, doc_type=None, **kwargs):
+        lines = [line for line in body.splitlines() if line]
+        items = []
+        while lines:
+            (op_type, meta), = json.loads(lines.pop(0)).items()
+            target = self.resolve(meta.get('_index', index))
+            doc_id = str(meta['_id'])
+            docs = self.documents.setdefault(target, {})
+            if op_type == 'delete':
+                status = 200 if docs.pop(doc_id, None) is not None else 404
+            else:
+                docs[doc_id] = json.loads(lines.pop(0))
+                status = 201
+            items.append({op_type: {'_index': target, '_id': doc_id, 'status': status}})
+        return {'errors': any(next(iter(i.values()))['status'] >= 300 for i in items), 'items': items}
@@ -0,0 +1,127 @@
+import atexit
+import os
+import threading
+from collections import defaultdict
+
+from sqlalchemy import case
+
+from coco.extensions import db
+
+
+class ViewCounter:
+    """浏览数累加器
+
+    浏览数先按记录 id 在内存中累加，后台线程每隔 flush_interval 秒或累计 max_pending 次浏览后，
+    用一条 UPDATE ... SET view_count = view_count + CASE id ... END 写入全部增量。
+    写入的是增量，多个进程各自累加也不会互相覆盖；不经过 ORM，不会修改 updated_time。
+    asynchronous 为 False 时每次累加后立即写入，供测试使用。
+    """
+
+    def __init__(self, get_engine, table, column='view_count', flush_interval=5.0,
+                 max_pending=1000, asynchronous=True, logger=None):
+        self.get_engine = get_engine
+        self.table = table
+        self.column = column
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.asynchronous = asynchronous
+        self.logger = logger
+        self._pending = defaultdict(int)
+        # 正在写入数据库的增量，写入完成前仍计入实时浏览数
+        self._inflight = {}
+        self._count = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        self._pid = None
+
+    @classmethod
+    def from_app(cls, app, table):
+        counter = cls(
+            lambda: db.get_engine(app),
+            table,
+            flush_interval=app.config['VIEW_COUNT_FLUSH_INTERVAL'],
+            max_pending=app.config['VIEW_COUNT_MAX_PENDING'],
+            asynchronous=app.config['VIEW_COUNT_ASYNC'],
+            logger=app.logger,
+        )
+        atexit.register(counter.close, app.config['VIEW_COUNT_DRAIN_TIMEOUT'])
+        return counter
+
+    def incr(self, obj_id, delta=1):
+        with self._cond:
+            self._pending[obj_id] += delta
+            self._count += delta
+            if self.asynchronous:
+                self._ensure_worker()
+                if self._count >= self.max_pending:
+                    self._cond.notify()
+        if not self.asynchronous:
+            self.flush()
+
+    def pending(self, obj_id):
+        """还没有写入数据库的增量，数据库中的值加上它就是实时浏览数"""
+        with self._cond:
+            return self._pending.get(obj_id, 0) + self._inflight.get(obj_id, 0)
+
+    def flush(self):
+        # 同一时刻只有一个线程写入，保证 _inflight 只对应一次 UPDATE
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return
+                self._inflight = dict(self._pending)
+                self._pending.clear()
+                self._count = 0
+            try:
+                self._write(self._inflight)
+            except Exception as e:
+                # 写入失败时把增量放回队列，下次一起写入
+                with self._cond:
+                    for obj_id, delta in self._inflight.items():
+                        self._pending[obj_id] += delta
+                        self._count += delta
+                if self.logger:
+                    self.logger.error(f'Failed to flush view counts: {e}')
+            finally:
+                with self._cond:
+                    self._inflight = {}
+
+    def _write(self, deltas):
+        column = self.table.c[self.column]
+        statement = self.table.update()\
+            .where(self.table.c.id.in_(list(deltas)))\
+            .values({self.column: column + case(deltas, value=self.table.c.id, else_=0)})
+        with self.get_engine().begin() as connection:
+            connection.execute(statement)
+
+    def close(self, timeout=None):
+        """停止后台线程，并把剩余的增量写入数据库"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def _ensure_worker(self):
+        # 进程 fork 之后父进程的线程不会被继承，需要重新启动
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._count >= self.max_pending,
+                    timeout=self.flush_interval
+                )
+                closed = self._closed
+            if closed:
+                return
+            self.flush()
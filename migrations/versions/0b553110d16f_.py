@@ -0,0 +1,70 @@
+"""article full text search vector
+
+Revision ID: 0b553110d16f
+Revises: f88f9a1e9b3e
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '0b553110d16f'
+down_revision = 'f88f9a1e9b3e'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 500
+
+# 迁移写入的内容不能随应用代码变化，这里保存一份编写时的 coco.search.analysis.tokenize
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[^\W_{_CJK}]+')
+
+
+def tokenize(text):
+    tokens = []
+    for match in _TOKEN_RE.finditer(text or ''):
+        word = match.group().lower()
+        if not re.match(f'[{_CJK}]', word) or len(word) == 1:
+            tokens.append(word)
+            continue
+        tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def upgrade():
+    op.add_column('article', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True, comment='全文检索向量'))
+    op.create_index('ix_article_search_vector', 'article', ['search_vector'], unique=False, postgresql_using='gin')
+
+    # 分批填充已有文章的检索向量，与 PostgresBackend 的权重一致：标题 A、摘要 B、正文 C
+    bind = op.get_bind()
+    select = sa.text('SELECT id, title, summary, content FROM article WHERE id > :last_id ORDER BY id LIMIT :limit')
+    update = sa.text(
+        "UPDATE article SET search_vector = "
+        "setweight(to_tsvector('simple', :title), 'A') || "
+        "setweight(to_tsvector('simple', :summary), 'B') || "
+        "setweight(to_tsvector('simple', :content), 'C') "
+        "WHERE id = :id"
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(select, last_id=last_id, limit=BATCH_SIZE).fetchall()
+        if not rows:
+            break
+        bind.execute(update, [{
+            'id': row.id,
+            'title': ' '.join(tokenize(row.title)),
+            'summary': ' '.join(tokenize(row.summary)),
+            'content': ' '.join(tokenize(row.content)),
+        } for row in rows])
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_index('ix_article_search_vector', table_name='article')
+    op.drop_column('article', 'search_vector')
@@ -0,0 +1,87 @@
+"""article_tag backfill and tag index
+
+Revision ID: 3e7b1c9d5f20
+Revises: 9a3c5e71d2b4
+Create Date: 2026-10-18 16:40:12.208415
+
+"""
+import logging
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e7b1c9d5f20'
+down_revision = '9a3c5e71d2b4'
+branch_labels = None
+depends_on = None
+
+# 每批回填的文章数
+BATCH_SIZE = 500
+# tag.name 的长度限制
+TAG_NAME_LENGTH = 10
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def _parse_tags(value):
+    names = (name.strip() for name in re.split(r'[,，]', value or ''))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def _backfill(bind):
+    """把旧的 article.tags 字符串拆分写入 tag 和 article_tag，按 id 分批，重复执行不会重复插入"""
+    last_id = 0
+    too_long = []
+    while True:
+        rows = bind.execute(
+            sa.text('SELECT id, author_id, tags FROM article WHERE id > :last_id ORDER BY id LIMIT :limit'),
+            {'last_id': last_id, 'limit': BATCH_SIZE}
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        pairs = []
+        for article_id, author_id, tags in rows:
+            for name in _parse_tags(tags):
+                if len(name) > TAG_NAME_LENGTH:
+                    logger.error('Tag %r of article %s is longer than %s', name, article_id, TAG_NAME_LENGTH)
+                    too_long.append(name)
+                    continue
+                pairs.append({'article_id': article_id, 'author_id': author_id, 'name': name})
+        if not pairs:
+            continue
+
+        bind.execute(sa.text(
+            'INSERT INTO tag (created_time, updated_time, deleted, author_id, name) '
+            "VALUES (now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc', false, :author_id, :name) "
+            'ON CONFLICT (name) DO NOTHING'
+        ), pairs)
+        bind.execute(sa.text(
+            'INSERT INTO article_tag (created_time, updated_time, deleted, article_id, tag_id) '
+            "SELECT now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc', false, :article_id, id FROM tag WHERE name = :name "
+            'ON CONFLICT (article_id, tag_id) DO NOTHING'
+        ), pairs)
+
+    # 超长的标签放不进 tag.name，让迁移失败回滚，而不是丢掉这些数据
+    if too_long:
+        raise RuntimeError(
+            f'{len(too_long)} tags are longer than {TAG_NAME_LENGTH} characters, '
+            'shorten them in article.tags and run the migration again'
+        )
+
+
+def upgrade():
+    op.create_index('ix_article_tag_tag_id_article_id', 'article_tag', ['tag_id', 'article_id'], unique=False)
+    bind = op.get_bind()
+    columns = {column['name'] for column in sa.inspect(bind).get_columns('article')}
+    # 只有保留旧的 tags 字符串列的数据库需要回填
+    if 'tags' in columns:
+        _backfill(bind)
+
+
+def downgrade():
+    op.drop_index('ix_article_tag_tag_id_article_id', table_name='article_tag')
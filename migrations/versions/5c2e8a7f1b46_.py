@@ -0,0 +1,67 @@
+"""fill empty article summaries
+
+Revision ID: 5c2e8a7f1b46
+Revises: b81f4d2a6c93
+Create Date: 2026-10-18 18:05:31.927154
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8a7f1b46'
+down_revision = 'b81f4d2a6c93'
+branch_labels = None
+depends_on = None
+
+# 每批处理的文章数
+BATCH_SIZE = 500
+
+# 迁移写入的内容不能随应用代码变化，这里保存一份编写时的 coco.utils.other_utils.gen_summary
+SUMMARY_LENGTH = 120
+_MARKDOWN_PATTERNS = [
+    (re.compile(r'```.*?```', re.S), ' '),
+    (re.compile(r'!\[[^\]]*\]\([^)]*\)'), ' '),
+    (re.compile(r'\[([^\]]*)\]\([^)]*\)'), r'\1'),
+    (re.compile(r'<[^>]+>'), ' '),
+    (re.compile(r'^\s{0,3}(#{1,6}|>|[-*+]|\d+\.)\s+', re.M), ''),
+    (re.compile(r'[`*_~]+'), ''),
+]
+
+
+def gen_summary(text):
+    for pattern, repl in _MARKDOWN_PATTERNS:
+        text = pattern.sub(repl, text or '')
+    text = ' '.join(text.split())
+    if len(text) > SUMMARY_LENGTH:
+        text = text[:SUMMARY_LENGTH - 1].rstrip() + '…'
+    return text
+
+
+def upgrade():
+    """为没有摘要的文章由正文生成摘要，按 id 分批读取正文"""
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, content FROM article WHERE id > :last_id AND coalesce(summary, '') = '' "
+                'ORDER BY id LIMIT :limit'
+            ),
+            {'last_id': last_id, 'limit': BATCH_SIZE}
+        ).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        bind.execute(
+            sa.text('UPDATE article SET summary = :summary WHERE id = :id'),
+            [{'id': article_id, 'summary': gen_summary(content)} for article_id, content in rows]
+        )
+
+
+def downgrade():
+    # 无法区分作者填写的摘要和生成的摘要，不做处理
+    pass
@@ -0,0 +1,26 @@
+"""keyset pagination indexes
+
+Revision ID: 9a3c5e71d2b4
+Revises: fc0d40481e03
+Create Date: 2026-10-18 15:21:07.512309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3c5e71d2b4'
+down_revision = 'fc0d40481e03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_article_category_id_id', 'article', ['category_id', 'id'], unique=False)
+    op.create_index('ix_comment_article_id_id', 'comment', ['article_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comment_article_id_id', table_name='comment')
+    op.drop_index('ix_article_category_id_id', table_name='article')
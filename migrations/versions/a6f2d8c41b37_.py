@@ -0,0 +1,80 @@
+"""article search vector includes tags
+
+Revision ID: a6f2d8c41b37
+Revises: 7d4a2f9c8e15
+Create Date: 2026-10-19 09:41:07.318256
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6f2d8c41b37'
+down_revision = '7d4a2f9c8e15'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 500
+
+# 迁移写入的内容不能随应用代码变化，这里保存一份编写时的 coco.search.analysis.tokenize
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[^\W_{_CJK}]+')
+
+
+def tokenize(text):
+    tokens = []
+    for match in _TOKEN_RE.finditer(text or ''):
+        word = match.group().lower()
+        if not re.match(f'[{_CJK}]', word) or len(word) == 1:
+            tokens.append(word)
+            continue
+        tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def _fill_vectors(with_tags):
+    bind = op.get_bind()
+    select = sa.text(
+        'SELECT article.id, article.title, article.summary, article.content, '
+        "coalesce(string_agg(tag.name, ' ' ORDER BY tag.id), '') AS tags "
+        'FROM article '
+        'LEFT JOIN article_tag ON article_tag.article_id = article.id AND NOT article_tag.deleted '
+        'LEFT JOIN tag ON tag.id = article_tag.tag_id AND NOT tag.deleted '
+        'WHERE article.id > :last_id GROUP BY article.id ORDER BY article.id LIMIT :limit'
+    )
+    # 与 PostgresBackend 的权重一致：标题 A、摘要 B、正文 C、标签 D
+    vector = (
+        "setweight(to_tsvector('simple', :title), 'A') || "
+        "setweight(to_tsvector('simple', :summary), 'B') || "
+        "setweight(to_tsvector('simple', :content), 'C')"
+    )
+    if with_tags:
+        vector += " || setweight(to_tsvector('simple', :tags), 'D')"
+    update = sa.text(f'UPDATE article SET search_vector = {vector} WHERE id = :id')
+    last_id = 0
+    while True:
+        rows = bind.execute(select, last_id=last_id, limit=BATCH_SIZE).fetchall()
+        if not rows:
+            break
+        bind.execute(update, [{
+            'id': row.id,
+            'title': ' '.join(tokenize(row.title)),
+            'summary': ' '.join(tokenize(row.summary)),
+            'content': ' '.join(tokenize(row.content)),
+            'tags': ' '.join(tokenize(row.tags)),
+        } for row in rows])
+        last_id = rows[-1].id
+
+
+def upgrade():
+    # 标签重新参与检索，分批重新计算已有文章的检索向量
+    _fill_vectors(with_tags=True)
+
+
+def downgrade():
+    _fill_vectors(with_tags=False)
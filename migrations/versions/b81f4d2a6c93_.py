@@ -0,0 +1,36 @@
+"""tag and category article counts
+
+Revision ID: b81f4d2a6c93
+Revises: 3e7b1c9d5f20
+Create Date: 2026-10-18 17:12:45.630871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81f4d2a6c93'
+down_revision = '3e7b1c9d5f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('category', sa.Column('article_count', sa.Integer(), server_default='0', nullable=False, comment='文章数'))
+    op.add_column('tag', sa.Column('article_count', sa.Integer(), server_default='0', nullable=False, comment='文章数'))
+    op.execute(
+        'UPDATE category SET article_count = ('
+        'SELECT count(*) FROM article '
+        'WHERE article.category_id = category.id AND NOT article.deleted)'
+    )
+    op.execute(
+        'UPDATE tag SET article_count = ('
+        'SELECT count(*) FROM article_tag JOIN article ON article.id = article_tag.article_id '
+        'WHERE article_tag.tag_id = tag.id AND NOT article_tag.deleted AND NOT article.deleted)'
+    )
+
+
+def downgrade():
+    op.drop_column('tag', 'article_count')
+    op.drop_column('category', 'article_count')
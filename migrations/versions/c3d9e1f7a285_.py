@@ -0,0 +1,28 @@
+"""article status stored through ChoiceType
+
+Revision ID: c3d9e1f7a285
+Revises: a6f2d8c41b37
+Create Date: 2026-10-19 10:26:53.802114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d9e1f7a285'
+down_revision = 'a6f2d8c41b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 模型中 status 之前同时声明了 SmallInteger 和 ChoiceType，实际使用的是 SmallInteger，
+    # 写入 ArticleStatus 时无法转换；改为 ChoiceType 以 SmallInteger 保存枚举值，列的类型不变，
+    # 这里重新声明一次列的类型，保证各环境的库结构与模型一致
+    op.alter_column('article', 'status', existing_type=sa.SmallInteger(), type_=sa.SmallInteger(),
+                    existing_nullable=False, existing_comment='状态', postgresql_using='status::smallint')
+
+
+def downgrade():
+    pass
@@ -0,0 +1,35 @@
+"""search reconcile watermark
+
+Revision ID: fc0d40481e03
+Revises: 0b553110d16f
+Create Date: 2026-10-18 14:03:52.381026
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fc0d40481e03'
+down_revision = '0b553110d16f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('search_watermark',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False, comment='主键ID'),
+    sa.Column('created_time', sa.DateTime(), nullable=False, comment='创建时间'),
+    sa.Column('updated_time', sa.DateTime(), nullable=False, comment='最近更新时间'),
+    sa.Column('deleted', sa.Boolean(), nullable=False, comment='是否删除'),
+    sa.Column('table_name', sa.String(length=64), nullable=False, comment='表名'),
+    sa.Column('watermark', sa.DateTime(), nullable=False, comment='该时间之前的变更已同步到索引'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('table_name')
+    )
+    op.create_index('ix_article_updated_time', 'article', ['updated_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_article_updated_time', table_name='article')
+    op.drop_table('search_watermark')